@@ -0,0 +1,190 @@
+"""
+ACA bad pixel proximity check (ACA-025).
+
+The ACA bad pixel file gives row and column ranges of bad pixels.  The pixels
+are read once per file (and file size and modification time) and bucketed into a
+coarse grid of ``CELL_SIZE`` x ``CELL_SIZE`` pixel cells, so that a catalog entry
+only compares with the pixels in the cells that overlap its dither + 25 arcsec box
+instead of every bad pixel.
+"""
+
+import functools
+import os
+import re
+
+import numpy as np
+
+# Size (pixels) of the cells of the bad pixel grid
+CELL_SIZE = 16
+
+# Pixel size (arcsec) used for the bad pixel separations
+PIXEL_SCALE = 5
+
+# Bad pixel within the guide dither amplitude + BAD_PIXEL_PAD (arcsec) in y and z
+BAD_PIXEL_PAD = 25
+
+# Lines of the bad pixel file with a range: "  row0, row1, col0, col1; ..."
+RANGE_LINE = re.compile(r"\s+(\d|-)")
+
+
+class BadPixelIndex:
+    """
+    Bad pixels bucketed into a grid of cells.
+
+    :param rows: bad pixel rows
+    :param cols: bad pixel columns
+    :param cell_size: size of the grid cells (pixels)
+    """
+
+    def __init__(self, rows, cols, cell_size=CELL_SIZE):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.cell_size = cell_size
+        cells = {}
+        for idx, cell in enumerate(
+            zip(self.rows // cell_size, self.cols // cell_size, strict=True)
+        ):
+            cells.setdefault(cell, []).append(idx)
+        self.cells = {cell: np.array(idxs) for cell, idxs in cells.items()}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def read(cls, pixel_file):
+        """
+        Read the bad pixels from an ACA bad pixel file.
+
+        Each line starting with whitespace and a number gives the row range and the
+        column range of a block of bad pixels (inclusive).  Pixels are in the order
+        of the file, and by row then column within a block.
+
+        :param pixel_file: ACA bad pixel file name
+        :returns: BadPixelIndex
+        """
+        rows = []
+        cols = []
+        with open(pixel_file) as fh:
+            for line in fh:
+                if not RANGE_LINE.match(line):
+                    continue
+                row0, row1, col0, col1 = (
+                    int(val) for val in re.split("[;,]", line)[:4]
+                )
+                for row in range(row0, row1 + 1):
+                    rows.extend([row] * max(col1 - col0 + 1, 0))
+                    cols.extend(range(col0, col1 + 1))
+        return cls(rows, cols)
+
+    def get_candidates(self, row, col, drow, dcol):
+        """
+        Get the indexes of the pixels in the cells overlapping a box.
+
+        :param row: box center row
+        :param col: box center column
+        :param drow: box half-size in rows
+        :param dcol: box half-size in columns
+        :returns: sorted array of pixel indexes (a superset of the pixels in the box)
+        """
+        cell_rows = range(
+            int(np.floor((row - drow) / self.cell_size)),
+            int(np.floor((row + drow) / self.cell_size)) + 1,
+        )
+        cell_cols = range(
+            int(np.floor((col - dcol) / self.cell_size)),
+            int(np.floor((col + dcol) / self.cell_size)) + 1,
+        )
+        idxs = [
+            self.cells[cell_row, cell_col]
+            for cell_row in cell_rows
+            for cell_col in cell_cols
+            if (cell_row, cell_col) in self.cells
+        ]
+        return np.sort(np.concatenate(idxs)) if idxs else np.array([], dtype=int)
+
+    def get_closest(self, row, col, dy_max, dz_max):
+        """
+        Get the closest bad pixel within a box around (``row``, ``col``).
+
+        :param row: row of the catalog entry
+        :param col: column of the catalog entry
+        :param dy_max: separations in row have dy < dy_max (arcsec)
+        :param dz_max: separations in column have dz < dz_max (arcsec)
+        :returns: tuple of row, col, dy, dz (arcsec) of the closest bad pixel (the
+            first in file order for equal distances), or None
+        """
+        idxs = self.get_candidates(row, col, dy_max / PIXEL_SCALE, dz_max / PIXEL_SCALE)
+        dys = np.abs(row - self.rows[idxs]) * PIXEL_SCALE
+        dzs = np.abs(col - self.cols[idxs]) * PIXEL_SCALE
+        ok = (dzs < dz_max) & (dys < dy_max)
+        if not np.any(ok):
+            return None
+        idxs, dys, dzs = idxs[ok], dys[ok], dzs[ok]
+        closest = np.argmin(np.sqrt(dys**2 + dzs**2))
+        idx = idxs[closest]
+        return (
+            int(self.rows[idx]),
+            int(self.cols[idx]),
+            float(dys[closest]),
+            float(dzs[closest]),
+        )
+
+
+@functools.cache
+def _read_bad_pixels(pixel_file, size, mtime_ns):  # noqa: ARG001 (cache key only)
+    return BadPixelIndex.read(pixel_file)
+
+
+def get_bad_pixels(pixel_file):
+    """
+    Get the ``BadPixelIndex`` for ``pixel_file``.
+
+    This is read once per file, and again if the file size or modification time
+    changes (e.g. in a starcheck server daemon).
+
+    :param pixel_file: ACA bad pixel file name
+    :returns: BadPixelIndex
+    """
+    stat = os.stat(pixel_file)
+    return _read_bad_pixels(str(pixel_file), stat.st_size, stat.st_mtime_ns)
+
+
+def read_bad_pixels(pixel_file):
+    """
+    Read the ACA bad pixel file into the index.
+
+    :param pixel_file: ACA bad pixel file name
+    :returns: number of bad pixels
+    """
+    return len(get_bad_pixels(pixel_file))
+
+
+def bad_pixel_warnings(pixel_file, entries, dither_y, dither_p):
+    """
+    Get the nearby ACA bad pixel warnings for catalog entries (ACA-025).
+
+    For each entry the closest bad pixel with a y separation less than the guide
+    dither y amplitude + 25 arcsec and a z separation less than the dither z
+    amplitude + 25 arcsec gives a warning.
+
+    :param pixel_file: ACA bad pixel file name
+    :param entries: list of dict with keys idx, row and col (pixel row and column
+        of the catalog entry)
+    :param dither_y: guide dither amplitude in y (arcsec, None for 0)
+    :param dither_p: guide dither amplitude in z (arcsec, None for 0)
+    :returns: dict of str(idx) to warning for the entries with a nearby bad pixel
+    """
+    bad_pixels = get_bad_pixels(pixel_file)
+    dy_max = float(dither_y or 0) + BAD_PIXEL_PAD
+    dz_max = float(dither_p or 0) + BAD_PIXEL_PAD
+    out = {}
+    for entry in entries:
+        closest = bad_pixels.get_closest(
+            float(entry["row"]), float(entry["col"]), dy_max, dz_max
+        )
+        if closest is not None:
+            out[str(entry["idx"])] = (
+                "[%2d] Nearby ACA bad pixel.  row, col (%d, %d), dy, dz (%d, %d) \n"
+                % (entry["idx"], *closest)
+            )
+    return out
@@ -33,6 +33,7 @@ from ska_matplotlib import cxctime2plotdate as cxc2pd
 from ska_matplotlib import lineid_plot
 
 from starcheck import __version__ as version
+from starcheck import plot_cache, plot_queue
 
 MSID = {"aca": "AACCCDPT"}
 TASK_DATA = os.path.dirname(__file__)
@@ -238,13 +239,32 @@ def get_ccd_temps(  # noqa: PLR0915 Too many statements
             states, stat=None if use_maude else "5min"
         )
 
-    make_check_plots(
+    # Make the thermal plot in the plot queue (see starcheck.plot_queue), which
+    # can be in another process, so log here and once the plot file is written.
+    # The plot is cached by everything that goes into it (see
+    # starcheck.plot_cache).
+    outfile = os.path.join(outdir, MSID_PLOT_NAME["aca"])
+    logger.info("Making temperature check plots")
+    plot_key = plot_cache.get_plot_key(
+        "ccd_temperature",
+        *(np.asarray(states[name]) for name in ("tstart", "tstop", "pitch", "obsid")),
+        np.asarray(ccd_times),
+        np.asarray(ccd_temps),
+        bs_start.secs,
+        sched_stop.secs,
+        chandra_models_version(),
+    )
+    plot_queue.submit_cached_plot(
+        plot_key,
+        outfile,
+        make_check_plots,
         outdir,
         states,
         ccd_times,
         ccd_temps,
         tstart=bs_start.secs,
         tstop=sched_stop.secs,
+        on_success=functools.partial(logger.info, "Writing plot file %s", outfile),
     )
     intervals = get_obs_intervals(sc_obsids)
     obsreqs = None if orlist is None else read_or_list_full(orlist)[0]
@@ -584,8 +604,6 @@ def make_check_plots(outdir, states, times, temps, tstart, tstop):
             id_xs.append(cxc2pd([s1["tstart"]])[0])
             id_labels.append(str(s1["obsid"]))
 
-    logger.info("Making temperature check plots")
-
     for fig_id, msid in enumerate(("aca",)):
         temp_ymax = max(aca_t_ccd_planning_limit(), np.max(temps))
         temp_ymin = min(aca_t_ccd_planning_limit() - 1, np.min(temps))
@@ -650,7 +668,6 @@ def make_check_plots(outdir, states, times, temps, tstart, tstop):
 
         filename = MSID_PLOT_NAME[msid]
         outfile = os.path.join(outdir, filename)
-        logger.info("Writing plot file %s" % outfile)
         plots[msid]["fig"].savefig(outfile)
         plots[msid]["filename"] = filename
 
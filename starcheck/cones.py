@@ -0,0 +1,434 @@
+"""
+AGASC star cones for observations, kept in the starcheck server.
+
+The Perl side calls ``get_cone`` once per observation to fetch the cone of AGASC
+stars around the target attitude and gets back a small handle.  Checks then ask
+for just the stars they need (by id, near a position, or brighter than a
+magnitude) instead of holding a copy of every star in the cone.
+
+Stars are returned as dicts of plain Python types with the keys used by the
+Perl code (id, class, ra, dec, mag_aca, bv, color1, mag_aca_err, poserr, yag,
+zag, aspq, var, aspq1).
+
+The AGASC is read once per attitude, date and AGASC file in a run (see
+``get_cone_stars``), and the checks and the plots (``starcheck.plot``) both get
+their stars from that cone.  proseco (``starcheck.utils.proseco_probs``) fetches
+its own stars, so the acq probabilities use proseco's own AGASC selection.
+"""
+
+import collections
+import threading
+
+import agasc
+import numpy as np
+import Quaternion
+from agasc.agasc import add_pmcorr_columns
+from ska_quatutil import radec2yagzag
+
+# Radius (deg) of the cone read from the AGASC for an attitude.  The checks
+# and plots both use views of this cone at the same or a smaller radius.
+CONE_RADIUS = 1.5
+
+# Attitudes within this distance (deg) of the first attitude of a cluster share
+# one AGASC read in prefetch_cones()
+CLUSTER_RADIUS = 0.5
+
+# Extra radius (deg) read for a cluster to cover the proper motion of stars
+# between the read date and the date of each attitude
+PM_PAD = 0.1
+
+# AGASC cones for the current run keyed by (ra, dec, roll, date, agasc_file), and
+# counts of the AGASC reads and of the cone cache hits.
+CONE_CACHE = {}
+CONE_STATS = collections.Counter()
+CONE_CACHE_LOCK = threading.Lock()
+
+# Cones of stars for observations by handle, and for identify_stars() the cone
+# stars sorted by yag (made on first use for a cone)
+CONES = {}
+CONE_YAG_INDEXES = {}
+CONES_LOCK = threading.Lock()
+
+
+def get_cone_key(ra, dec, roll, date, agasc_file):
+    """Get the key of the cone for an attitude in ``CONE_CACHE``"""
+    return (
+        float(ra),
+        float(dec),
+        float(roll),
+        str(date),
+        None if agasc_file is None else str(agasc_file),
+    )
+
+
+def add_yag_zag(stars, ra, dec, roll):
+    """Add the yang and zang (arcsec) of ``stars`` for attitude (ra, dec, roll)"""
+    q_aca = Quaternion.Quat([float(ra), float(dec), float(roll)])
+    yags, zags = radec2yagzag(stars["RA_PMCORR"], stars["DEC_PMCORR"], q_aca)
+    stars["yang"] = yags * 3600
+    stars["zang"] = zags * 3600
+
+
+def read_cone_stars(ra, dec, roll, radius, *, date, agasc_file):
+    """
+    Read the cone of AGASC stars and add the yang and zang of each star.
+
+    :param ra: RA of the attitude (deg)
+    :param dec: Dec of the attitude (deg)
+    :param roll: roll of the attitude (deg)
+    :param radius: cone radius (deg)
+    :param date: date for proper motion correction
+    :param agasc_file: AGASC file name
+    :returns: Table of stars with yang and zang (arcsec)
+    """
+    stars = agasc.get_agasc_cone(
+        float(ra),
+        float(dec),
+        float(radius),
+        date,
+        agasc_file,
+    )
+    CONE_STATS["reads"] += 1
+    add_yag_zag(stars, ra, dec, roll)
+    return stars
+
+
+def get_cone_stars(ra, dec, roll, radius, *, date, agasc_file):
+    """
+    Get the cone of AGASC stars with the yang and zang of each star.
+
+    The AGASC is read once per (ra, dec, roll, date, agasc_file) for the run at
+    ``CONE_RADIUS`` (or taken from the cones read by ``prefetch_cones``), and the
+    stars within ``radius`` are selected from that in the same way as
+    ``agasc.get_agasc_cone`` (distance of the proper motion corrected position
+    <= radius).
+
+    :param ra: RA of the attitude (deg)
+    :param dec: Dec of the attitude (deg)
+    :param roll: roll of the attitude (deg)
+    :param radius: cone radius (deg)
+    :param date: date for proper motion correction
+    :param agasc_file: AGASC file name
+    :returns: Table of stars with yang and zang (arcsec)
+    """
+    if float(radius) > CONE_RADIUS:
+        return read_cone_stars(ra, dec, roll, radius, date=date, agasc_file=agasc_file)
+
+    key = get_cone_key(ra, dec, roll, date, agasc_file)
+    with CONE_CACHE_LOCK:
+        if key in CONE_CACHE:
+            CONE_STATS["hits"] += 1
+        else:
+            CONE_CACHE[key] = read_cone_stars(
+                ra, dec, roll, CONE_RADIUS, date=date, agasc_file=agasc_file
+            )
+        stars = CONE_CACHE[key]
+    return select_radius(stars, ra, dec, radius)
+
+
+def select_radius(stars, ra, dec, radius):
+    """Get the ``stars`` with PM-corrected positions within ``radius`` of (ra, dec)"""
+    dists = agasc.sphere_dist(
+        float(ra), float(dec), stars["RA_PMCORR"], stars["DEC_PMCORR"]
+    )
+    return stars[dists <= float(radius)]
+
+
+def cluster_attitudes(attitudes, cluster_radius=CLUSTER_RADIUS):
+    """
+    Group attitudes whose pointings are within ``cluster_radius`` of each other.
+
+    Each attitude joins the nearest cluster whose first attitude is within
+    ``cluster_radius``, otherwise it starts a new cluster.
+
+    :param attitudes: list of (ra, dec, ...) with ra and dec in deg
+    :param cluster_radius: cluster radius (deg)
+    :returns: list of clusters, each a list of indexes into ``attitudes``
+    """
+    clusters = []
+    center_ras = []
+    center_decs = []
+    for idx, (ra, dec, *_) in enumerate(attitudes):
+        if clusters:
+            dists = agasc.sphere_dist(float(ra), float(dec), center_ras, center_decs)
+            nearest = int(np.argmin(dists))
+            if dists[nearest] <= cluster_radius:
+                clusters[nearest].append(idx)
+                continue
+        clusters.append([idx])
+        center_ras.append(float(ra))
+        center_decs.append(float(dec))
+    return clusters
+
+
+def prefetch_cones(attitudes, agasc_file):
+    """
+    Read the AGASC cones for many attitudes (e.g. all observations in a week).
+
+    Attitudes are grouped with ``cluster_attitudes`` and each group with more
+    than one attitude is read from the AGASC as one cone large enough to cover
+    all of them.  The cone for each attitude is then selected from that, with the
+    proper motion correction for its own date, and put in ``CONE_CACHE`` for
+    ``get_cone_stars``.
+
+    :param attitudes: list of (ra, dec, roll, date) for each observation
+    :param agasc_file: AGASC file name
+    :returns: dict with keys n_cones (new cones), n_clusters and reads (AGASC reads)
+    """
+    reads0 = CONE_STATS["reads"]
+    with CONE_CACHE_LOCK:
+        keys = {}
+        for ra, dec, roll, date in attitudes:
+            key = get_cone_key(ra, dec, roll, date, agasc_file)
+            if key not in CONE_CACHE:
+                keys[key] = key[:4]
+        atts = list(keys.values())
+        clusters = cluster_attitudes(atts)
+        for cluster in clusters:
+            members = [atts[idx] for idx in cluster]
+            for (ra, dec, roll, date), stars in zip(
+                members, read_cluster_cones(members, agasc_file), strict=True
+            ):
+                key = get_cone_key(ra, dec, roll, date, agasc_file)
+                CONE_CACHE[key] = stars
+
+    return {
+        "n_cones": len(atts),
+        "n_clusters": len(clusters),
+        "reads": CONE_STATS["reads"] - reads0,
+    }
+
+
+def read_cluster_cones(attitudes, agasc_file):
+    """
+    Read the cones of a cluster of attitudes with one AGASC read.
+
+    :param attitudes: list of (ra, dec, roll, date) (ra, dec, roll as float)
+    :param agasc_file: AGASC file name
+    :returns: list of Table of stars within ``CONE_RADIUS`` for each attitude
+    """
+    if len(attitudes) == 1:
+        ra, dec, roll, date = attitudes[0]
+        return [
+            read_cone_stars(
+                ra, dec, roll, CONE_RADIUS, date=date, agasc_file=agasc_file
+            )
+        ]
+
+    ra0, dec0, _, date0 = attitudes[0]
+    ras = [att[0] for att in attitudes]
+    decs = [att[1] for att in attitudes]
+    radius = CONE_RADIUS + np.max(agasc.sphere_dist(ra0, dec0, ras, decs)) + PM_PAD
+    stars = agasc.get_agasc_cone(ra0, dec0, float(radius), date0, agasc_file)
+    CONE_STATS["reads"] += 1
+
+    att_cones = []
+    for ra, dec, roll, date in attitudes:
+        att_stars = stars.copy()
+        att_stars.remove_columns(["RA_PMCORR", "DEC_PMCORR"])
+        add_pmcorr_columns(att_stars, date)
+        att_stars = select_radius(att_stars, ra, dec, CONE_RADIUS)
+        add_yag_zag(att_stars, ra, dec, roll)
+        att_cones.append(att_stars)
+    return att_cones
+
+
+def get_cone_stats():
+    """
+    Get the AGASC cone cache statistics for the run.
+
+    :returns: dict with keys reads (AGASC reads), hits (cone cache hits) and
+        n_cones (cones in the cache)
+    """
+    with CONE_CACHE_LOCK:
+        return {
+            "reads": CONE_STATS["reads"],
+            "hits": CONE_STATS["hits"],
+            "n_cones": len(CONE_CACHE),
+        }
+
+
+def star_to_dict(star):
+    """Convert one row of a cone stars table to a dict of simple Python types"""
+    return {
+        "id": int(star["AGASC_ID"]),
+        "class": int(star["CLASS"]),
+        "ra": float(star["RA_PMCORR"]),
+        "dec": float(star["DEC_PMCORR"]),
+        "mag_aca": float(star["MAG_ACA"]),
+        "bv": float(star["COLOR1"]),
+        "color1": float(star["COLOR1"]),
+        "mag_aca_err": float(star["MAG_ACA_ERR"]),
+        "poserr": float(star["POS_ERR"]),
+        "yag": float(star["yang"]),
+        "zag": float(star["zang"]),
+        "aspq": int(star["ASPQ1"]),
+        "var": int(star["VAR"]),
+        "aspq1": int(star["ASPQ1"]),
+    }
+
+
+def stars_to_dicts(stars):
+    return [star_to_dict(star) for star in stars]
+
+
+def get_cone(handle, ra, dec, roll, radius, *, date, agasc_file, bad_mag_limit=-10):
+    """
+    Fetch the cone of AGASC stars for an observation and keep it as ``handle``.
+
+    :param handle: name for the cone (e.g. the observation id)
+    :param ra: RA of the attitude (deg)
+    :param dec: Dec of the attitude (deg)
+    :param roll: roll of the attitude (deg)
+    :param radius: cone radius (deg)
+    :param date: date for proper motion correction
+    :param agasc_file: AGASC file name
+    :param bad_mag_limit: stars with MAG_ACA or MAG_ACA_ERR below this are
+        returned in ``bad_mag_stars``
+    :returns: dict with keys handle, n_stars, and bad_mag_stars (list of star dicts)
+    """
+    handle = str(handle)
+    stars = get_cone_stars(ra, dec, roll, radius, date=date, agasc_file=agasc_file)
+    with CONES_LOCK:
+        CONES[handle] = stars
+    bad = (stars["MAG_ACA"] < bad_mag_limit) | (stars["MAG_ACA_ERR"] < bad_mag_limit)
+    return {
+        "handle": handle,
+        "n_stars": len(stars),
+        "bad_mag_stars": stars_to_dicts(stars[bad]),
+    }
+
+
+def get_stars(handle):
+    """Get the cone stars table for ``handle``"""
+    with CONES_LOCK:
+        try:
+            return CONES[str(handle)]
+        except KeyError:
+            raise KeyError(f"no AGASC cone with handle {handle!r}") from None
+
+
+def get_stars_by_id(handle, star_ids):
+    """
+    Get the stars in the cone with ids in ``star_ids``.
+
+    :param handle: cone handle
+    :param star_ids: list of AGASC ids (int or str)
+    :returns: dict of str(AGASC id) to star dict for the ids found in the cone
+    """
+    stars = get_stars(handle)
+    ids = np.array([int(star_id) for star_id in star_ids], dtype=np.int64)
+    ok = np.isin(stars["AGASC_ID"], ids)
+    return {str(star["id"]): star for star in stars_to_dicts(stars[ok])}
+
+
+def get_stars_near(handle, yag, zag, dy_max=None, dz_max=None):
+    """
+    Get the stars in the cone within a box around (``yag``, ``zag``).
+
+    :param handle: cone handle
+    :param yag: y-angle of the box center (arcsec)
+    :param zag: z-angle of the box center (arcsec)
+    :param dy_max: stars have abs(dy) < dy_max (arcsec, None for no limit)
+    :param dz_max: stars have abs(dz) < dz_max (arcsec, None for no limit)
+    :returns: list of star dicts sorted by distance from (yag, zag)
+    """
+    stars = get_stars(handle)
+    dy = np.abs(stars["yang"] - float(yag))
+    dz = np.abs(stars["zang"] - float(zag))
+    ok = np.ones(len(stars), dtype=bool)
+    if dy_max is not None:
+        ok &= dy < float(dy_max)
+    if dz_max is not None:
+        ok &= dz < float(dz_max)
+    idxs = np.flatnonzero(ok)
+    idxs = idxs[np.argsort(dy[idxs] ** 2 + dz[idxs] ** 2, kind="stable")]
+    return stars_to_dicts(stars[idxs])
+
+
+def get_yag_index(handle):
+    """
+    Get the cone stars for ``handle`` and their order by yag.
+
+    :param handle: cone handle
+    :returns: stars table, indexes of the stars sorted by yag, sorted yags
+    """
+    stars = get_stars(handle)
+    with CONES_LOCK:
+        index = CONE_YAG_INDEXES.get(str(handle))
+        if index is None or index[0] is not stars:
+            yags = np.asarray(stars["yang"], dtype=np.float64)
+            order = np.argsort(yags, kind="stable")
+            index = (stars, order, yags[order])
+            CONE_YAG_INDEXES[str(handle)] = index
+    return index
+
+
+def identify_stars(handle, positions, dist_limit):
+    """
+    Identify catalog entries with stars in the cone by position.
+
+    The matches for a position are the stars with abs(dy) and abs(dz) less than
+    ``dist_limit``, and the identified star is the closest match (the first star
+    from ``get_stars_near`` with that box).  Candidates are found by bisection
+    of the stars sorted by yag, so this does not scan the cone per entry.
+
+    :param handle: cone handle
+    :param positions: list of (yag, zag) (arcsec)
+    :param dist_limit: identification box half-size (arcsec)
+    :returns: list (one per position) of dict with keys star (star dict of the
+        closest match, or None), n_matches, and ambiguous (more than one match)
+    """
+    stars, order, sorted_yags = get_yag_index(handle)
+    dist_limit = float(dist_limit)
+    out = []
+    for position in positions:
+        yag, zag = (float(val) for val in position)
+        i0 = np.searchsorted(sorted_yags, yag - dist_limit, side="left")
+        i1 = np.searchsorted(sorted_yags, yag + dist_limit, side="right")
+        idxs = np.sort(order[i0:i1])
+        dy = np.abs(np.asarray(stars["yang"][idxs], dtype=np.float64) - yag)
+        dz = np.abs(np.asarray(stars["zang"][idxs], dtype=np.float64) - zag)
+        ok = (dy < dist_limit) & (dz < dist_limit)
+        idxs, dy, dz = idxs[ok], dy[ok], dz[ok]
+        star = None
+        if len(idxs) > 0:
+            star = star_to_dict(stars[idxs[np.argmin(dy**2 + dz**2)]])
+        out.append(
+            {"star": star, "n_matches": len(idxs), "ambiguous": bool(len(idxs) > 1)}
+        )
+    return out
+
+
+def get_stars_brighter(handle, mag, max_stars=None):
+    """
+    Get the stars in the cone with MAG_ACA <= ``mag``.
+
+    :param handle: cone handle
+    :param mag: faint magnitude limit
+    :param max_stars: maximum number of stars to return (None for all)
+    :returns: list of star dicts sorted by MAG_ACA (brightest first)
+    """
+    stars = get_stars(handle)
+    idxs = np.flatnonzero(stars["MAG_ACA"] <= float(mag))
+    idxs = idxs[np.argsort(stars["MAG_ACA"][idxs], kind="stable")]
+    if max_stars is not None:
+        idxs = idxs[: int(max_stars)]
+    return stars_to_dicts(stars[idxs])
+
+
+def release_cone(handle):
+    """Drop the cone for ``handle``"""
+    with CONES_LOCK:
+        CONES.pop(str(handle), None)
+        CONE_YAG_INDEXES.pop(str(handle), None)
+
+
+def clear_cones():
+    """Drop all cones and the cone cache (e.g. at the end of a starcheck run)"""
+    with CONES_LOCK:
+        CONES.clear()
+        CONE_YAG_INDEXES.clear()
+    with CONE_CACHE_LOCK:
+        CONE_CACHE.clear()
+        CONE_STATS.clear()
@@ -0,0 +1,233 @@
+"""
+ACA dark calibration images for the hot pixel check, cached in the server.
+
+Almost every observation in a load resolves to the same dark cal, so the image
+is held once per dark cal (``get_dark_cal``) instead of being read from the mica
+dark cal archive for every observation.  The image is also written to an on-disk
+cache of ``.npy`` files (see ``get_cache_dir``) and memory-mapped from there, so
+several starcheck server processes share the same pages.  Both caches are keyed
+by the dark cal id and the identity of its files in the mica archive (see
+``get_dark_cal_key``), so a reprocessed dark cal is read again.  The key of each
+dark cal is worked out once per run and dropped by ``clear_dark_cal_keys``.
+
+The images scaled to a t_ccd with ``chandra_aca.dark_model.dark_temp_scale``
+are kept per dark cal and t_ccd rounded to ``T_CCD_DECIMALS`` in a least
+recently used cache limited to ``SCALED_MAX_BYTES`` (``get_scaled_dark``).
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+from chandra_aca.aca_image import ACAImage
+from chandra_aca.dark_model import dark_temp_scale
+
+logger = logging.getLogger(__name__)
+
+# Dark cal images held in memory, least recently used dropped first
+MAX_DARK_CALS = 4
+
+# Memory budget (bytes) of the scaled dark cal images
+SCALED_MAX_BYTES = 256 * 1024**2
+
+# Decimals of the t_ccd (degC) used as the key of the scaled images
+T_CCD_DECIMALS = 2
+
+# Dark cal key by dark cal id for the run, dark cal (props, image) by dark cal key,
+# scaled images by (dark cal key, rounded t_ccd), and counts of cache hits and
+# misses.
+DARK_CAL_KEYS = {}
+DARK_CALS = collections.OrderedDict()
+SCALED_DARKS = collections.OrderedDict()
+DARK_CAL_STATS = collections.Counter()
+DARK_CAL_LOCK = threading.Lock()
+
+
+def get_cache_dir():
+    """
+    Get the directory of the dark cal image cache.
+
+    This is ``$STARCHECK_DARK_CAL_CACHE`` if set, else ``starcheck/dark_cal`` in
+    ``$XDG_CACHE_HOME`` (default ``~/.cache``).  Set ``STARCHECK_DARK_CAL_CACHE``
+    to an empty string to disable the cache.
+
+    :returns: Path or None if the cache is disabled
+    """
+    cache_dir = os.environ.get("STARCHECK_DARK_CAL_CACHE")
+    if cache_dir is not None:
+        return Path(cache_dir) if cache_dir else None
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "starcheck" / "dark_cal"
+
+
+def get_dark_cal_key(dark_id):
+    """
+    Get the cache key of dark cal ``dark_id``.
+
+    The key is the dark cal id and a hash of the name, size and modification time
+    of each file in its mica dark cal directory, like the source file signatures
+    of the mica stats cache (``starcheck.mica_stats``).
+
+    :param dark_id: dark cal id
+    :returns: str key
+    """
+    from mica.archive.aca_dark.dark_cal import get_dark_cal_dirs
+
+    digest = hashlib.sha256()
+    for path in sorted(Path(get_dark_cal_dirs()[dark_id]).iterdir()):
+        stat = path.stat()
+        digest.update(json.dumps([path.name, stat.st_size, stat.st_mtime_ns]).encode())
+    return f"{dark_id}-{digest.hexdigest()[:16]}"
+
+
+def read_image(dark_id, key, date, cache_dir):
+    """
+    Read the dark cal image for ``dark_id``.
+
+    The image is memory-mapped from the cache if it is there, else it is read from
+    the mica dark cal archive and written to the cache.  Cached images of earlier
+    versions of the same dark cal are then removed.
+
+    :param dark_id: dark cal id
+    :param key: dark cal key (from get_dark_cal_key)
+    :param date: date that resolves to ``dark_id``
+    :param cache_dir: cache directory (None to not use the cache)
+    :returns: ACAImage
+    """
+    from mica.archive import aca_dark
+
+    path = None if cache_dir is None else cache_dir / f"{key}.npy"
+    if path is not None and path.exists():
+        try:
+            image = np.load(path, mmap_mode="r")
+            return ACAImage(image, copy=False, row0=-512, col0=-512)
+        except Exception as err:
+            logger.warning(f"failed to read dark cal cache {path}: {err}")
+
+    image = aca_dark.get_dark_cal_props(date, include_image=True, aca_image=True)[
+        "image"
+    ]
+    if path is not None:
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=cache_dir, suffix=".npy", delete=False
+            ) as fh:
+                np.save(fh, np.asarray(image))
+            os.replace(fh.name, path)
+            for old_path in cache_dir.glob(f"{dark_id}-*.npy"):
+                if old_path != path:
+                    old_path.unlink(missing_ok=True)
+        except OSError as err:
+            logger.warning(f"failed to write dark cal cache {path}: {err}")
+    return image
+
+
+def get_dark_cal(date):
+    """
+    Get the properties and image of the dark cal before ``date``.
+
+    :param date: date
+    :returns: tuple of (dark cal props without the image, with the dark cal id
+        and key added, ACAImage)
+    """
+    from mica.archive import aca_dark
+
+    dark_id = aca_dark.get_dark_cal_id(date)
+    with DARK_CAL_LOCK:
+        # Only look at the dark cal files the first time in the run
+        key = DARK_CAL_KEYS.get(dark_id)
+        if key is None:
+            key = DARK_CAL_KEYS[dark_id] = get_dark_cal_key(dark_id)
+        if key in DARK_CALS:
+            DARK_CAL_STATS["hits"] += 1
+            DARK_CALS.move_to_end(key)
+            return DARK_CALS[key]
+
+        DARK_CAL_STATS["misses"] += 1
+        props = aca_dark.get_dark_cal_props(date)
+        props["id"] = dark_id
+        props["key"] = key
+        image = read_image(dark_id, key, date, get_cache_dir())
+        DARK_CALS[key] = props, image
+        while len(DARK_CALS) > MAX_DARK_CALS:
+            DARK_CALS.popitem(last=False)
+        return props, image
+
+
+def get_scaled_dark(date, t_ccd):
+    """
+    Get the dark cal image before ``date`` scaled to ``t_ccd``.
+
+    The scale is for ``t_ccd`` rounded to ``T_CCD_DECIMALS``, so observations
+    with about the same t_ccd share one scaled image.
+
+    :param date: date
+    :param t_ccd: CCD temperature (degC)
+    :returns: tuple of (dark cal props without the image, scaled ACAImage)
+    """
+    props, image = get_dark_cal(date)
+    t_ccd = round(float(t_ccd), T_CCD_DECIMALS)
+    key = (props["key"], t_ccd)
+    with DARK_CAL_LOCK:
+        if key in SCALED_DARKS:
+            DARK_CAL_STATS["scaled_hits"] += 1
+            SCALED_DARKS.move_to_end(key)
+            return props, SCALED_DARKS[key]
+
+        DARK_CAL_STATS["scaled_misses"] += 1
+        scaled = image * dark_temp_scale(props["ccd_temp"], t_ccd)
+        SCALED_DARKS[key] = scaled
+        while (
+            len(SCALED_DARKS) > 1
+            and sum(img.nbytes for img in SCALED_DARKS.values()) > SCALED_MAX_BYTES
+        ):
+            SCALED_DARKS.popitem(last=False)
+            DARK_CAL_STATS["scaled_evictions"] += 1
+        return props, scaled
+
+
+def get_dark_cal_stats():
+    """
+    Get the dark cal cache statistics.
+
+    :returns: dict with keys hits and misses (dark cal images), scaled_hits,
+        scaled_misses and scaled_evictions (scaled images), n_dark_cals,
+        n_scaled and scaled_bytes
+    """
+    with DARK_CAL_LOCK:
+        stats = {
+            key: DARK_CAL_STATS[key]
+            for key in (
+                "hits",
+                "misses",
+                "scaled_hits",
+                "scaled_misses",
+                "scaled_evictions",
+            )
+        }
+        stats["n_dark_cals"] = len(DARK_CALS)
+        stats["n_scaled"] = len(SCALED_DARKS)
+        stats["scaled_bytes"] = sum(img.nbytes for img in SCALED_DARKS.values())
+    return stats
+
+
+def clear_dark_cal_keys():
+    """Drop the dark cal keys (e.g. at the end of a starcheck run)"""
+    with DARK_CAL_LOCK:
+        DARK_CAL_KEYS.clear()
+
+
+def clear_dark_cals():
+    """Drop all cached dark cal images and reset the statistics"""
+    with DARK_CAL_LOCK:
+        DARK_CAL_KEYS.clear()
+        DARK_CALS.clear()
+        SCALED_DARKS.clear()
+        DARK_CAL_STATS.clear()
@@ -0,0 +1,154 @@
+"""
+Acquisition magnitude limits from a precomputed surface of the acquisition model.
+
+``chandra_aca.star_probs.mag_for_p_acq`` finds the mag with a given acquisition
+probability with a root finder on the acquisition model, which is slow for
+every observation.  Here the model probability is evaluated once (vectorized)
+on a grid of mag and t_ccd at date nodes every ``DATE_STEP`` days, the first time
+a date near that node is used in the server.  The mag for a probability is then
+found by linear interpolation of that surface along mag, t_ccd and date.
+
+Within ``T_CCD_MIN`` to ``T_CCD_MAX`` the result is within ``MAG_ERROR`` of
+``mag_for_p_acq`` (which itself solves to about 1e-4 mag).  Outside that range of
+t_ccd the exact solver is used.
+"""
+
+import functools
+import threading
+
+import numpy as np
+from chandra_aca.star_probs import acq_success_prob
+from chandra_aca.star_probs import mag_for_p_acq as mag_for_p_acq_exact
+from cxotime import CxoTime
+
+# Mag range searched by mag_for_p_acq, and step of the surface along mag
+MAG_MIN = 5.0
+MAG_MAX = 12.0
+MAG_STEP = 0.01
+
+# t_ccd range (degC) and step of the surface along t_ccd
+T_CCD_MIN = -25.0
+T_CCD_MAX = 5.0
+T_CCD_STEP = 0.1
+
+# Days between the date nodes of the surface
+DATE_STEP = 30
+
+# Maximum difference (mag) from mag_for_p_acq within the t_ccd range
+MAG_ERROR = 0.002
+
+# Acquisition probabilities of the faint mag limits (yellow and red)
+P_ACQ_YELLOW = 0.75
+P_ACQ_RED = 0.5
+
+MAGS = np.linspace(MAG_MIN, MAG_MAX, round((MAG_MAX - MAG_MIN) / MAG_STEP) + 1)
+T_CCDS = np.linspace(
+    T_CCD_MIN, T_CCD_MAX, round((T_CCD_MAX - T_CCD_MIN) / T_CCD_STEP) + 1
+)
+
+SURFACE_LOCK = threading.Lock()
+
+
+@functools.cache
+def _get_surface(node):
+    date = CxoTime(node * DATE_STEP * 86400.0).date
+    probs = acq_success_prob(date=date, t_ccd=T_CCDS[None, :], mag=MAGS[:, None])
+    return np.asarray(probs, dtype=np.float64)
+
+
+def get_surface(node):
+    """
+    Get the acquisition probability surface for a date node.
+
+    :param node: date node (CXC seconds / ``DATE_STEP`` days, int)
+    :returns: array of acquisition probability (len(MAGS), len(T_CCDS))
+    """
+    with SURFACE_LOCK:
+        return _get_surface(int(node))
+
+
+def invert_columns(probs, p_acqs):
+    """
+    Get the mag where each column of ``probs`` (decreasing with mag) is ``p_acq``.
+
+    As for mag_for_p_acq, this is MAG_MIN if the probability at MAG_MIN is already
+    at or below ``p_acq`` and MAG_MAX if the probability at MAG_MAX is still at or
+    above ``p_acq``.
+
+    :param probs: array (n, len(MAGS)) of probabilities for n queries
+    :param p_acqs: array (n,) of acquisition probabilities
+    :returns: array (n,) of mags
+    """
+    p_acqs = p_acqs[:, None]
+    # First mag index with prob <= p_acq (len(MAGS) if none)
+    below = probs <= p_acqs
+    idx1 = np.where(below.any(axis=1), below.argmax(axis=1), len(MAGS))
+    idx0 = np.clip(idx1 - 1, 0, len(MAGS) - 1)
+    idx1 = np.clip(idx1, 0, len(MAGS) - 1)
+    rows = np.arange(len(probs))
+    p0 = probs[rows, idx0]
+    p1 = probs[rows, idx1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(p0 != p1, (p0 - p_acqs[:, 0]) / (p0 - p1), 0.0)
+    mags = MAGS[idx0] + np.clip(frac, 0.0, 1.0) * (MAGS[idx1] - MAGS[idx0])
+    mags[probs[:, -1] >= p_acqs[:, 0]] = MAG_MAX
+    mags[probs[:, 0] <= p_acqs[:, 0]] = MAG_MIN
+    return mags
+
+
+def mag_for_p_acq(p_acqs, dates, t_ccds):
+    """
+    Get the star mag with acquisition probability ``p_acq`` for many observations.
+
+    This is ``chandra_aca.star_probs.mag_for_p_acq`` (default halfwidth and
+    model) from the precomputed surface, to within ``MAG_ERROR`` mag.
+
+    :param p_acqs: list of acquisition probabilities
+    :param dates: list of dates
+    :param t_ccds: list of t_ccd (degC)
+    :returns: list of mags (float)
+    """
+    p_acqs = np.asarray(p_acqs, dtype=np.float64)
+    t_ccds = np.asarray(t_ccds, dtype=np.float64)
+    if len(p_acqs) == 0:
+        return []
+    days = np.atleast_1d(CxoTime(dates).secs) / 86400.0
+    nodes = np.floor(days / DATE_STEP).astype(int)
+    date_fracs = days / DATE_STEP - nodes
+    t_idx = np.clip(
+        np.floor((t_ccds - T_CCD_MIN) / T_CCD_STEP).astype(int), 0, len(T_CCDS) - 2
+    )
+    t_fracs = (t_ccds - T_CCDS[t_idx]) / T_CCD_STEP
+
+    mags = np.zeros(len(p_acqs))
+    for node in np.unique(nodes):
+        ok = nodes == node
+        for dnode, date_wt in ((0, 1 - date_fracs[ok]), (1, date_fracs[ok])):
+            surface = get_surface(node + dnode)
+            for dt, t_wt in ((0, 1 - t_fracs[ok]), (1, t_fracs[ok])):
+                col_mags = invert_columns(surface[:, t_idx[ok] + dt].T, p_acqs[ok])
+                mags[ok] += date_wt * t_wt * col_mags
+
+    # Exact solver outside the t_ccd range of the surface
+    for idx in np.flatnonzero((t_ccds < T_CCD_MIN) | (t_ccds > T_CCD_MAX)):
+        date = np.atleast_1d(dates)[idx]
+        mags[idx] = mag_for_p_acq_exact(float(p_acqs[idx]), date, float(t_ccds[idx]))
+    return mags.tolist()
+
+
+def get_acq_mag_limits(dates, t_ccds):
+    """
+    Get the faint acquisition mag limits for many observations in one call.
+
+    :param dates: list of dates
+    :param t_ccds: list of acquisition t_ccd (degC)
+    :returns: dict with keys yellow (mag for p_acq of ``P_ACQ_YELLOW``) and red
+        (mag for p_acq of ``P_ACQ_RED``), each a list of mags
+    """
+    n_obs = len(t_ccds)
+    mags = mag_for_p_acq(
+        [P_ACQ_YELLOW] * n_obs + [P_ACQ_RED] * n_obs,
+        list(dates) * 2,
+        list(t_ccds) * 2,
+    )
+    return {"yellow": mags[:n_obs], "red": mags[n_obs:]}
@@ -0,0 +1,537 @@
+"""
+Acquisition and guide star history from the mica acq and guide stats.
+
+The mica stats tables are loaded on first use and indexed by star: each table
+is sorted by (agasc_id, time) and the start row of each agasc_id is kept, so
+the history of one star before a given time is found with two binary searches
+instead of a scan over the full tables.
+
+Only the columns needed for the star history are kept (the mags as float64, so
+avg_mag is the same as from the mica tables), and they are written to an on-disk
+cache of ``.npy`` files (see ``get_cache_dir``).  Later loads memory-map the cache
+instead of reading the mica tables, so several starcheck server processes share
+the same pages.  The cache is rebuilt when the size or modification time of the
+mica stats files changes, unless their SHA-256 hash is unchanged.  Processes lock
+the cache (see ``cache_lock``) so that a rebuild never removes arrays that another
+process is opening.
+"""
+
+import contextlib
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import mica.stats.acq_stats
+import mica.stats.guide_stats
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Mag used for avg_mag of a star with no observed mags
+DEFAULT_AVG_MAG = 13.94
+
+# Version of the cache format, bump when changing STATS_ARRAYS or their meaning
+CACHE_VERSION = 2
+
+# Arrays of StarStats and their dtypes.  The acq and guide rows are sorted by
+# (agasc_id, time), with the unique ids and their start rows in *_ids and *_starts.
+STATS_ARRAYS = {
+    "acq_ids": np.int64,
+    "acq_starts": np.int64,
+    "acq_times": np.float64,
+    "acq_star": np.bool_,  # img_func == "star"
+    "acq_mag": np.float64,  # mag_obs
+    "guide_ids": np.int64,
+    "guide_starts": np.int64,
+    "guide_times": np.float64,
+    "guide_mag": np.float64,  # aoacmag_mean
+    "guide_bad": np.bool_,  # f_track < 0.95
+    "guide_fail": np.bool_,  # f_track < 0.01
+    "guide_obc_bad": np.bool_,  # f_obc_bad > 0.05
+}
+
+MICA_STATS_LOCK = threading.Lock()
+
+
+class StarIndex:
+    """
+    Rows of a table sorted by (agasc_id, time) with the start row of each star.
+
+    :param ids: sorted unique AGASC ids
+    :param starts: start row of each id, with the number of rows appended
+    :param times: times (CXC secs) of the sorted rows
+    """
+
+    def __init__(self, ids, starts, times):
+        self.ids = ids
+        self.starts = starts
+        self.times = times
+
+    @classmethod
+    def from_rows(cls, agasc_ids, times):
+        """
+        Sort rows by (agasc_id, time) and index them.
+
+        :param agasc_ids: array of AGASC ids for each row
+        :param times: array of times (CXC secs) for each row
+        :returns: tuple of (StarIndex, row order of the input in the index)
+        """
+        agasc_ids = np.asarray(agasc_ids)
+        times = np.asarray(times, dtype=np.float64)
+        order = np.lexsort((times, agasc_ids))
+        ids, starts = np.unique(agasc_ids[order], return_index=True)
+        starts = np.append(starts, len(order))
+        return cls(ids.astype(np.int64), starts.astype(np.int64), times[order]), order
+
+    def get_rows(self, agasc_id, time):
+        """
+        Get rows of the sorted table for ``agasc_id`` with time < ``time``.
+
+        :param agasc_id: AGASC id
+        :param time: time (CXC secs)
+        :returns: slice of the sorted table
+        """
+        idx = np.searchsorted(self.ids, agasc_id)
+        if idx == len(self.ids) or self.ids[idx] != agasc_id:
+            return slice(0, 0)
+        i0, i1 = self.starts[idx], self.starts[idx + 1]
+        n_before = np.searchsorted(self.times[i0:i1], time, side="left")
+        return slice(i0, i0 + n_before)
+
+    def get_rows_batch(self, agasc_ids, times):
+        """
+        Get row ranges of the sorted table for many (``agasc_id``, ``time``) pairs.
+
+        This is ``get_rows`` for arrays of ids and times, with the search within
+        each star's rows done as a bisection over all pairs at once.
+
+        :param agasc_ids: array of AGASC ids
+        :param times: array of times (CXC secs)
+        :returns: tuple of (start, stop) arrays of rows with time < ``times``
+        """
+        agasc_ids = np.asarray(agasc_ids)
+        times = np.asarray(times, dtype=float)
+        idxs = np.searchsorted(self.ids, agasc_ids)
+        found = idxs < len(self.ids)
+        found[found] = self.ids[idxs[found]] == agasc_ids[found]
+        idxs = np.where(found, idxs, 0)
+        lo = np.where(found, self.starts[idxs], 0)
+        hi = np.where(found, self.starts[idxs + 1], 0)
+        starts = lo.copy()
+
+        # Find the first row in [lo, hi) with time >= ``times``
+        while np.any(active := lo < hi):
+            mid = (lo + hi) // 2
+            before = np.zeros(len(mid), dtype=bool)
+            before[active] = self.times[mid[active]] < times[active]
+            lo = np.where(active & before, mid + 1, lo)
+            hi = np.where(active & ~before, mid, hi)
+        return starts, lo
+
+
+class StarStats:
+    """
+    Per-star acq and guide statistics from the arrays in ``STATS_ARRAYS``.
+
+    Use ``from_tables`` to make these from the mica acq and guide stats tables
+    and ``write`` / ``read`` to save them to and memory-map them from a directory.
+
+    :param arrays: dict of the arrays in ``STATS_ARRAYS``
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.acq_index = StarIndex(
+            arrays["acq_ids"], arrays["acq_starts"], arrays["acq_times"]
+        )
+        self.guide_index = StarIndex(
+            arrays["guide_ids"], arrays["guide_starts"], arrays["guide_times"]
+        )
+
+    @classmethod
+    def from_tables(cls, acqs, guides):
+        """
+        Make StarStats from the mica acq and guide stats tables.
+
+        :param acqs: mica acq stats table
+        :param guides: mica guide stats table
+        :returns: StarStats
+        """
+        acq_index, order = StarIndex.from_rows(acqs["agasc_id"], acqs["guide_tstart"])
+        arrays = {
+            "acq_ids": acq_index.ids,
+            "acq_starts": acq_index.starts,
+            "acq_times": acq_index.times,
+            "acq_star": np.asarray(acqs["img_func"])[order] == "star",
+            "acq_mag": np.asarray(acqs["mag_obs"])[order],
+        }
+        guide_index, order = StarIndex.from_rows(
+            guides["agasc_id"], guides["kalman_tstart"]
+        )
+        f_track = np.asarray(guides["f_track"])[order]
+        arrays.update(
+            {
+                "guide_ids": guide_index.ids,
+                "guide_starts": guide_index.starts,
+                "guide_times": guide_index.times,
+                "guide_mag": np.asarray(guides["aoacmag_mean"])[order],
+                "guide_bad": f_track < 0.95,
+                "guide_fail": f_track < 0.01,
+                "guide_obc_bad": np.asarray(guides["f_obc_bad"])[order] > 0.05,
+            }
+        )
+        return cls(
+            {name: arrays[name].astype(dtype) for name, dtype in STATS_ARRAYS.items()}
+        )
+
+    def write(self, path):
+        """
+        Write the arrays as ``<name>.npy`` files in directory ``path``.
+
+        :param path: output directory (created if needed)
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in STATS_ARRAYS:
+            np.save(path / f"{name}.npy", self.arrays[name])
+
+    @classmethod
+    def read(cls, path):
+        """
+        Memory-map the arrays written by ``write`` in directory ``path``.
+
+        :param path: directory
+        :returns: StarStats
+        """
+        path = Path(path)
+        arrays = {}
+        for name, dtype in STATS_ARRAYS.items():
+            arrays[name] = np.load(path / f"{name}.npy", mmap_mode="r")
+            if arrays[name].dtype != dtype:
+                raise ValueError(f"{name} in {path} has dtype {arrays[name].dtype}")
+        return cls(arrays)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def get_star_stats(self, agasc_id, time):
+        """
+        Get the acq and guide star statistics for a star before a given time.
+
+        :param agasc_id: AGASC id of star
+        :param time: time used as end of range to retrieve statistics
+        :returns: dict of stats for the observed history of the star
+        """
+        acqs = self.acq_index.get_rows(int(agasc_id), float(time))
+        guides = self.guide_index.get_rows(int(agasc_id), float(time))
+        arrays = self.arrays
+
+        acq_mags = arrays["acq_mag"][acqs].astype(np.float64)
+        guide_mags = arrays["guide_mag"][guides].astype(np.float64)
+        mags = np.concatenate([acq_mags[acq_mags != 0], guide_mags[guide_mags != 0]])
+        avg_mag = float(np.mean(mags)) if (len(mags) > 0) else float(DEFAULT_AVG_MAG)
+
+        return {
+            "acq": len(acq_mags),
+            "acq_noid": int(np.count_nonzero(~arrays["acq_star"][acqs])),
+            "gui": len(guide_mags),
+            "gui_bad": int(np.count_nonzero(arrays["guide_bad"][guides])),
+            "gui_fail": int(np.count_nonzero(arrays["guide_fail"][guides])),
+            "gui_obc_bad": int(np.count_nonzero(arrays["guide_obc_bad"][guides])),
+            "avg_mag": avg_mag,
+        }
+
+    def get_star_stats_batch(self, agasc_ids, times):
+        """
+        Get the acq and guide star statistics for many stars.
+
+        The rows of all the stars are gathered in one pass and the statistics are
+        summed per star with ``np.bincount``.
+
+        :param agasc_ids: list of AGASC ids
+        :param times: list of times (or one time for all stars) used as end of
+            range to retrieve statistics
+        :returns: dict of lists with the keys of ``get_star_stats``, one item per star
+        """
+        agasc_ids = np.array([int(agasc_id) for agasc_id in agasc_ids], dtype=np.int64)
+        times = np.broadcast_to(np.asarray(times, dtype=float), agasc_ids.shape)
+        n_stars = len(agasc_ids)
+        arrays = self.arrays
+
+        acq_star, acq_rows = self._gather(self.acq_index, agasc_ids, times)
+        guide_star, guide_rows = self._gather(self.guide_index, agasc_ids, times)
+
+        def count(star, ok=None):
+            return np.bincount(star, weights=ok, minlength=n_stars).astype(int)
+
+        acq_mags = arrays["acq_mag"][acq_rows].astype(np.float64)
+        guide_mags = arrays["guide_mag"][guide_rows].astype(np.float64)
+        n_mags = count(acq_star, acq_mags != 0) + count(guide_star, guide_mags != 0)
+        sum_mags = np.bincount(acq_star, weights=acq_mags, minlength=n_stars)
+        sum_mags += np.bincount(guide_star, weights=guide_mags, minlength=n_stars)
+        avg_mag = np.full(n_stars, DEFAULT_AVG_MAG)
+        ok = n_mags > 0
+        avg_mag[ok] = sum_mags[ok] / n_mags[ok]
+
+        stats = {
+            "acq": count(acq_star),
+            "acq_noid": count(acq_star, ~arrays["acq_star"][acq_rows]),
+            "gui": count(guide_star),
+            "gui_bad": count(guide_star, arrays["guide_bad"][guide_rows]),
+            "gui_fail": count(guide_star, arrays["guide_fail"][guide_rows]),
+            "gui_obc_bad": count(guide_star, arrays["guide_obc_bad"][guide_rows]),
+            "avg_mag": avg_mag,
+        }
+        return {key: val.tolist() for key, val in stats.items()}
+
+    @staticmethod
+    def _gather(index, agasc_ids, times):
+        """
+        Get the rows of ``index`` for each star.
+
+        :returns: tuple of (star number, row) arrays with one item per matching row
+        """
+        starts, stops = index.get_rows_batch(agasc_ids, times)
+        lens = stops - starts
+        star = np.repeat(np.arange(len(lens)), lens)
+        offsets = np.cumsum(lens) - lens
+        rows = np.repeat(starts - offsets, lens) + np.arange(lens.sum())
+        return star, rows
+
+
+def get_cache_dir():
+    """
+    Get the directory of the star stats cache.
+
+    This is ``$STARCHECK_MICA_STATS_CACHE`` if set, else ``starcheck/mica_stats``
+    in ``$XDG_CACHE_HOME`` (default ``~/.cache``).  Set
+    ``STARCHECK_MICA_STATS_CACHE`` to an empty string to disable the cache.
+
+    :returns: Path or None if the cache is disabled
+    """
+    cache_dir = os.environ.get("STARCHECK_MICA_STATS_CACHE")
+    if cache_dir is not None:
+        return Path(cache_dir) if cache_dir else None
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "starcheck" / "mica_stats"
+
+
+def get_source_files():
+    """Get the mica acq and guide stats files (HDF5) the cache is made from"""
+    return [
+        str(mica.stats.acq_stats.TABLE_FILE),
+        str(mica.stats.guide_stats.TABLE_FILE),
+    ]
+
+
+def get_file_signature(filename):
+    """
+    Get the size and modification time of ``filename``.
+
+    :returns: dict with keys file, size, mtime_ns
+    """
+    stat = os.stat(filename)
+    return {"file": filename, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def get_file_hash(filename):
+    """Get the SHA-256 hex digest of the contents of ``filename``"""
+    sha = hashlib.sha256()
+    with open(filename, "rb") as fh:
+        while chunk := fh.read(1 << 20):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@contextlib.contextmanager
+def cache_lock(cache_dir, *, exclusive):
+    """
+    Lock the cache in ``cache_dir`` with ``flock`` on its ``.lock`` file.
+
+    Reading the index and memory-mapping the arrays takes a shared lock, and a
+    rebuild, which removes the previous arrays, takes an exclusive lock.
+
+    :param cache_dir: cache directory (created if needed)
+    :param exclusive: take an exclusive lock instead of a shared one
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir / ".lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def read_cache(cache_dir, source_files):
+    """
+    Read the star stats cache in ``cache_dir`` if it is current for ``source_files``.
+
+    If only the size or mtime of a source file changed, but not its SHA-256
+    hash, the cache is still used and the signatures in its index are updated.
+
+    :param cache_dir: cache directory
+    :param source_files: list of source file names
+    :returns: StarStats or None if the cache is missing or stale
+    """
+    index_file = cache_dir / "index.json"
+    try:
+        index = json.loads(index_file.read_text())
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != CACHE_VERSION:
+        return None
+
+    signatures = [get_file_signature(filename) for filename in source_files]
+    if signatures != index["signatures"]:
+        cached_files = [sig["file"] for sig in index["signatures"]]
+        if cached_files != source_files:
+            return None
+        hashes = [get_file_hash(filename) for filename in source_files]
+        if hashes != index["hashes"]:
+            return None
+        logger.info(f"mica stats files touched but unchanged, reusing {cache_dir}")
+        index["signatures"] = signatures
+        write_index(cache_dir, index)
+
+    return StarStats.read(cache_dir / index["arrays"])
+
+
+def write_index(cache_dir, index):
+    """Write the cache ``index`` to ``cache_dir / "index.json"`` atomically"""
+    with tempfile.NamedTemporaryFile(
+        "w", dir=cache_dir, prefix=".index", delete=False
+    ) as fh:
+        json.dump(index, fh, indent=2)
+    os.replace(fh.name, cache_dir / "index.json")
+
+
+def write_cache(cache_dir, source_files, star_stats):
+    """
+    Write ``star_stats`` to the cache in ``cache_dir`` for ``source_files``.
+
+    The arrays go in a new subdirectory, which is made current by replacing the
+    index file, so that processes reading the previous arrays are unaffected.
+    Arrays directories that are no longer current are then removed, so this must
+    be called with the exclusive ``cache_lock``.
+
+    :param cache_dir: cache directory
+    :param source_files: list of source file names
+    :param star_stats: StarStats
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    signatures = [get_file_signature(filename) for filename in source_files]
+    hashes = [get_file_hash(filename) for filename in source_files]
+    arrays_dir = Path(tempfile.mkdtemp(dir=cache_dir, prefix="arrays-"))
+    star_stats.write(arrays_dir)
+    arrays_dir.chmod(0o755)
+    index = {
+        "version": CACHE_VERSION,
+        "signatures": signatures,
+        "hashes": hashes,
+        "arrays": arrays_dir.name,
+    }
+    write_index(cache_dir, index)
+
+    for path in cache_dir.glob("arrays-*"):
+        if path != arrays_dir:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_mica_stats():
+    """
+    Read the mica acq and guide stats tables.
+
+    :returns: tuple of (acq stats, guide stats) tables
+    """
+    return mica.stats.acq_stats.get_stats(), mica.stats.guide_stats.get_stats()
+
+
+def load_star_stats(cache_dir, source_files):
+    """
+    Load the ``StarStats`` from the cache, or make them and write the cache.
+
+    :param cache_dir: cache directory (None to not use the cache)
+    :param source_files: list of the mica stats files the cache is made from
+    :returns: StarStats
+    """
+    if cache_dir is None:
+        return StarStats.from_tables(*read_mica_stats())
+
+    star_stats = None
+    try:
+        with cache_lock(cache_dir, exclusive=False):
+            star_stats = read_cache(cache_dir, source_files)
+    except Exception as err:
+        logger.warning(f"failed to read mica stats cache {cache_dir}: {err}")
+    if star_stats is not None:
+        return star_stats
+
+    try:
+        with cache_lock(cache_dir, exclusive=True):
+            # Another process may have rebuilt the cache while this one waited
+            try:
+                star_stats = read_cache(cache_dir, source_files)
+            except Exception:
+                star_stats = None
+            if star_stats is None:
+                star_stats = StarStats.from_tables(*read_mica_stats())
+                write_cache(cache_dir, source_files, star_stats)
+                logger.info(
+                    f"wrote mica stats cache {cache_dir} ({star_stats.nbytes} bytes)"
+                )
+    except OSError as err:
+        logger.warning(f"failed to write mica stats cache {cache_dir}: {err}")
+    if star_stats is None:
+        star_stats = StarStats.from_tables(*read_mica_stats())
+    return star_stats
+
+
+@functools.cache
+def _load_star_stats():
+    cache_dir = get_cache_dir()
+    source_files = get_source_files() if cache_dir is not None else None
+    return load_star_stats(cache_dir, source_files)
+
+
+def get_star_stats_index():
+    """
+    Get the ``StarStats`` for the mica acq and guide stats.
+
+    This is made on the first call, from the cache if it is current or else from
+    the mica stats tables (and then written to the cache).
+
+    :returns: StarStats
+    """
+    # Lock so a call from the server while starcheck.utils.preload() is running
+    # in another thread waits for that load instead of doing a second one.
+    with MICA_STATS_LOCK:
+        return _load_star_stats()
+
+
+def get_star_stats(agasc_id, time):
+    """
+    Get the acq and guide star statistics for a star before a given time.
+
+    :param agasc_id: AGASC id of star
+    :param time: time used as end of range to retrieve statistics
+    :returns: dict of stats for the observed history of the star
+    """
+    return get_star_stats_index().get_star_stats(agasc_id, time)
+
+
+def get_star_stats_batch(agasc_ids, times):
+    """
+    Get the acq and guide star statistics for many stars.
+
+    :param agasc_ids: list of AGASC ids
+    :param times: list of times (or one time for all stars) used as end of range
+        to retrieve statistics
+    :returns: dict of lists with the keys of ``get_star_stats``, one item per star
+    """
+    return get_star_stats_index().get_star_stats_batch(agasc_ids, times)
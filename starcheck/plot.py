@@ -1,11 +1,16 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 import os
 
-import agasc
 import matplotlib.pyplot as plt
-import Quaternion
 from chandra_aca.plot import bad_acq_stars, plot_stars
-from ska_quatutil import radec2yagzag
+
+from starcheck import cones
+
+# Radius (deg) of the AGASC stars in the star field plots
+STARS_RADIUS = 1.5
+
+# File name of the star field plot of an obsid
+STARS_PLOT_NAME = "stars_{}.png"
 
 
 def make_plots_for_obsid(
@@ -19,6 +24,7 @@ def make_plots_for_obsid(
     red_mag_lim=10.7,
     duration=0.0,
     agasc_file=None,
+    stars=None,
 ):
     """
     Make standard starcheck plots for obsid and save as pngs with standard names.
@@ -36,6 +42,8 @@ def make_plots_for_obsid(
     :param red_mag_lim: faint limit
     :param duration: length of observation in seconds
     :param agasc_file: agasc_file for star lookups
+    :param stars: table of stars within STARS_RADIUS with yang and zang (default is
+                  the cone from ``cones.get_cone_stars``)
     """
 
     # explicitly float convert these, as we may be receiving this from Perl passing strings
@@ -43,18 +51,13 @@ def make_plots_for_obsid(
     dec = float(dec)
     roll = float(roll)
 
-    # get the agasc field once and then use it for both plots that have stars
-    stars = agasc.get_agasc_cone(
-        ra, dec, radius=1.5, date=starcat_time, agasc_file=agasc_file
-    )
-    # We use the full star list for both the field plot and the main "catalog" plot
-    # and we can save looking up the yang/zang positions twice if we add that content
-    # to the stars in this wrapper
-    yags, zags = radec2yagzag(
-        stars["RA_PMCORR"], stars["DEC_PMCORR"], Quaternion.Quat([ra, dec, roll])
-    )
-    stars["yang"] = yags * 3600
-    stars["zang"] = zags * 3600
+    # get the agasc field once and then use it for both plots that have stars.
+    # This is the cone shared with the checks for this attitude, with
+    # the yang/zang positions already included.
+    if stars is None:
+        stars = cones.get_cone_stars(
+            ra, dec, roll, STARS_RADIUS, date=starcat_time, agasc_file=agasc_file
+        )
 
     bad_stars = bad_acq_stars(stars)
 
@@ -68,5 +71,5 @@ def make_plots_for_obsid(
         bad_stars=bad_stars,
         red_mag_lim=red_mag_lim,
     )
-    cat_plot.savefig(os.path.join(outdir, "stars_{}.png".format(obsid)), dpi=150)
+    cat_plot.savefig(os.path.join(outdir, STARS_PLOT_NAME.format(obsid)), dpi=150)
     plt.close(cat_plot)
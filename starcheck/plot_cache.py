@@ -0,0 +1,205 @@
+"""
+Content-addressed cache of the starcheck plot files.
+
+A plot is keyed by a hash of everything that goes into it (see ``get_plot_key``),
+e.g. for the star field plots the attitude, catalog rows, starcat time, duration,
+red mag limit, AGASC file identity and starcheck version.  On a rerun of a load,
+or a reissued load with mostly unchanged obsids, the plot file is then copied
+from the cache directory (see ``get_cache_dir``) instead of being rendered again.
+Plots are always copied (never hard-linked) so that pruning or rewriting the
+cache cannot change the plot files of a delivered starcheck report.
+
+Plots are added to the cache by ``make_cached_plot`` once rendered.  The cache is
+limited to ``PLOT_CACHE_MAX_BYTES`` by ``prune_cache``, which drops the least
+recently used plots first (a cache hit updates the file modification time).
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from starcheck import __version__ as version
+
+logger = logging.getLogger(__name__)
+
+# Maximum total size (bytes) of the plot files in the cache
+PLOT_CACHE_MAX_BYTES = 512 * 1024**2
+
+# Counts of plot cache hits and misses
+PLOT_CACHE_STATS = collections.Counter()
+PLOT_CACHE_LOCK = threading.Lock()
+
+
+def get_cache_dir():
+    """
+    Get the directory of the plot cache.
+
+    This is ``$STARCHECK_PLOT_CACHE`` if set, else ``starcheck/plots`` in
+    ``$XDG_CACHE_HOME`` (default ``~/.cache``).  Set ``STARCHECK_PLOT_CACHE`` to an
+    empty string to disable the cache.
+
+    :returns: Path or None if the cache is disabled
+    """
+    cache_dir = os.environ.get("STARCHECK_PLOT_CACHE")
+    if cache_dir is not None:
+        return Path(cache_dir) if cache_dir else None
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "starcheck" / "plots"
+
+
+def get_file_identity(filename):
+    """
+    Get the identity of a file for a plot key.
+
+    :param filename: file name (or None)
+    :returns: list of the real path, size and modification time (ns), or None
+    """
+    if not filename:
+        return None
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return [str(filename)]
+    return [os.path.realpath(filename), stat.st_size, stat.st_mtime_ns]
+
+
+def get_plot_key(kind, *parts):
+    """
+    Get the cache key of a plot.
+
+    The key is the SHA-256 of the plot kind, the starcheck version and ``parts``.
+    numpy arrays are hashed by dtype, shape and data, and anything else by its
+    JSON with sorted keys.
+
+    :param kind: plot kind (e.g. 'stars')
+    :param *parts: values that define the plot
+    :returns: str hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([kind, str(version)]).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"{part.dtype.str}{part.shape}".encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def get_cache_path(cache_dir, key, outfile):
+    return Path(cache_dir) / f"{key}{Path(outfile).suffix}"
+
+
+def copy_file(src, dest):
+    """Copy ``src`` to ``dest``, replacing ``dest`` only once the copy is complete"""
+    dest = Path(dest)
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def get_cached_plot(key, outfile, cache_dir=None):
+    """
+    Get a plot from the cache.
+
+    :param key: plot key (from get_plot_key)
+    :param outfile: plot file to write from the cache
+    :param cache_dir: cache directory (default from get_cache_dir)
+    :returns: True if the plot was in the cache and written to ``outfile``
+    """
+    cache_dir = get_cache_dir() if cache_dir is None else cache_dir
+    hit = False
+    if cache_dir is not None:
+        cache_path = get_cache_path(cache_dir, key, outfile)
+        try:
+            copy_file(cache_path, outfile)
+            os.utime(cache_path)
+            hit = True
+        except OSError:
+            pass
+    with PLOT_CACHE_LOCK:
+        PLOT_CACHE_STATS["hits" if hit else "misses"] += 1
+    return hit
+
+
+def make_cached_plot(func, args, kwargs, *, key, outfile, cache_dir):
+    """
+    Make a plot with ``func(*args, **kwargs)`` and add ``outfile`` to the cache.
+
+    :param func: plot function
+    :param args: positional args of ``func``
+    :param kwargs: keyword args of ``func``
+    :param key: plot key (from get_plot_key)
+    :param outfile: plot file written by ``func``
+    :param cache_dir: cache directory (None to not use the cache)
+    """
+    # Remove any earlier plot file instead of writing over it, in case it is a
+    # hard link to a cached plot made by an older starcheck.
+    Path(outfile).unlink(missing_ok=True)
+    func(*args, **kwargs)
+    if cache_dir is None:
+        return
+    try:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=".", delete=False) as fh:
+            pass
+        shutil.copyfile(outfile, fh.name)
+        os.replace(fh.name, get_cache_path(cache_dir, key, outfile))
+    except OSError as err:
+        logger.warning(f"failed to write plot cache for {outfile}: {err}")
+
+
+def prune_cache(cache_dir=None, max_bytes=PLOT_CACHE_MAX_BYTES):
+    """
+    Remove the least recently used plots until the cache is within ``max_bytes``.
+
+    :param cache_dir: cache directory (default from get_cache_dir)
+    :param max_bytes: maximum total size (bytes) of the cached plots
+    :returns: number of plots removed
+    """
+    cache_dir = get_cache_dir() if cache_dir is None else cache_dir
+    if cache_dir is None or not Path(cache_dir).is_dir():
+        return 0
+    files = []
+    for path in Path(cache_dir).iterdir():
+        # Skip temporary files of plots being added
+        if path.name.startswith(".") or not path.is_file():
+            continue
+        stat = path.stat()
+        files.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    n_removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        n_removed += 1
+    return n_removed
+
+
+def get_plot_cache_stats():
+    """
+    Get the plot cache statistics.
+
+    :returns: dict with keys hits and misses
+    """
+    with PLOT_CACHE_LOCK:
+        return {key: PLOT_CACHE_STATS[key] for key in ("hits", "misses")}
+
+
+def clear_plot_cache_stats():
+    """Reset the plot cache statistics"""
+    with PLOT_CACHE_LOCK:
+        PLOT_CACHE_STATS.clear()
@@ -0,0 +1,237 @@
+"""
+Queue of star field and thermal plots rendered in a pool of worker processes.
+
+Each plot costs a matplotlib render and a PNG encode, and nothing in the checks
+depends on the plot files.  Once ``start_plot_queue`` has been called, plots
+submitted with ``submit_plot`` (or ``submit_plot_cat`` for the star field plots
+of an obsid) are rendered in a process pool while the checks continue, and
+``wait_plots`` waits for all of them before the report is written.  Without a
+started queue (or with ``STARCHECK_PLOT_PROCESSES=0``) plots are made inline
+when submitted.  A plot can have an ``on_success`` function (e.g. to log the plot
+file), which is called in this process once the plot is made.
+
+The AGASC stars for the star field plots are taken in this process from the
+cones cache (see ``starcheck.cones``) and passed to the workers.  Plots submitted
+with ``submit_cached_plot`` are taken from the plot cache if they are there (see
+``starcheck.plot_cache``) and added to it when rendered.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+
+from starcheck import cones, plot_cache
+
+logger = logging.getLogger(__name__)
+
+# Default maximum number of plot processes.  The pool is in the starcheck server,
+# which can be a daemon shared by runs, alongside the proseco process pool.
+PLOT_MAX_PROCESSES = 4
+
+# Process pool for the plots (None to make plots inline) and its number of
+# processes, (future, on_success) of the plots not yet waited for, and a lock for
+# all of these.
+PLOT_POOL = None
+PLOT_N_PROCESSES = 0
+PLOT_FUTURES = []
+PLOT_LOCK = threading.Lock()
+
+
+def get_n_plot_processes():
+    """
+    Get the number of plot worker processes.
+
+    This is ``$STARCHECK_PLOT_PROCESSES`` if set, else the number of cores
+    available to this process up to ``PLOT_MAX_PROCESSES``.
+
+    :returns: int number of processes (0 to make plots inline)
+    """
+    n_processes = os.environ.get("STARCHECK_PLOT_PROCESSES")
+    if n_processes:
+        return max(int(n_processes), 0)
+    if hasattr(os, "sched_getaffinity"):
+        n_cores = len(os.sched_getaffinity(0))
+    else:
+        n_cores = os.cpu_count() or 1
+    return min(n_cores, PLOT_MAX_PROCESSES)
+
+
+def init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def start_plot_queue(n_processes=None):
+    """
+    Start the plot worker pool, if not already started.
+
+    :param n_processes: number of processes (default from get_n_plot_processes)
+    :returns: number of plot processes (0 if plots are made inline)
+    """
+    global PLOT_POOL, PLOT_N_PROCESSES  # noqa: PLW0603 Using the global statement is discouraged
+
+    if n_processes is None:
+        n_processes = get_n_plot_processes()
+    with PLOT_LOCK:
+        if PLOT_POOL is None and n_processes > 0:
+            # Use spawn since the starcheck server process has threads
+            PLOT_POOL = concurrent.futures.ProcessPoolExecutor(
+                n_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+            )
+            PLOT_N_PROCESSES = n_processes
+        return PLOT_N_PROCESSES
+
+
+def stop_plot_queue():
+    """Wait for the queued plots and shut down the plot worker pool"""
+    global PLOT_POOL, PLOT_N_PROCESSES  # noqa: PLW0603 Using the global statement is discouraged
+
+    try:
+        wait_plots()
+    finally:
+        with PLOT_LOCK:
+            pool, PLOT_POOL = PLOT_POOL, None
+            PLOT_N_PROCESSES = 0
+        if pool is not None:
+            pool.shutdown()
+
+
+def submit_plot(func, *args, on_success=None, **kwargs):
+    """
+    Make a plot with ``func(*args, **kwargs)`` in the plot pool.
+
+    If the plot pool is not started then the plot is made now.
+
+    :param func: module level plot function
+    :param *args: positional args of ``func``
+    :param on_success: function (no args) to call in this process once the plot
+        is made, from ``wait_plots`` for a plot made in the pool
+    :param **kwargs: keyword args of ``func``
+    """
+    with PLOT_LOCK:
+        if PLOT_POOL is not None:
+            future = PLOT_POOL.submit(func, *args, **kwargs)
+            PLOT_FUTURES.append((future, on_success))
+            return
+    func(*args, **kwargs)
+    if on_success is not None:
+        on_success()
+
+
+def submit_cached_plot(key, outfile, func, *args, on_success=None, **kwargs):
+    """
+    Get a plot from the plot cache, or make it in the plot pool and cache it.
+
+    :param key: plot key (from ``plot_cache.get_plot_key``)
+    :param outfile: plot file written by ``func``
+    :param func: module level plot function
+    :param *args: positional args of ``func``
+    :param on_success: function (no args) to call in this process once the plot
+        file is written (see ``submit_plot``)
+    :param **kwargs: keyword args of ``func``
+    """
+    cache_dir = plot_cache.get_cache_dir()
+    if plot_cache.get_cached_plot(key, outfile, cache_dir):
+        if on_success is not None:
+            on_success()
+        return
+    submit_plot(
+        plot_cache.make_cached_plot,
+        func,
+        args,
+        kwargs,
+        key=key,
+        outfile=outfile,
+        cache_dir=cache_dir,
+        on_success=on_success,
+    )
+
+
+def submit_plot_cat(**kwargs):
+    """
+    Queue the standard starcheck plots for an obsid.
+
+    This takes the keyword args of ``starcheck.plot.make_plots_for_obsid`` and
+    gets the stars for the plot here from the cones cache.  The plot is cached by
+    the attitude, catalog, starcat time, duration, red mag limit, AGASC file and
+    starcheck version.
+
+    :param **kwargs: keyword args of make_plots_for_obsid
+    """
+    from starcheck.plot import STARS_PLOT_NAME, STARS_RADIUS, make_plots_for_obsid
+
+    attitude = [float(kwargs[name]) for name in ("ra", "dec", "roll")]
+    key = plot_cache.get_plot_key(
+        "stars",
+        attitude,
+        kwargs["catalog"],
+        kwargs["starcat_time"],
+        float(kwargs.get("duration", 0.0)),
+        float(kwargs.get("red_mag_lim", 10.7)),
+        plot_cache.get_file_identity(kwargs.get("agasc_file")),
+    )
+    outfile = Path(kwargs["outdir"], STARS_PLOT_NAME.format(kwargs["obsid"]))
+    cache_dir = plot_cache.get_cache_dir()
+    if plot_cache.get_cached_plot(key, outfile, cache_dir):
+        return
+
+    kwargs["stars"] = cones.get_cone_stars(
+        *attitude,
+        STARS_RADIUS,
+        date=kwargs["starcat_time"],
+        agasc_file=kwargs.get("agasc_file"),
+    )
+    submit_plot(
+        plot_cache.make_cached_plot,
+        make_plots_for_obsid,
+        (),
+        kwargs,
+        key=key,
+        outfile=outfile,
+        cache_dir=cache_dir,
+    )
+
+
+def wait_plots():
+    """
+    Wait for all the queued plots.
+
+    The ``on_success`` function of each plot that was made is called here.  If
+    any plot failed, the exception of the first failure is raised once all the
+    plots are done.  The plot cache is then pruned to its size limit.
+
+    :returns: number of plots waited for
+    """
+    with PLOT_LOCK:
+        futures = list(PLOT_FUTURES)
+        PLOT_FUTURES.clear()
+    errors = []
+    for future, on_success in futures:
+        err = future.exception()
+        if err is not None:
+            errors.append(err)
+        elif on_success is not None:
+            on_success()
+    for err in errors[1:]:
+        logger.warning(f"plot failed: {err}")
+    if errors:
+        raise errors[0]
+    try:
+        plot_cache.prune_cache()
+    except OSError as err:
+        logger.warning(f"failed to prune plot cache: {err}")
+    return len(futures)
+
+
+def clear_plot_queue():
+    """Cancel queued plots that have not started and forget all queued plots"""
+    with PLOT_LOCK:
+        for future, _ in PLOT_FUTURES:
+            future.cancel()
+        PLOT_FUTURES.clear()
@@ -1,9 +1,21 @@
+import argparse
+import bisect
 import collections
+import concurrent.futures
+import functools
 import importlib
 import json
 import logging
+import math
+import multiprocessing
+import os
+import secrets
+import socket
 import socketserver
+import struct
 import sys
+import threading
+import time
 import traceback
 
 from ska_helpers.logging import basic_logger
@@ -14,95 +26,1073 @@ HOST = "localhost"
 KEY = None
 
 func_calls = collections.Counter()
+func_calls_lock = threading.Lock()
+
+# Functions that are CPU-bound and are run in the process pool when one is
+# configured.  Everything else goes to the thread pool (if configured).
+PROCESS_FUNCS = {
+    "utils.check_hot_pix",
+    "utils.proseco_probs",
+}
+
+# Pure functions (the result depends only on the args) whose results are cached
+# in the server, keyed by the args.  These are also always run inline since a
+# cache hit is much faster than a round trip to a pool.
+MEMO_FUNCS = {
+    "utils._mag_for_p_acq",
+    "utils._pixels_to_yagzag",
+    "utils._yagzag_to_pixels",
+    "utils.apply_t_ccds_bonus",
+    "utils.date2time",
+    "utils.get_fid_offset",
+    "utils.guide_count",
+    "utils.time2date",
+}
+
+# Functions run in a background thread once the server is listening, to import
+# heavy modules and load data before the first calls that need them.
+PRELOAD_FUNCS = ["utils.preload"]
+
+# Default idle time (secs) before a daemon exits
+DAEMON_TIMEOUT = 8 * 3600
+
+# Default maximum number of results in the memoization cache
+MEMO_SIZE = 10000
+
+# Environment variables that a run can set (e.g. in set_kadi_scenario_default)
+# and that are restored after each run in daemon mode.
+RUN_ENV_VARS = ("KADI_SCENARIO",)
+
+# Idle time (secs) waiting for the next command before a daemon closes a session,
+# so that a hung run does not hold the daemon.  A server started by starcheck.pl
+# for one run does not close its session.
+SESSION_TIMEOUT = 180
+
+# Functions run at the end of each run in daemon mode to drop per-run state
+RUN_RESET_FUNCS = [
+    "cones.clear_cones",
+    "plot_queue.clear_plot_queue",
+    "plot_cache.clear_plot_cache_stats",
+    "dark_cal.clear_dark_cal_keys",
+]
+
+# Set by the shutdown_server command to stop a daemon after the current session
+SHUTDOWN = threading.Event()
+
+# State of the daemon run in progress (from begin_run to end_run)
+CURRENT_RUN = None
+
+# Upper edges (secs) of the wall time histogram bins in the server profile
+WALL_TIME_BINS = [1e-4, 1e-3, 1e-2, 0.1, 1.0, 10.0]
+
+# Frame header for the Unix domain socket transport: payload length as 4-byte
+# big-endian unsigned int.
+FRAME_HEADER = struct.Struct(">I")
 
 
 class PythonServer(socketserver.TCPServer):
     timeout = 180
 
+    # In daemon mode the server is shared by a series of starcheck runs, each
+    # one a session between begin_run and end_run commands, and state that a run
+    # changes is restored by end_run.
+    daemon = False
+
+    # Idle time (secs) before closing a session (None to wait for the client)
+    session_timeout = None
+
     def handle_timeout(self) -> None:
         print(
             f"SERVER: starcheck python server timeout after {self.timeout}s idle",
             file=sys.stderr,
         )
         # self.shutdown()  # DOES NOT WORK, just hangs
-        sys.exit(1)
+        sys.exit(0 if self.daemon else 1)
+
+
+class PythonUnixServer(PythonServer, socketserver.UnixStreamServer):
+    """
+    Server on a Unix domain socket.
+
+    Commands and responses are length-prefixed frames (4-byte big-endian length
+    then the payload) encoded with ``encoding`` ("json" or "msgpack").
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, encoding="json"):
+        self.dumps, self.loads = get_codec(encoding)
+        super().__init__(server_address, RequestHandlerClass)
+
+    def server_bind(self):
+        super().server_bind()
+        # Only the owner (starcheck.pl) should be able to connect
+        os.chmod(self.server_address, 0o600)
+
+
+def get_codec(encoding):
+    """
+    Get the (dumps, loads) functions to convert commands and responses to bytes.
+
+    :param encoding: "json" or "msgpack" (requires the optional msgpack package)
+    :returns: tuple of (dumps, loads) functions
+    """
+    if encoding == "json":
+        return (lambda obj: json.dumps(obj).encode("utf-8")), json.loads
+    if encoding == "msgpack":
+        import msgpack
+
+        return (
+            lambda obj: msgpack.packb(obj, use_bin_type=True),
+            lambda data: msgpack.unpackb(data, raw=False),
+        )
+    raise ValueError(f"unknown encoding {encoding!r}")
 
 
 class MyTCPHandler(socketserver.StreamRequestHandler):
     """
     The request handler class for our server.
 
-    It is instantiated once per connection to the server, and must
-    override the handle() method to implement communication to the
-    client.
+    It is instantiated once per connection to the server.  Each connection is a
+    session that can carry any number of newline-delimited JSON commands, and each
+    command gets one newline-delimited JSON response.  The key is checked on the
+    first command of the session.  A client that sends one command and then closes
+    the connection is just a session of length one.
     """
 
+    def setup(self):
+        # Idle time (secs) waiting for the next command in a session before closing it
+        self.timeout = self.server.session_timeout
+        super().setup()
+        self.dumps, self.loads = get_codec("json")
+
     def handle(self):
-        # self.request is the TCP socket connected to the client
+        self.handle_session()
+        # The run state is only reset by end_run (or the next begin_run), so a
+        # closed session never drops the state of a run that is still going.
+        if self.server.daemon and CURRENT_RUN is not None:
+            logger.warning("SERVER: session closed before end_run")
+
+    def handle_session(self):
+        authorized = False
+        # Number of commands that have not sent a response yet, and a condition
+        # (whose lock also serializes writing responses) to wait for them.
+        self.n_pending = 0
+        self.pending = threading.Condition()
+        while True:
+            try:
+                data = self.read_data()
+            except TimeoutError:
+                logger.info(f"SERVER: session idle for {self.timeout}s, closing")
+                break
+            if data is None:
+                # Client closed the session
+                break
+
+            t0 = time.perf_counter()
+            cmd = self.loads(data)
+            decode_time = time.perf_counter() - t0
+
+            if not authorized:
+                if cmd.get("key") != KEY:
+                    logger.error(f"SERVER: bad key {cmd.get('key')!r}")
+                    break
+                authorized = True
+
+            PROFILE.add_request(cmd["func"], len(data), decode_time)
+
+            # The response is written when the command is done, which is right away
+            # unless the command was sent to a thread or process pool.
+            with self.pending:
+                self.n_pending += 1
+            future = DISPATCHER.submit(cmd)
+            future.add_done_callback(functools.partial(self.send_result, cmd))
+
+        # Finish commands still running in a pool before the connection is closed
+        with self.pending:
+            self.pending.wait_for(lambda: self.n_pending == 0)
+
+    def send_result(self, cmd, future):
+        try:
+            result, exc = future.result()
+        except Exception:
+            # Failure in the pool itself, e.g. a worker process died
+            result, exc = None, traceback.format_exc()
+        with self.pending:
+            try:
+                resp = {"id": cmd.get("id"), "result": result, "exception": exc}
+                self.send_response(cmd.get("func"), resp)
+            except (OSError, ValueError):
+                logger.error(
+                    f"SERVER: unable to send response for command {cmd.get('id')}"
+                )
+            finally:
+                self.n_pending -= 1
+                self.pending.notify_all()
+
+    def send_response(self, func_name, resp):
+        t0 = time.perf_counter()
+        try:
+            data = self.dumps(resp)
+        except TypeError:
+            # Result that cannot be encoded, return that as the exception
+            resp = {
+                "id": resp["id"],
+                "result": None,
+                "exception": traceback.format_exc(),
+            }
+            data = self.dumps(resp)
+        PROFILE.add_response(func_name, len(data), time.perf_counter() - t0)
+        self.write_data(data)
+
+    def read_data(self):
+        """Read one encoded command from the session or return None at end of session"""
+        # self.rfile is a file-like view on the socket connected to the client
         data = self.rfile.readline()
+        if not data:
+            return None
         logger.debug(f"SERVER receive: {data.decode('utf-8')}")
+        return data
 
-        # Decode self.data from JSON
-        cmd = json.loads(data)
+    def write_data(self, data):
+        logger.debug(f"SERVER send: {data.decode('utf-8')}")
+        self.wfile.write(data + b"\n")
 
-        if cmd["key"] != KEY:
-            logger.ERROR(f"SERVER: bad key {cmd['key']!r}")
-            return
 
+class FramedHandler(MyTCPHandler):
+    """
+    Request handler for length-prefixed frames.
+
+    This is used for the Unix domain socket server, where the frame payload
+    encoding is set by the server (JSON or MessagePack).
+    """
+
+    def setup(self):
+        super().setup()
+        self.dumps, self.loads = self.server.dumps, self.server.loads
+
+    def read_data(self):
+        header = self.rfile.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return None
+        (size,) = FRAME_HEADER.unpack(header)
+        data = self.rfile.read(size)
+        logger.debug(f"SERVER receive: {size} byte frame")
+        return data
+
+    def write_data(self, data):
+        logger.debug(f"SERVER send: {len(data)} byte frame")
+        self.wfile.write(FRAME_HEADER.pack(len(data)) + data)
+
+
+class Dispatcher:
+    """
+    Run commands inline or in a thread or process pool.
+
+    With the default of no pools every command runs inline in the session
+    handler, one at a time.  If ``n_threads`` > 0 then commands run in a thread
+    pool, and if ``n_processes`` > 0 then functions in ``PROCESS_FUNCS`` run in a
+    process pool.  Responses from a session can then come back out of order and
+    the client matches them up by the command id.
+
+    :param n_threads: number of threads for the thread pool (0 for none)
+    :param n_processes: number of processes for the process pool (0 for none)
+    """
+
+    def __init__(self, n_threads=0, n_processes=0):
+        self.n_processes = n_processes
+        self.pools = {}
+        if n_threads > 0:
+            self.pools["thread"] = concurrent.futures.ThreadPoolExecutor(n_threads)
+        if n_processes > 0:
+            self.pools["process"] = self.get_process_pool()
+        self.queue_depth = collections.Counter(dict.fromkeys(self.pools, 0))
+        self.lock = threading.Lock()
+
+    def get_process_pool(self):
+        # Use spawn since the server process has threads
+        return concurrent.futures.ProcessPoolExecutor(
+            self.n_processes, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def restart_processes(self):
+        """Replace the process pool workers so they import the current code"""
+        if "process" in self.pools:
+            self.pools["process"].shutdown()
+            self.pools["process"] = self.get_process_pool()
+
+    def get_pool_name(self, func_name):
+        if func_name in PROCESS_FUNCS and "process" in self.pools:
+            return "process"
+        if "thread" in self.pools:
+            return "thread"
+        return None
+
+    def submit(self, cmd):
+        """
+        Submit one command from the client.
+
+        :param cmd: dict with keys func, args, kwargs
+        :returns: Future with result tuple of (result, exception traceback or None)
+        """
         logger.debug(f"SERVER receive func: {cmd['func']}")
         logger.debug(f"SERVER receive args: {cmd['args']}")
         logger.debug(f"SERVER receive kwargs: {cmd['kwargs']}")
 
-        exc = None
+        func_name = cmd["func"]
+        if func_name == "batch" and self.pools:
+            return self.submit_batch(*cmd["args"], **cmd["kwargs"])
+        if func_name in SERVER_FUNCS:
+            future = concurrent.futures.Future()
+            future.set_result(run_command(cmd))
+            return future
+        return self.submit_func(func_name, cmd["args"], cmd["kwargs"])
 
-        # For security reasons, only allow functions in the public API of starcheck module
-        if cmd["func"] == "get_server_calls":
-            # Sort func calls by the items in the counter
-            result = dict(func_calls)
-        else:
-            func_calls[cmd["func"]] += 1
-            parts = cmd["func"].split(".")
-            package = ".".join(["starcheck"] + parts[:-1])
-            func = parts[-1]
-            module = importlib.import_module(package)
-            func = getattr(module, func)
-            args = cmd["args"]
-            kwargs = cmd["kwargs"]
+    def submit_func(self, func_name, args, kwargs):
+        """
+        Submit one call of a function in the starcheck package.
 
-            try:
-                result = func(*args, **kwargs)
-            except Exception:
-                result = None
-                exc = traceback.format_exc()
+        The call runs in a pool if one is configured for ``func_name``, else it
+        runs inline (as do memoized functions).
+
+        :param func_name: function name relative to the starcheck package
+        :param args: list of positional args
+        :param kwargs: dict of keyword args
+        :returns: Future with result tuple of (result, exception traceback or None)
+        """
+        pool_name = None if func_name in MEMO_FUNCS else self.get_pool_name(func_name)
+        if pool_name is None:
+            future = concurrent.futures.Future()
+            future.set_result(run_func(func_name, args, kwargs))
+            return future
+
+        with self.lock:
+            self.queue_depth[pool_name] += 1
+        count_call(func_name)
+        pool_future = self.pools[pool_name].submit(
+            timed_call_func, func_name, args, kwargs
+        )
+
+        # Future for the (result, exception) of the command.  The function timing
+        # is measured where it runs (which can be a worker process) and recorded
+        # here in the server process.
+        future = concurrent.futures.Future()
+        pool_future.add_done_callback(
+            functools.partial(self.task_done, pool_name, func_name, future)
+        )
+        return future
+
+    def submit_batch(self, items):
+        """
+        Submit a batch of ``{func, args, kwargs}`` items.
+
+        Each item is submitted like a separate command, so the items of a batch
+        run at the same time in the pools.  The result is a list of ``{result,
+        exception}`` for each item in order, as for ``run_batch``.
+
+        :param items: list of dict
+        :returns: Future with result tuple of (list of dict, None)
+        """
+        t0 = time.perf_counter()
+        futures = [
+            self.submit_func(item["func"], item.get("args", []), item.get("kwargs", {}))
+            for item in items
+        ]
+        future = concurrent.futures.Future()
+        n_pending = [len(futures)]
+        lock = threading.Lock()
+
+        def item_done(_):
+            with lock:
+                n_pending[0] -= 1
+                if n_pending[0] > 0:
+                    return
+            results = []
+            for item_future in futures:
+                try:
+                    result, exc = item_future.result()
+                except Exception:
+                    # Failure in the pool itself, e.g. a worker process died
+                    result, exc = None, traceback.format_exc()
+                results.append({"result": result, "exception": exc})
+            PROFILE.add_call("batch", time.perf_counter() - t0, 0.0)
+            future.set_result((results, None))
+
+        if not futures:
+            future.set_result(([], None))
+        for item_future in futures:
+            item_future.add_done_callback(item_done)
+        return future
+
+    def task_done(self, pool_name, func_name, future, pool_future):
+        with self.lock:
+            self.queue_depth[pool_name] -= 1
+        try:
+            output = pool_future.result()
+        except Exception as err:
+            future.set_exception(err)
+            return
+        result, exc, wall_time, cpu_time = output
+        PROFILE.add_call(func_name, wall_time, cpu_time)
+        future.set_result((result, exc))
+
+
+class RunState:
+    """
+    Process state that a starcheck run can change.
+
+    This saves the environment variables in ``RUN_ENV_VARS`` and the handlers of
+    every logger when created, and ``restore()`` puts them back, closing any
+    handlers (e.g. the run.dat file handler from ``utils.config_logging``) that
+    were added in between.
+    """
+
+    def __init__(self):
+        self.env = {name: os.environ.get(name) for name in RUN_ENV_VARS}
+        self.handlers = {
+            name: list(log.handlers) for name, log in self.get_loggers().items()
+        }
+
+    @staticmethod
+    def get_loggers():
+        loggers = {
+            name: log
+            for name, log in logging.root.manager.loggerDict.items()
+            if isinstance(log, logging.Logger)
+        }
+        loggers[""] = logging.root
+        return loggers
+
+    def restore(self):
+        for name, value in self.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+        for name, log in self.get_loggers().items():
+            handlers = self.handlers.get(name, [])
+            for handler in list(log.handlers):
+                if handler not in handlers:
+                    log.removeHandler(handler)
+                    handler.close()
+            for handler in handlers:
+                if handler not in log.handlers:
+                    log.addHandler(handler)
+
+
+class MemoCache:
+    """
+    Least-recently-used cache of results for the functions in ``MEMO_FUNCS``.
+
+    The cache key is the function name and the canonical JSON of the args and
+    kwargs.  Only successful results are cached.
+
+    :param maxsize: maximum number of cached results (0 to disable caching)
+    """
+
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        self.evictions = 0
+
+    @staticmethod
+    def get_key(func_name, args, kwargs):
+        """Cache key for a call, or None if the args cannot be encoded as JSON"""
+        try:
+            return json.dumps(
+                [func_name, args, kwargs], sort_keys=True, separators=(",", ":")
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def call(self, func_name, args, kwargs):
+        """
+        Call ``func_name`` with ``timed_call_func``, using the cached result if any.
+
+        :returns: tuple of (result, exception or None, wall time, CPU time)
+        """
+        key = self.get_key(func_name, args, kwargs) if self.maxsize > 0 else None
+        if key is None:
+            return timed_call_func(func_name, args, kwargs)
+
+        t0 = time.perf_counter()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits[func_name] += 1
+                return self.cache[key], None, time.perf_counter() - t0, 0.0
+            self.misses[func_name] += 1
+
+        result, exc, wall_time, cpu_time = timed_call_func(func_name, args, kwargs)
+        if exc is None:
+            with self.lock:
+                self.cache[key] = result
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.maxsize:
+                    self.cache.popitem(last=False)
+                    self.evictions += 1
+        return result, exc, wall_time, cpu_time
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "maxsize": self.maxsize,
+                "size": len(self.cache),
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "evictions": self.evictions,
+            }
+
+
+class ServerProfile:
+    """
+    Timing and payload size statistics for each function called by the client.
+
+    For each function this accumulates the wall and CPU time of the calls, the
+    encoded command and response sizes in bytes, and the time to decode the
+    commands and encode the responses.  Items in a batch are recorded under their
+    own function name, and the encoded sizes of the batch under "batch".
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = collections.defaultdict(self.new_stats)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    @staticmethod
+    def new_stats():
+        return {
+            "wall_times": [],
+            "cpu_time": 0.0,
+            "request_bytes": 0,
+            "response_bytes": 0,
+            "decode_time": 0.0,
+            "encode_time": 0.0,
+        }
+
+    def add_call(self, func_name, wall_time, cpu_time):
+        with self.lock:
+            stats = self.stats[func_name]
+            stats["wall_times"].append(wall_time)
+            stats["cpu_time"] += cpu_time
+
+    def add_request(self, func_name, n_bytes, decode_time):
+        with self.lock:
+            stats = self.stats[func_name]
+            stats["request_bytes"] += n_bytes
+            stats["decode_time"] += decode_time
 
-        resp = json.dumps({"result": result, "exception": exc})
-        logger.debug(f"SERVER send: {resp}")
+    def add_response(self, func_name, n_bytes, encode_time):
+        with self.lock:
+            stats = self.stats[func_name]
+            stats["response_bytes"] += n_bytes
+            stats["encode_time"] += encode_time
 
-        self.request.sendall(resp.encode("utf-8"))
+    def summary(self):
+        """
+        Summary of the statistics for each function.
 
+        The wall time histogram ``wall_hist`` is the number of calls in bins with
+        upper edges ``WALL_TIME_BINS`` plus one final bin for anything longer.
 
-def main():
-    global KEY  # noqa: PLW0603 Using the global statement to update `KEY` is discouraged
+        :returns: dict of function name to dict of statistics
+        """
+        out = {}
+        with self.lock:
+            for func_name, stats in sorted(self.stats.items()):
+                wall_times = sorted(stats["wall_times"])
+                hist = [0] * (len(WALL_TIME_BINS) + 1)
+                for wall_time in wall_times:
+                    hist[bisect.bisect_left(WALL_TIME_BINS, wall_time)] += 1
+                out[func_name] = {
+                    "n_calls": len(wall_times),
+                    "wall_total": sum(wall_times),
+                    "wall_min": wall_times[0] if wall_times else None,
+                    "wall_max": wall_times[-1] if wall_times else None,
+                    "wall_p50": percentile(wall_times, 50),
+                    "wall_p95": percentile(wall_times, 95),
+                    "wall_hist": hist,
+                    "cpu_total": stats["cpu_time"],
+                    "request_bytes": stats["request_bytes"],
+                    "response_bytes": stats["response_bytes"],
+                    "decode_time": stats["decode_time"],
+                    "encode_time": stats["encode_time"],
+                }
+        return out
 
-    # Read a line from STDIN
-    port = int(sys.stdin.readline().strip())
-    KEY = sys.stdin.readline().strip()
-    loglevel = sys.stdin.readline().strip()
 
+def percentile(values, pct):
+    """Nearest-rank ``pct`` percentile of sorted ``values`` (None if empty)"""
+    if not values:
+        return None
+    idx = max(0, math.ceil(pct / 100 * len(values)) - 1)
+    return values[idx]
+
+
+def count_call(func_name):
+    with func_calls_lock:
+        func_calls[func_name] += 1
+
+
+def get_server_calls():
+    """
+    Server call counts and statistics.
+
+    This includes the number of commands queued or running in each pool and the
+    timing and payload size statistics for each function (see ``ServerProfile``).
+    """
+    return {
+        "calls": dict(func_calls),
+        "queue_depth": dict(DISPATCHER.queue_depth),
+        "memo": MEMO_CACHE.stats(),
+        "profile": PROFILE.summary(),
+        "wall_time_bins": WALL_TIME_BINS,
+    }
+
+
+def write_server_profile(filename):
+    """
+    Write the ``get_server_calls`` output as JSON to ``filename``.
+
+    :param filename: output file name (e.g. starcheck/server_profile.json)
+    """
+    with open(filename, "w") as fh:
+        json.dump(get_server_calls(), fh, indent=2)
+
+
+def run_batch(items):
+    """
+    Run a list of ``{func, args, kwargs}`` items in order.
+
+    :param items: list of dict
+    :returns: list of ``{result, exception}`` for each item
+    """
+    results = []
+    for item in items:
+        result, exc = run_func(
+            item["func"], item.get("args", []), item.get("kwargs", {})
+        )
+        results.append({"result": result, "exception": exc})
+    return results
+
+
+def shutdown_server():
+    """Stop the server after the current session ends"""
+    SHUTDOWN.set()
+
+
+def begin_run():
+    """
+    Start a starcheck run on a daemon.
+
+    Sessions are handled one at a time, so each starcheck run sharing the daemon
+    gets its own logging, environment, and call statistics.  This saves the state
+    that the run can change (see ``RunState``) and resets the call statistics.  A
+    previous run that never sent ``end_run`` (e.g. it died) is ended first.
+    """
+    global CURRENT_RUN  # noqa: PLW0603 Using the global statement is discouraged
+
+    if CURRENT_RUN is not None:
+        logger.warning("SERVER: previous run did not send end_run, ending it now")
+        end_run()
+    CURRENT_RUN = RunState()
+    func_calls.clear()
+    PROFILE.reset()
+
+
+def end_run():
+    """
+    End a starcheck run on a daemon.
+
+    This restores the state saved by ``begin_run`` and calls the
+    ``RUN_RESET_FUNCS`` to drop per-run state (cones, queued plots, dark cal
+    keys).
+    """
+    global CURRENT_RUN  # noqa: PLW0603 Using the global statement is discouraged
+
+    run_state, CURRENT_RUN = CURRENT_RUN, None
+    if run_state is not None:
+        run_state.restore()
+    for func_name in RUN_RESET_FUNCS:
+        _, exc = call_func(func_name, [], {})
+        if exc is not None:
+            logger.warning(f"SERVER: {func_name} failed:\n{exc}")
+
+
+def reload_server():
+    """
+    Reload the starcheck modules and drop cached results.
+
+    This lets a daemon pick up new starcheck code or data (e.g. the mica acq and
+    guide stats loaded by starcheck.utils) without a restart.  Modules are
+    reloaded in name order, which puts starcheck.utils after the modules it
+    imports from.
+
+    :returns: list of reloaded module names
+    """
+    # Shut down the plot worker pool, like the process pool below, since
+    # reloading starcheck.plot_queue would lose track of its workers.
+    plot_queue = sys.modules.get("starcheck.plot_queue")
+    if plot_queue is not None:
+        try:
+            plot_queue.stop_plot_queue()
+        except Exception:
+            logger.warning(f"SERVER: plot queue failed:\n{traceback.format_exc()}")
+    names = sorted(
+        name
+        for name in sys.modules
+        if name.startswith("starcheck.") and name != __name__
+    )
+    for name in names:
+        importlib.reload(sys.modules[name])
+    MEMO_CACHE.clear()
+    DISPATCHER.restart_processes()
+    return names
+
+
+# Commands handled by the server itself instead of a function in starcheck
+SERVER_FUNCS = {
+    "get_server_calls": get_server_calls,
+    "batch": run_batch,
+    "write_server_profile": write_server_profile,
+    "shutdown_server": shutdown_server,
+    "reload_server": reload_server,
+    "begin_run": begin_run,
+    "end_run": end_run,
+}
+
+
+def run_command(cmd):
+    """
+    Run one command from the client.
+
+    The ``func`` of the command is either a function in the starcheck package
+    (e.g. "utils.date2time") or one of the ``SERVER_FUNCS`` commands.  For
+    "batch" the single arg is a list of ``{func, args, kwargs}`` items which are
+    run in order (with pools the dispatcher runs them at the same time instead,
+    see ``Dispatcher.submit_batch``), and the result is a list of ``{result, exception}`` for each
+    item so that one failing item does not fail the batch.
+
+    :param cmd: dict with keys func, args, kwargs
+    :returns: tuple of (result, formatted exception traceback or None)
+    """
+    if cmd["func"] in SERVER_FUNCS:
+        t0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        try:
+            return SERVER_FUNCS[cmd["func"]](*cmd["args"], **cmd["kwargs"]), None
+        except Exception:
+            return None, traceback.format_exc()
+        finally:
+            PROFILE.add_call(
+                cmd["func"], time.perf_counter() - t0, time.thread_time() - cpu0
+            )
+
+    return run_func(cmd["func"], cmd["args"], cmd["kwargs"])
+
+
+def run_func(func_name, args, kwargs):
+    """
+    Run a function in the starcheck package here and record the call.
+
+    :param func_name: function name relative to the starcheck package
+    :param args: list of positional args
+    :param kwargs: dict of keyword args
+    :returns: tuple of (result, formatted exception traceback or None)
+    """
+    count_call(func_name)
+    result, exc, wall_time, cpu_time = call_func_memo(func_name, args, kwargs)
+    PROFILE.add_call(func_name, wall_time, cpu_time)
+    return result, exc
+
+
+def call_func(func_name, args, kwargs):
+    """
+    Call ``func_name`` in the starcheck package with ``args`` and ``kwargs``.
+
+    :param func_name: function name relative to the starcheck package
+    :param args: list of positional args
+    :param kwargs: dict of keyword args
+    :returns: tuple of (result, formatted exception traceback or None)
+    """
+    # For security reasons, only allow functions in the public API of starcheck module
+    parts = func_name.split(".")
+    package = ".".join(["starcheck"] + parts[:-1])
+
+    try:
+        module = importlib.import_module(package)
+        func = getattr(module, parts[-1])
+        result = func(*args, **kwargs)
+    except Exception:
+        return None, traceback.format_exc()
+
+    return result, None
+
+
+def timed_call_func(func_name, args, kwargs):
+    """
+    Call ``func_name`` like ``call_func`` and time it.
+
+    CPU time is for the thread that runs the function.
+
+    :returns: tuple of (result, exception or None, wall time, CPU time)
+    """
+    t0 = time.perf_counter()
+    cpu0 = time.thread_time()
+    result, exc = call_func(func_name, args, kwargs)
+    return result, exc, time.perf_counter() - t0, time.thread_time() - cpu0
+
+
+def call_func_memo(func_name, args, kwargs):
+    """
+    Call ``func_name`` like ``timed_call_func``.
+
+    Functions in ``MEMO_FUNCS`` use the memoization cache.
+    """
+    if func_name in MEMO_FUNCS:
+        return MEMO_CACHE.call(func_name, args, kwargs)
+    return timed_call_func(func_name, args, kwargs)
+
+
+PROFILE = ServerProfile()
+MEMO_CACHE = MemoCache()
+DISPATCHER = Dispatcher()
+
+
+def get_options(args=None):
+    parser = argparse.ArgumentParser(description="starcheck Python server")
+    parser.add_argument(
+        "--encoding",
+        default="json",
+        choices=["json", "msgpack"],
+        help="Frame encoding for the Unix domain socket transport (default=json)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run as a daemon on --socket that is shared by starcheck runs",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Unix domain socket path for --daemon or --control",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        help=(
+            "Exit after this many secs with no sessions "
+            f"(default={PythonServer.timeout}, or {DAEMON_TIMEOUT} with --daemon)"
+        ),
+    )
+    parser.add_argument(
+        "--control",
+        choices=["shutdown", "reload"],
+        help="Send shutdown or reload to the daemon on --socket and exit",
+    )
+    parser.add_argument(
+        "--ready-file",
+        help="File to write once the server is listening (readiness handshake)",
+    )
+    parser.add_argument(
+        "--no-preload",
+        dest="preload",
+        action="store_false",
+        help="Do not import and load starcheck.utils data in the background at start",
+    )
+    parser.add_argument(
+        "--memo-size",
+        default=MEMO_SIZE,
+        type=int,
+        help=f"Max number of cached function results (default={MEMO_SIZE}, 0=none)",
+    )
+    parser.add_argument(
+        "--threads",
+        default=0,
+        type=int,
+        help="Number of threads to run commands (default=0, run inline)",
+    )
+    parser.add_argument(
+        "--processes",
+        default=0,
+        type=int,
+        help="Number of processes to run CPU-bound commands (default=0, none)",
+    )
+    return parser.parse_args(args)
+
+
+def get_daemon_info_file(socket_path):
+    """
+    Daemon info file for ``socket_path``.
+
+    The daemon writes this JSON file with its key, encoding, and pid once it is
+    listening, readable only by the owner.
+    """
+    return f"{socket_path}.json"
+
+
+def write_daemon_info(socket_path, encoding):
+    info_file = get_daemon_info_file(socket_path)
+    tmp_file = f"{info_file}.tmp"
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fh:
+        json.dump({"key": KEY, "encoding": encoding, "pid": os.getpid()}, fh)
+    os.replace(tmp_file, info_file)
+
+
+def remove_stale_socket(socket_path):
+    """Remove ``socket_path`` if it exists but no server is listening on it"""
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+        else:
+            raise RuntimeError(f"a server is already running on {socket_path}")
+
+
+def send_control(socket_path, command):
+    """
+    Send a ``shutdown`` or ``reload`` command to the daemon on ``socket_path``.
+
+    :returns: result of the command
+    """
+    with open(get_daemon_info_file(socket_path)) as fh:
+        info = json.load(fh)
+    dumps, loads = get_codec(info["encoding"])
+    cmd = {
+        "func": f"{command}_server",
+        "args": [],
+        "kwargs": {},
+        "key": info["key"],
+        "id": 1,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        data = dumps(cmd)
+        sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+        with sock.makefile("rb") as rfile:
+            (size,) = FRAME_HEADER.unpack(rfile.read(FRAME_HEADER.size))
+            resp = loads(rfile.read(size))
+    if resp["exception"] is not None:
+        raise RuntimeError(resp["exception"])
+    return resp["result"]
+
+
+def set_log_level(loglevel):
     logmap = {"0": logging.CRITICAL, "1": logging.WARNING, "2": logging.INFO}
     if loglevel in logmap:
         logger.setLevel(logmap[loglevel])
     if int(loglevel) > 2:
         logger.setLevel(logging.DEBUG)
 
-    logger.info(f"SERVER: starting on port {port}")
 
-    # Create the server, binding to localhost on supplied port
-    with PythonServer((HOST, port), MyTCPHandler) as server:
-        # Activate the server; this will keep running until you
-        # interrupt the program with Ctrl-C
-        while True:
-            server.handle_request()
+def get_server(address, opt):
+    """
+    Create the server on ``address``.
+
+    :param address: TCP port number or Unix domain socket path (str)
+    :param opt: command line options
+    :returns: server
+    """
+    if address.isdigit():
+        logger.info(f"SERVER: starting on port {address}")
+        # Create the server, binding to localhost on supplied port
+        server = PythonServer((HOST, int(address)), MyTCPHandler)
+    else:
+        logger.info(f"SERVER: starting on socket {address} ({opt.encoding})")
+        if opt.daemon:
+            remove_stale_socket(address)
+        server = PythonUnixServer(address, FramedHandler, encoding=opt.encoding)
+
+    server.daemon = opt.daemon
+    if opt.daemon:
+        server.session_timeout = SESSION_TIMEOUT
+    if opt.idle_timeout is not None:
+        server.timeout = opt.idle_timeout
+    elif opt.daemon:
+        server.timeout = DAEMON_TIMEOUT
+    return server
+
+
+def preload():
+    """Run ``PRELOAD_FUNCS`` (in a background thread)"""
+    for func_name in PRELOAD_FUNCS:
+        t0 = time.perf_counter()
+        _, exc = call_func(func_name, [], {})
+        if exc is not None:
+            logger.warning(f"SERVER: preload {func_name} failed:\n{exc}")
+        else:
+            dt = time.perf_counter() - t0
+            logger.info(f"SERVER: preload {func_name} done in {dt:.1f}s")
+
+
+def write_ready_file(ready_file):
+    """Write ``ready_file`` with the server pid to signal the server is listening"""
+    tmp_file = f"{ready_file}.tmp"
+    with open(tmp_file, "w") as fh:
+        print(os.getpid(), file=fh)
+    os.replace(tmp_file, ready_file)
+
+
+def main(args=None):
+    global KEY, DISPATCHER, MEMO_CACHE  # noqa: PLW0603 Using the global statement is discouraged
+
+    opt = get_options(args)
+    if (opt.daemon or opt.control) and not opt.socket:
+        raise ValueError("--daemon and --control require --socket")
+    if opt.control:
+        print(send_control(opt.socket, opt.control))
+        return
+
+    DISPATCHER = Dispatcher(n_threads=opt.threads, n_processes=opt.processes)
+    MEMO_CACHE = MemoCache(maxsize=opt.memo_size)
+
+    if opt.daemon:
+        # The daemon makes its own key and writes it to the daemon info file
+        # next to the socket for starcheck runs to read.
+        address = opt.socket
+        KEY = secrets.token_hex(16)
+        loglevel = "1"
+    else:
+        # Read the address (TCP port number or Unix domain socket path), key, and
+        # log level from STDIN
+        address = sys.stdin.readline().strip()
+        KEY = sys.stdin.readline().strip()
+        loglevel = sys.stdin.readline().strip()
+
+    set_log_level(loglevel)
+    server = get_server(address, opt)
+
+    with server:
+        try:
+            # The server is listening now, so signal that it is ready and then do
+            # the slow imports and data loads in the background.
+            if opt.daemon:
+                write_daemon_info(address, opt.encoding)
+            if opt.ready_file:
+                write_ready_file(opt.ready_file)
+            if opt.preload:
+                threading.Thread(target=preload, daemon=True).start()
+            # Activate the server; this will keep running until you
+            # interrupt the program with Ctrl-C (or shutdown_server for a daemon)
+            while not SHUTDOWN.is_set():
+                server.handle_request()
+        finally:
+            if opt.daemon:
+                for path in (get_daemon_info_file(address), address):
+                    if os.path.exists(path):
+                        os.unlink(path)
 
 
 if __name__ == "__main__":
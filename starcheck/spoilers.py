@@ -0,0 +1,169 @@
+"""
+Spoiler, fid spoiler and common column checks of a star catalog.
+
+These compare every catalog entry with every star in the AGASC cone of the
+observation (kept in the server, see ``starcheck.cones``) as numpy arrays, and
+return the warnings in the order and format of the original per-star Perl loop
+in ``Ska::Starcheck::Obsid::check_star_catalog``.
+"""
+
+import re
+
+import numpy as np
+
+from starcheck import cones
+
+# Track box spoiler ACA-022: star within this y and z separation (arcsec) ...
+SPOILER_DIST = 25
+# ... and brighter than the catalog star mag + SPOILER_DMAG (red if + SPOILER_DMAG_RED)
+SPOILER_DMAG = -1.0
+SPOILER_DMAG_RED = -0.2
+
+# Fid spoiler ACA-024: star within dither + FID_SPOILER_PAD (arcsec) in y and z ...
+FID_SPOILER_PAD = 25
+# ... and brighter than the fid mag + FID_SPOILER_DMAG (red if + FID_SPOILER_DMAG_RED)
+FID_SPOILER_DMAG = -5.0
+FID_SPOILER_DMAG_RED = -4.0
+
+# Common column ACA-026: only for stars with abs(yag) less than this (arcsec)
+COL_MAX_YAG = 2500
+
+PERL_NUMBER = re.compile(r"\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+
+
+def perl_float(val):
+    """
+    Convert ``val`` to float the way Perl numifies a scalar.
+
+    The leading number of a string is used, and a string without one (e.g. '---')
+    or None is 0.
+
+    :param val: number, string or None
+    :returns: float
+    """
+    if val is None:
+        return 0.0
+    if isinstance(val, (int, float)):
+        return float(val)
+    match = PERL_NUMBER.match(val)
+    return float(match.group(1)) if match else 0.0
+
+
+def spoiler_warnings(
+    handle,
+    catalog,
+    dither_y,
+    dither_p,
+    *,
+    id_dist_limit=1.5,
+    col_sep_dist=50,
+    col_sep_mag=4.5,
+):
+    """
+    Get the spoiler, fid spoiler and common column warnings for a star catalog.
+
+    Each catalog entry is a dict with the keys (from the Perl catalog) idx, type,
+    id (GS_ID without spaces or '*'), yag, zag and mag (GS_MAG, which can be
+    '---').  For each entry the cone stars are taken in order of distance from the
+    entry, skipping the catalog star itself (same id, or within ``id_dist_limit``
+    in y and z and 0.1 in mag), and each star can give a fid spoiler (FID), a
+    spoiler (BOT, GUI) and a common column (not MON) warning, in that order.
+
+    :param handle: AGASC cone handle
+    :param catalog: list of catalog entry dicts
+    :param dither_y: guide dither amplitude in y (arcsec, None for 0)
+    :param dither_p: guide dither amplitude in z (arcsec, None for 0)
+    :param id_dist_limit: star identification box half-size (arcsec)
+    :param col_sep_dist: common column z separation (arcsec)
+    :param col_sep_mag: common column mag separation
+    :returns: dict of str(idx) to list of [level, message] with level 'warn' or
+        'yellow_warn'
+    """
+    stars = cones.get_stars(handle)
+    star_ids = np.asarray(stars["AGASC_ID"])
+    star_yags = np.asarray(stars["yang"], dtype=np.float64)
+    star_zags = np.asarray(stars["zang"], dtype=np.float64)
+    star_mags = np.asarray(stars["MAG_ACA"], dtype=np.float64)
+    dither_y = perl_float(dither_y)
+    dither_p = perl_float(dither_p)
+
+    out = {}
+    for entry in catalog:
+        yag = perl_float(entry["yag"])
+        zag = perl_float(entry["zag"])
+        has_mag = entry["mag"] != "---"
+        mag = perl_float(entry["mag"])
+        entry_type = entry["type"]
+
+        dys = np.abs(yag - star_yags)
+        dzs = np.abs(zag - star_zags)
+        drs = np.sqrt(dzs**2 + dys**2)
+        dms = mag - star_mags if has_mag else np.zeros(len(stars))
+
+        is_self = (star_ids.astype(str) == str(entry["id"])) | (
+            (dys < id_dist_limit)
+            & (dzs < id_dist_limit)
+            & (np.abs(star_mags - mag) < 0.1)
+        )
+        fid_spoil = (
+            (entry_type == "FID")
+            & (dzs < dither_p + FID_SPOILER_PAD)
+            & (dys < dither_y + FID_SPOILER_PAD)
+            & (dms > FID_SPOILER_DMAG)
+        )
+        spoil = (
+            (entry_type in ("BOT", "GUI"))
+            & (dzs < SPOILER_DIST)
+            & (dys < SPOILER_DIST)
+            & (dms > SPOILER_DMAG)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            between = (
+                (star_yags / yag > 1.0) if yag != 0 else np.zeros(len(stars), bool)
+            )
+        common_col = (
+            (entry_type != "MON")
+            & (dzs < col_sep_dist)
+            & (dms > col_sep_mag)
+            & between
+            & (np.abs(star_yags) < COL_MAX_YAG)
+        )
+
+        idxs = np.flatnonzero(~is_self & (fid_spoil | spoil | common_col))
+        idxs = idxs[np.argsort(dys[idxs] ** 2 + dzs[idxs] ** 2, kind="stable")]
+        warns = []
+        for idx in idxs:
+            seps = (int(star_ids[idx]), dys[idx], dzs[idx], drs[idx])
+            dm_string = f"{dms[idx]:4.1f}" if has_mag else "?"
+            if fid_spoil[idx]:
+                warns.append(
+                    [
+                        "warn" if dms[idx] > FID_SPOILER_DMAG_RED else "yellow_warn",
+                        "[%2d] Fid spoiler.  %10d: Y,Z,Radial,Mag seps: %3d %3d %3d %4s\n"
+                        % (entry["idx"], *seps, dm_string),
+                    ]
+                )
+            if spoil[idx]:
+                warns.append(
+                    [
+                        "warn" if dms[idx] > SPOILER_DMAG_RED else "yellow_warn",
+                        "[%2d] Spoiler. %10d: Y,Z,Radial,Mag seps: %3d %3d %3d %4s\n"
+                        % (entry["idx"], *seps, dm_string),
+                    ]
+                )
+            if common_col[idx]:
+                warns.append(
+                    [
+                        "warn",
+                        "[%2d] Common Column. %10d at Y,Z,Mag: %5d %5d %5.2f\n"
+                        % (
+                            entry["idx"],
+                            star_ids[idx],
+                            star_yags[idx],
+                            star_zags[idx],
+                            star_mags[idx],
+                        ),
+                    ]
+                )
+        out[str(entry["idx"])] = warns
+    return out
@@ -54,7 +54,7 @@ my $ID_DIST_LIMIT = 1.5;    # 1.5 arcsec box for ID'ing a star
 my $agasc_start_date = '2000:001:00:00:00.000';
 
 # Actual science global structures.
-my @bad_pixels;
+my $bad_pixel_file;
 my %odb;
 my %bad_acqs;
 my %bad_gui;
@@ -80,7 +80,9 @@ sub new {
     @{ $self->{fyi} } = ();
     $self->{n_guide_summ} = 0;
     @{ $self->{commands} } = ();
-    %{ $self->{agasc_hash} } = ();
+
+    # Handle for the AGASC cone of stars kept in the Python server (see get_agasc_stars)
+    $self->{agasc_cone} = undef;
 
     #    @{$self->{agasc_stars}} = ();
     $self->{ccd_temp} = undef;
@@ -139,23 +141,15 @@ sub set_odb {
 ##################################################################################
 sub set_ACA_bad_pixels {
 ##################################################################################
+    # Read the ACA bad pixels into the bad pixel index on the Python side (see
+    # starcheck/bad_pixels.py), which is used for the ACA-025 check.  Returns false
+    # only if the file cannot be read; any error on the Python side is fatal.
     my $pixel_file = shift;
-    my @tmp = io($pixel_file)->slurp;
-    my @lines = grep { /^\s+(\d|-)/ } @tmp;
-    foreach (@lines) {
-        my @line = split /;|,/, $_;
-        foreach my $i ($line[0] .. $line[1]) {
-            foreach my $j ($line[2] .. $line[3]) {
-                my $pixel = {
-                    'row' => $i,
-                    'col' => $j
-                };
-                push @bad_pixels, $pixel;
-            }
-        }
-    }
-
-    print STDERR "Read ", ($#bad_pixels + 1), " ACA bad pixels from $pixel_file\n";
+    return unless -r $pixel_file;
+    my $n_pixels = call_python("bad_pixels.read_bad_pixels", [$pixel_file]);
+    $bad_pixel_file = $pixel_file;
+    print STDERR "Read $n_pixels ACA bad pixels from $pixel_file\n";
+    return 1;
 }
 
 
@@ -424,8 +418,8 @@ sub set_ps_times {
         $self->{or_er_stop} = undef;
     }
     else {
-        $self->{or_er_start} = date2time($or_er_start);
-        $self->{or_er_stop} = date2time($or_er_stop);
+        ($self->{or_er_start}, $self->{or_er_stop}) =
+          @{ date2time([ $or_er_start, $or_er_stop ]) };
     }
 
 }
@@ -949,22 +943,17 @@ sub check_bright_perigee {
     my $c = find_command($self, 'MP_STARCAT');
     return if (not defined $c);
 
-    my @mags = ();
-    for my $i (1 .. 16) {
-        if ($c->{"TYPE$i"} =~ /GUI|BOT/) {
-            my $mag = $c->{"GS_MAG$i"};
-            push @mags, $mag;
-        }
-    }
-
-    # Pass 1 to guide_count as count_9th kwarg to use the count_9th mode
+    # Use the count_9th guide count from set_guide_counts() if there is one, else
+    # pass 1 to guide_count as count_9th kwarg to use the count_9th mode
     my $bright_count = sprintf(
         "%.1f",
-        call_python(
+        defined $self->{guide_counts}
+        ? $self->{guide_counts}->{guide_count_9th}
+        : call_python(
             "utils.guide_count",
             [],
             {
-                mags => \@mags,
+                mags => [ $self->guide_star_mags() ],
                 t_ccd => $self->{ccd_temp},
                 count_9th => 1,
                 date => $self->{date},
@@ -1270,6 +1259,68 @@ sub check_star_catalog {
         }
     }
 
+    # Get the pixel row/col for every catalog entry in one call
+    my @pix_idxs = grep { $c->{"TYPE$_"} ne 'NUL' } (1 .. 16);
+    my %pixels;
+    if (@pix_idxs) {
+        my @yags = map { 0 + $c->{"YANG$_"} } @pix_idxs;
+        my @zags = map { 0 + $c->{"ZANG$_"} } @pix_idxs;
+        my ($pix_rows, $pix_cols) =
+          @{ call_python("utils._yagzag_to_pixels", [ \@yags, \@zags ]) };
+        @pixels{@pix_idxs} =
+          map { [ $pix_rows->[$_], $pix_cols->[$_] ] } (0 .. $#pix_idxs);
+    }
+
+    # Get the nearby ACA bad pixel warnings for the guide stars in one call
+    my %bad_pixel_warns;
+    my @gui_idxs = grep { $c->{"TYPE$_"} =~ /GUI|BOT/ } @pix_idxs;
+    if (defined $bad_pixel_file and @gui_idxs) {
+        my @entries = map {
+            my ($row, $col) = @{ $pixels{$_} };
+            +{ idx => $_, row => $row, col => $col }
+        } @gui_idxs;
+        %bad_pixel_warns = %{
+            call_python(
+                "bad_pixels.bad_pixel_warnings",
+                [
+                    $bad_pixel_file, \@entries,
+                    $self->{dither_guide}->{ampl_y}, $self->{dither_guide}->{ampl_p}
+                ]
+            )
+        };
+    }
+
+    # Get the spoiler, fid spoiler and common column warnings for all the catalog
+    # entries from the AGASC cone in one call (see starcheck/spoilers.py)
+    my %spoiler_warns;
+    if (defined $self->{agasc_cone}) {
+        my @entries = map {
+            (my $sid = $c->{"GS_ID$_"}) =~ s/[\s\*]//g;
+            +{
+                idx => $_,
+                type => $c->{"TYPE$_"},
+                id => $sid,
+                yag => $c->{"YANG$_"},
+                zag => $c->{"ZANG$_"},
+                mag => $c->{"GS_MAG$_"}
+            }
+        } @pix_idxs;
+        %spoiler_warns = %{
+            call_python(
+                "spoilers.spoiler_warnings",
+                [
+                    $self->{agasc_cone}, \@entries,
+                    $self->{dither_guide}->{ampl_y}, $self->{dither_guide}->{ampl_p}
+                ],
+                {
+                    id_dist_limit => $ID_DIST_LIMIT,
+                    col_sep_dist => $col_sep_dist,
+                    col_sep_mag => $col_sep_mag
+                }
+            )
+        };
+    }
+
     # Seed smallest maximums and largest minimums for guide star box
     my $max_y = -3000;
     my $min_y = 3000;
@@ -1393,8 +1444,7 @@ sub check_star_catalog {
 
         # Star/fid outside of CCD boundaries
         # ACA-019 ACA-020 ACA-021
-        my ($pixel_row, $pixel_col) =
-          @{ call_python("utils._yagzag_to_pixels", [ $yag, $zag ]) };
+        my ($pixel_row, $pixel_col) = @{ $pixels{$i} };
 
         # Set "acq phase" dither to acq dither or 20.0 if undefined
         my $dither_acq_y = $self->{dither_acq}->{ampl_y} or 20.0;
@@ -1572,86 +1622,15 @@ sub check_star_catalog {
           sprintf("[%2d] Readout Size. %s Should be 8x8\n", $i, $c->{"SIZE$i"})
           if ($type =~ /MON/ && $c->{"SIZE$i"} ne "8x8");
 
-        # Bad Pixels ACA-025
-        my @close_pixels;
-        my @dr;
-        if ($type =~ /GUI|BOT/) {
-            foreach my $pixel (@bad_pixels) {
-                my $dy = abs($pixel_row - $pixel->{row}) * 5;
-                my $dz = abs($pixel_col - $pixel->{col}) * 5;
-                my $dr = sqrt($dy**2 + $dz**2);
-                next
-                  unless ($dz < $self->{dither_guide}->{ampl_p} + 25
-                    and $dy < $self->{dither_guide}->{ampl_y} + 25);
-                push @close_pixels,
-                  sprintf(" row, col (%d, %d), dy, dz (%d, %d) \n",
-                    $pixel->{row}, $pixel->{col}, $dy, $dz);
-                push @dr, $dr;
-            }
-            if (@close_pixels > 0) {
-                my ($closest) = sort { $dr[$a] <=> $dr[$b] } (0 .. $#dr);
-                my $warn =
-                  sprintf("[%2d] Nearby ACA bad pixel. " . $close_pixels[$closest], $i)
-                  ;    #Only warn for the closest pixel
-                push @warn, $warn;
-            }
-        }
-
-        # Spoiler star (for search) and common column
-
-        foreach my $star (values %{ $self->{agasc_hash} }) {
-
-            # Skip tests if $star is the same as the catalog star
-            next
-              if (
-                $star->{id} eq $sid
-                || (   abs($star->{yag} - $yag) < $ID_DIST_LIMIT
-                    && abs($star->{zag} - $zag) < $ID_DIST_LIMIT
-                    && abs($star->{mag_aca} - $mag) < 0.1)
-              );
-            my $dy = abs($yag - $star->{yag});
-            my $dz = abs($zag - $star->{zag});
-            my $dr = sqrt($dz**2 + $dy**2);
-            my $dm = $mag ne '---' ? $mag - $star->{mag_aca} : 0.0;
-            my $dm_string =
-              $mag ne '---' ? sprintf("%4.1f", $mag - $star->{mag_aca}) : '?';
-
-     # Fid within $dither + 25 arcsec of a star (yellow) and within 4 mags (red) ACA-024
-            if (    $type eq 'FID'
-                and $dz < $self->{dither_guide}->{ampl_p} + 25
-                and $dy < $self->{dither_guide}->{ampl_y} + 25
-                and $dm > -5.0)
-            {
-                my $warn =
-                  sprintf("[%2d] Fid spoiler.  %10d: "
-                      . "Y,Z,Radial,Mag seps: %3d %3d %3d %4s\n",
-                    $i, $star->{id}, $dy, $dz, $dr, $dm_string);
-                if ($dm > -4.0) { push @warn, $warn }
-                else { push @yellow_warn, $warn }
-            }
-
-            # Spoiler star in track box ACA-022
-            if (($type =~ /BOT|GUI/) and ($dz < 25) and ($dy < 25) and ($dm > -1.0)) {
-                my $warn = sprintf(
-                    "[%2d] Spoiler. %10d: " . "Y,Z,Radial,Mag seps: %3d %3d %3d %4s\n",
-                    $i, $star->{id}, $dy, $dz, $dr, $dm_string);
-                if ($dm > -0.2) { push @warn, $warn }
-                else { push @yellow_warn, $warn }
-            }
+        # Bad Pixels ACA-025, only warn for the closest pixel
+        push @warn, $bad_pixel_warns{$i} if defined $bad_pixel_warns{$i};
 
-
-           # Common column: dz within limit, spoiler is $col_sep_mag brighter than star,
-            # and spoiler is located between star and readout ACA-026
-            if (    $type ne 'MON'
-                and $dz < $col_sep_dist
-                and $dm > $col_sep_mag
-                and ($star->{yag} / $yag) > 1.0
-                and abs($star->{yag}) < 2500)
-            {
-                push @warn,
-                  sprintf("[%2d] Common Column. %10d " . "at Y,Z,Mag: %5d %5d %5.2f\n",
-                    $i, $star->{id}, $star->{yag}, $star->{zag}, $star->{mag_aca});
-            }
+        # Spoiler star (for search) ACA-022, fid spoiler ACA-024 and common column
+        # ACA-026, for each nearby star in order of distance
+        foreach my $spoiler_warn (@{ $spoiler_warns{$i} || [] }) {
+            my ($level, $warn) = @{$spoiler_warn};
+            if ($level eq 'warn') { push @warn, $warn }
+            else { push @yellow_warn, $warn }
         }
     }
 
@@ -2624,23 +2603,78 @@ sub get_agasc_stars {
     my $c;
     return unless ($c = find_command($self, "MP_TARGQUAT"));
 
-    # Use Python agasc to fetch the stars into a hash
-    $self->{agasc_hash} = call_python("utils._get_agasc_stars",
-        [ $self->{ra}, $self->{dec}, $self->{roll}, 1.3, $self->{date}, $agasc_file ]);
+    # Use Python agasc to fetch the stars into a cone kept in the server, and
+    # just keep the handle here.  Stars with bad mags (< -10) come back directly.
+    my $cone = call_python(
+        "cones.get_cone",
+        [ $self->{dot_obsid}, $self->{ra}, $self->{dec}, $self->{roll}, 1.3 ],
+        { date => $self->{date}, agasc_file => $agasc_file }
+    );
+    $self->{agasc_cone} = $cone->{handle};
 
-    foreach my $star (values %{ $self->{agasc_hash} }) {
-        if ($star->{'mag_aca'} < -10 or $star->{'mag_aca_err'} < -10) {
-            push @{ $self->{warn} },
-              sprintf(
-                "Star with bad mag %.1f or magerr %.1f at (yag,zag)=%.1f,%.1f\n",
-                $star->{'mag_aca'}, $star->{'mag_aca_err'},
-                $star->{'yag'}, $star->{'zag'}
-              );
-        }
+    foreach my $star (@{ $cone->{bad_mag_stars} }) {
+        push @{ $self->{warn} },
+          sprintf(
+            "Star with bad mag %.1f or magerr %.1f at (yag,zag)=%.1f,%.1f\n",
+            $star->{'mag_aca'}, $star->{'mag_aca_err'},
+            $star->{'yag'}, $star->{'zag'}
+          );
     }
 
 }
 
+#############################################################################################
+sub prefetch_agasc_cones {
+#############################################################################################
+    # Read the AGASC cones for all the observations @obs with a target attitude in
+    # one call, so that nearby attitudes share AGASC reads.  get_agasc_stars() then
+    # gets each cone from the server cache.
+    my $agasc_file = shift;
+    my @obs = grep { find_command($_, "MP_TARGQUAT") } @_;
+    return unless @obs;
+    my @attitudes = map { [ $_->{ra}, $_->{dec}, $_->{roll}, $_->{date} ] } @obs;
+    return call_python("cones.prefetch_cones", [ \@attitudes, $agasc_file ]);
+}
+
+#############################################################################################
+sub agasc_stars_by_id {
+#############################################################################################
+    # Get the stars in the AGASC cone with ids in list ref $star_ids as a hash ref
+    # of star hashes keyed by id.  Ids not in the cone are not in the result.
+    my $self = shift;
+    my $star_ids = shift;
+    my @ids = grep { defined $_ and /^\d+$/ } @{$star_ids};
+    return {} unless defined $self->{agasc_cone} and @ids;
+    return call_python("cones.get_stars_by_id", [ $self->{agasc_cone}, \@ids ]);
+}
+
+#############################################################################################
+sub agasc_identify_stars {
+#############################################################################################
+    # Identify stars in the AGASC cone at the positions in list ref $positions of
+    # [yag, zag] (arcsec), using the closest star within $dist_limit in y and z.
+    # Returns a list ref (one per position) of hashes with keys star (star hash or
+    # undef), n_matches and ambiguous.
+    my $self = shift;
+    my ($positions, $dist_limit) = @_;
+    return [ map { +{ star => undef, n_matches => 0, ambiguous => 0 } } @{$positions} ]
+      unless defined $self->{agasc_cone} and @{$positions};
+    return call_python("cones.identify_stars",
+        [ $self->{agasc_cone}, $positions, $dist_limit ]);
+}
+
+#############################################################################################
+sub agasc_stars_brighter {
+#############################################################################################
+    # Get up to $max_stars stars in the AGASC cone with mag_aca <= $mag, as a list
+    # ref of star hashes sorted by mag (brightest first).
+    my $self = shift;
+    my ($mag, $max_stars) = @_;
+    return [] unless defined $self->{agasc_cone};
+    return call_python("cones.get_stars_brighter",
+        [ $self->{agasc_cone}, $mag, $max_stars ]);
+}
+
 #############################################################################################
 sub identify_stars {
 #############################################################################################
@@ -2650,7 +2684,31 @@ sub identify_stars {
 
     my $manvr = find_command($self, "MP_TARGQUAT");
 
-    my $obs_time = $c->{time};
+    # Ids of identified stars by catalog index, for the star history
+    my %dbhist_ids;
+
+    # Get the catalog stars from the AGASC cone by id in one call
+    my $agasc_stars = $self->agasc_stars_by_id(
+        [
+            map { $c->{"GS_ID$_"} }
+            grep { $c->{"TYPE$_"} ne 'NUL' and $c->{"TYPE$_"} ne 'FID' } (1 .. 16)
+        ]
+    );
+
+    # Identify the entries that are not in the cone by id (the '---' cases) by
+    # position, all in one call
+    my @pos_idxs = grep {
+              $c->{"TYPE$_"} ne 'NUL'
+          and $c->{"TYPE$_"} ne 'FID'
+          and not defined $agasc_stars->{ $c->{"GS_ID$_"} }
+    } (1 .. 16);
+    my %pos_matches;
+    @pos_matches{@pos_idxs} = @{
+        $self->agasc_identify_stars(
+            [ map { [ $c->{"YANG$_"}, $c->{"ZANG$_"} ] } @pos_idxs ],
+            $ID_DIST_LIMIT
+        )
+    };
 
     for my $i (1 .. 16) {
         my $type = $c->{"TYPE$i"};
@@ -2668,7 +2726,7 @@ sub identify_stars {
 
      # if the star is defined in the guide summary but doesn't seem to be present in the
         # agasc hash for this ra and dec, throw a warning
-        unless ((defined $self->{agasc_hash}{$gs_id}) or ($gs_id eq '---')) {
+        unless ((defined $agasc_stars->{$gs_id}) or ($gs_id eq '---')) {
             push @{ $self->{warn} },
               sprintf(
                 "[%2d] Star $gs_id is not in retrieved AGASC region by RA and DEC! \n",
@@ -2678,8 +2736,8 @@ sub identify_stars {
         # if the star is defined in the agasc hash, copy
         # the information from the agasc to the catalog
 
-        if (defined $self->{agasc_hash}{$gs_id}) {
-            my $star = $self->{agasc_hash}{$gs_id};
+        if (defined $agasc_stars->{$gs_id}) {
+            my $star = $agasc_stars->{$gs_id};
 
             # Confirm that the agasc magnitude matches the guide star summary magnitude
             my $gs_mag = $c->{"GS_MAG$i"};
@@ -2728,49 +2786,73 @@ sub identify_stars {
             $c->{"GS_POSERR$i"} = $star->{poserr};
             $c->{"GS_CLASS$i"} = $star->{class};
             $c->{"GS_ASPQ$i"} = $star->{aspq};
-            my $db_hist = star_dbhist("$gs_id", $obs_time);
-            $c->{"GS_USEDBEFORE$i"} = $db_hist;
+            $dbhist_ids{$i} = "$gs_id";
 
         }
         else {
-            # This loop should just get the $gs_id eq '---' cases
-            foreach my $star (values %{ $self->{agasc_hash} }) {
-                if (   abs($star->{yag} - $yag) < $ID_DIST_LIMIT
-                    && abs($star->{zag} - $zag) < $ID_DIST_LIMIT)
-                {
-                    $c->{"GS_IDENTIFIED$i"} = 1;
-                    $c->{"GS_BV$i"} = $star->{bv};
-                    $c->{"GS_MAGERR$i"} = $star->{mag_aca_err};
-                    $c->{"GS_POSERR$i"} = $star->{poserr};
-                    $c->{"GS_CLASS$i"} = $star->{class};
-                    $c->{"GS_ASPQ$i"} = $star->{aspq};
-                    $c->{"GS_ID$i"} = "*$star->{id}";
-                    $c->{"GS_RA$i"} = $star->{ra};
-                    $c->{"GS_DEC$i"} = $star->{dec};
-                    $c->{"GS_MAG$i"} = sprintf "%8.3f", $star->{mag_aca};
-                    $c->{"GS_YANG$i"} = $star->{yag};
-                    $c->{"GS_ZANG$i"} = $star->{zag};
-                    $c->{"GS_USEDBEFORE$i"} = star_dbhist($star->{id}, $obs_time);
-                    last;
+            # This should just get the $gs_id eq '---' cases.  Use the closest
+            # star within $ID_DIST_LIMIT in y and z.
+            my $match = $pos_matches{$i};
+            my $star = $match->{star};
+            if (defined $star) {
+                if ($match->{ambiguous}) {
+                    push @{ $self->{yellow_warn} },
+                      sprintf(
+                        "[%2d] Ambiguous identification by position: %d AGASC stars "
+                          . "within %.1f arcsec\n",
+                        $i, $match->{n_matches}, $ID_DIST_LIMIT
+                      );
                 }
+                $c->{"GS_IDENTIFIED$i"} = 1;
+                $c->{"GS_BV$i"} = $star->{bv};
+                $c->{"GS_MAGERR$i"} = $star->{mag_aca_err};
+                $c->{"GS_POSERR$i"} = $star->{poserr};
+                $c->{"GS_CLASS$i"} = $star->{class};
+                $c->{"GS_ASPQ$i"} = $star->{aspq};
+                $c->{"GS_ID$i"} = "*$star->{id}";
+                $c->{"GS_RA$i"} = $star->{ra};
+                $c->{"GS_DEC$i"} = $star->{dec};
+                $c->{"GS_MAG$i"} = sprintf "%8.3f", $star->{mag_aca};
+                $c->{"GS_YANG$i"} = $star->{yag};
+                $c->{"GS_ZANG$i"} = $star->{zag};
+                $dbhist_ids{$i} = $star->{id};
             }
 
         }
     }
+
+    # Star history (GS_USEDBEFORE) is set for all observations at once by
+    # set_star_dbhists().
+    $self->{dbhist_ids} = \%dbhist_ids;
 }
 
 #############################################################################################
-sub star_dbhist {
+sub set_star_dbhists {
 #############################################################################################
-
-    my $star_id = shift;
-    my $obs_tstart = shift;
-
-    my $obs_tstart_minus_day = $obs_tstart - 86400;
-
-    return call_python("utils.get_mica_star_stats",
-        [ $star_id, $obs_tstart_minus_day ]);
-
+    # Set the star history GS_USEDBEFORE for the stars found by identify_stars() in
+    # all the observations @obs, using one call to the Python side.  The history for
+    # each star is from before one day prior to the catalog time.
+
+    my @obs = @_;
+    my (@stars, @ids, @times);
+    for my $obs (@obs) {
+        next unless (defined $obs->{dbhist_ids});
+        my $dbhist_ids = delete $obs->{dbhist_ids};
+        my $c = find_command($obs, 'MP_STARCAT');
+        for my $i (sort { $a <=> $b } keys %{$dbhist_ids}) {
+            push @stars, [ $obs, $c, $i ];
+            push @ids, $dbhist_ids->{$i};
+            push @times, $c->{time} - 86400;
+        }
+    }
+    return unless @stars;
+
+    # A failure here is fatal, as it was for the per-star calls
+    my $dbhists = call_python("utils.get_mica_star_stats_batch", [ \@ids, \@times ]);
+    for my $n (0 .. $#stars) {
+        my ($obs, $c, $i) = @{ $stars[$n] };
+        $c->{"GS_USEDBEFORE$i"} = { map { $_ => $dbhists->{$_}->[$n] } keys %{$dbhists} };
+    }
 }
 
 #############################################################################################
@@ -2786,27 +2868,24 @@ sub star_image_map {
         and (defined $self->{roll}));
     my $obsid = $self->{obsid};
 
-    # a hash of the agasc ids we want to plot
-    my %plot_ids;
+    # a hash of the agasc stars we want to plot, keyed by id
 
     # first the catalog ones
-    for my $i (1 .. 16) {
-        next if ($c->{"TYPE$i"} eq 'NUL');
-        next if ($c->{"TYPE$i"} eq 'FID');
-        if (defined $self->{agasc_hash}->{ $c->{"GS_ID${i}"} }) {
-            $plot_ids{ $c->{"GS_ID${i}"} } = 1;
-        }
-    }
+    my %plot_stars = %{
+        $self->agasc_stars_by_id(
+            [
+                map { $c->{"GS_ID${_}"} }
+                grep { $c->{"TYPE$_"} ne 'NUL' and $c->{"TYPE$_"} ne 'FID' } (1 .. 16)
+            ]
+        )
+    };
 
-    # then up to 100 of the stars in the field brighter than
+    # then up to 100 of the brightest stars in the field brighter than
     # the faint plot limit
     my $star_count_limit = 100;
-    my $star_count = 0;
-    foreach my $star (values %{ $self->{agasc_hash} }) {
-        next if ($star->{mag_aca} > $faint_plot_mag);
-        $plot_ids{ $star->{id} } = 1;
-        last if $star_count > $star_count_limit;
-        $star_count++;
+    foreach my $star (@{ $self->agasc_stars_brighter($faint_plot_mag, $star_count_limit) })
+    {
+        $plot_stars{ $star->{id} } = $star;
     }
 
     # For a 798x798 image (native with dpi=150), -2900 to 2900 arcsec is 619 pixels.
@@ -2818,18 +2897,18 @@ sub star_image_map {
     my $y_offset = 63 * $img_size_scale;
 
     # Convert all the yag/zags to pixel rows/cols
-    my @yags = map { $self->{agasc_hash}->{$_}->{yag} } keys %plot_ids;
-    my @zags = map { $self->{agasc_hash}->{$_}->{zag} } keys %plot_ids;
+    my @star_ids = keys %plot_stars;
+    my @yags = map { $plot_stars{$_}->{yag} } @star_ids;
+    my @zags = map { $plot_stars{$_}->{zag} } @star_ids;
     my ($pix_rows, $pix_cols) =
       @{ call_python("utils._yagzag_to_pixels", [ \@yags, \@zags ]) };
 
     my $map = "<map name=\"starmap_${obsid}\" id=\"starmap_${obsid}\"> \n";
-    my @star_ids = keys %plot_ids;
     for my $idx (0 .. $#star_ids) {
         my $star_id = $star_ids[$idx];
         my $pix_row = $pix_rows->[$idx];
         my $pix_col = $pix_cols->[$idx];
-        my $cat_star = $self->{agasc_hash}->{$star_id};
+        my $cat_star = $plot_stars{$star_id};
         my $sid = $cat_star->{id};
         my $yag = $cat_star->{yag};
         my $zag = $cat_star->{zag};
@@ -2889,21 +2968,7 @@ sub check_guide_count {
 ###################################################################################
     my $self = shift;
 
-    # Disable dynamic background if guide dither is disabled or amplitude is small.
-    # The dynamic background isn't as effective with small dither so the temperature
-    # "bonus" should not be applied to the guide count.  Introduced in PR #452.
-    my $guide_dither = $self->{dither_guide};
-    my $dyn_bgd;
-    my $guide_dither_ampl_y = $guide_dither->{ampl_y_int};
-    my $guide_dither_ampl_p = $guide_dither->{ampl_p_int};
-    if (   ($guide_dither->{state} eq 'DISA')
-        or (($guide_dither_ampl_y < 8) and ($guide_dither_ampl_p < 8)))
-    {
-        $dyn_bgd = 0;
-    }
-    else {
-        $dyn_bgd = 1;
-    }
+    my $dyn_bgd = $self->dyn_bgd_enabled();
 
     # If dyn_bgd is disabled, push an info statement
     if ($dyn_bgd == 0) {
@@ -2932,20 +2997,77 @@ sub check_guide_count {
     $self->{figure_of_merit}->{guide_count} = $guide_count;
 }
 
+###################################################################################
+sub dyn_bgd_enabled {
+###################################################################################
+    # Disable dynamic background if guide dither is disabled or amplitude is small.
+    # The dynamic background isn't as effective with small dither so the temperature
+    # "bonus" should not be applied to the guide count.  Introduced in PR #452.
+    my $self = shift;
+    my $guide_dither = $self->{dither_guide};
+    my $guide_dither_ampl_y = $guide_dither->{ampl_y_int};
+    my $guide_dither_ampl_p = $guide_dither->{ampl_p_int};
+    if (   ($guide_dither->{state} eq 'DISA')
+        or (($guide_dither_ampl_y < 8) and ($guide_dither_ampl_p < 8)))
+    {
+        return 0;
+    }
+    return 1;
+}
+
+###################################################################################
+sub guide_star_mags {
+###################################################################################
+    # Get the GS_MAG of the guide stars (GUI and BOT) in the catalog
+    my $self = shift;
+    my $c = find_command($self, 'MP_STARCAT');
+    return () unless defined $c;
+    return map { $c->{"GS_MAG$_"} } grep { $c->{"TYPE$_"} =~ /GUI|BOT/ } (1 .. 16);
+}
+
+###################################################################################
+sub set_guide_counts {
+###################################################################################
+    # Get the guide count and the count_9th guide count for the catalogs of all the
+    # observations @obs in one call to the Python side.  These are used by
+    # count_guide_stars() and check_bright_perigee(), and need the guide dither
+    # from check_dither().
+    my @obs = grep { defined find_command($_, 'MP_STARCAT') } @_;
+    return unless @obs;
+
+    my @dyn_bgds = map { $_->dyn_bgd_enabled() } @obs;
+    my $counts = call_python(
+        "utils.guide_count_batch",
+        [],
+        {
+            mags => [ map { [ $_->guide_star_mags() ] } @obs ],
+            t_ccds => [ map { $_->{ccd_temp} } @obs ],
+            dates => [ map { $_->{date} } @obs ],
+            dyn_bgds => \@dyn_bgds,
+        }
+    );
+    for my $n (0 .. $#obs) {
+        $obs[$n]->{guide_counts} = {
+            dyn_bgd => $dyn_bgds[$n],
+            guide_count => $counts->{guide_count}->[$n],
+            guide_count_9th => $counts->{guide_count_9th}->[$n],
+        };
+    }
+}
+
 ###################################################################################
 sub count_guide_stars {
 ###################################################################################
     my $self = shift;
     my $dyn_bgd = shift;
-    my $c;
 
-    return 0.0 unless ($c = find_command($self, 'MP_STARCAT'));
-    my @mags = ();
-    for my $i (1 .. 16) {
-        if ($c->{"TYPE$i"} =~ /GUI|BOT/) {
-            my $mag = $c->{"GS_MAG$i"};
-            push @mags, $mag;
-        }
+    return 0.0 unless (find_command($self, 'MP_STARCAT'));
+
+    # Use the guide count from set_guide_counts() if it is for this dyn_bgd
+    if (defined $self->{guide_counts}
+        and $self->{guide_counts}->{dyn_bgd} == $dyn_bgd)
+    {
+        return sprintf("%.1f", $self->{guide_counts}->{guide_count});
     }
 
     return sprintf(
@@ -2954,7 +3076,7 @@ sub count_guide_stars {
             "utils.guide_count",
             [],
             {
-                mags => \@mags,
+                mags => [ $self->guide_star_mags() ],
                 t_ccd => $self->{ccd_temp},
                 count_9th => 0,
                 date => $self->{date},
@@ -3148,6 +3270,23 @@ sub proseco_args {
 
 }
 
+###################################################################################
+sub set_proseco_probs {
+###################################################################################
+    # Get the proseco acq star probabilities, P2 and expected acq stars for all the
+    # observations @obs with proseco args in one call to the Python side, which
+    # spreads the proseco calls over a pool of processes.  These are used by
+    # set_proseco_probs_and_check_P2().
+    my @obs = grep { defined $_->{proseco_args} and %{ $_->{proseco_args} } } @_;
+    return unless @obs;
+
+    my $probs = call_python("utils.proseco_probs_batch",
+        [ [ map { $_->{proseco_args} } @obs ] ]);
+    for my $n (0 .. $#obs) {
+        $obs[$n]->{proseco_probs} = $probs->[$n];
+    }
+}
+
 ###################################################################################
 sub set_proseco_probs_and_check_P2 {
 ###################################################################################
@@ -3164,7 +3303,12 @@ sub set_proseco_probs_and_check_P2 {
     if (not %{$args}) {
         return;
     }
-    my ($p_acqs, $P2, $expected) = @{ call_python("utils.proseco_probs", [], $args) };
+    # Use the probabilities from set_proseco_probs() if there, else get them
+    my $probs = $self->{proseco_probs};
+    if (not defined $probs) {
+        $probs = call_python("utils.proseco_probs", [], $args);
+    }
+    my ($p_acqs, $P2, $expected) = @{$probs};
 
     $P2 = sprintf("%.1f", $P2);
 
@@ -3214,14 +3358,38 @@ sub set_dynamic_mag_limits {
     my $self = shift;
     return unless ($c = $self->find_command("MP_STARCAT"));
 
-    my $date = $c->{date};
-    my $t_ccd = $self->{ccd_temp_acq};
+    # Dynamic mag limits based on 75% and 50% chance of successful star acq from
+    # set_acq_mag_limits(), or get them for just this observation.
+    my $limits = $self->{acq_mag_limits};
+    if (not defined $limits) {
+        my $mags = call_python("mag_limits.get_acq_mag_limits",
+            [ [ $c->{date} ], [ $self->{ccd_temp_acq} ] ]);
+        $limits = { yellow => $mags->{yellow}->[0], red => $mags->{red}->[0] };
+    }
 
-    # Dynamic mag limits based on 75% and 50% chance of successful star acq
     # Maximum limits of 10.3 and 10.6
-    $self->{mag_faint_yellow} =
-      min(10.3, call_python("utils._mag_for_p_acq", [ 0.75, $date, $t_ccd ]));
-    $self->{mag_faint_red} =
-      min(10.6, call_python("utils._mag_for_p_acq", [ 0.5, $date, $t_ccd ]));
+    $self->{mag_faint_yellow} = min(10.3, $limits->{yellow});
+    $self->{mag_faint_red} = min(10.6, $limits->{red});
+}
+
+#############################################################################################
+sub set_acq_mag_limits {
+#############################################################################################
+    # Get the acquisition mag limits (p_acq of 0.75 and 0.5 at the catalog date and
+    # acquisition t_ccd) for all the observations @obs in one call to the Python
+    # side.  These are used by set_dynamic_mag_limits().
+    my @obs = grep { defined find_command($_, 'MP_STARCAT') } @_;
+    return unless @obs;
+    my $mags = call_python(
+        "mag_limits.get_acq_mag_limits",
+        [
+            [ map { find_command($_, 'MP_STARCAT')->{date} } @obs ],
+            [ map { $_->{ccd_temp_acq} } @obs ]
+        ]
+    );
+    for my $n (0 .. $#obs) {
+        $obs[$n]->{acq_mag_limits} =
+          { yellow => $mags->{yellow}->[$n], red => $mags->{red}->[$n] };
+    }
 }
 
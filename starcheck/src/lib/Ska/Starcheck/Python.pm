@@ -3,16 +3,19 @@ package Ska::Starcheck::Python;
 use strict;
 use warnings;
 use IO::Socket;
+use IO::Select;
 use JSON;
 use Carp qw(confess);
 use Data::Dumper;
+use POSIX ();
+use Time::HiRes qw(sleep);
 
 use vars qw($VERSION @ISA @EXPORT @EXPORT_OK %EXPORT_TAGS);
 require Exporter;
 
 our @ISA = qw(Exporter);
 our @EXPORT = qw();
-our @EXPORT_OK = qw(call_python date2time time2date set_port set_key);
+our @EXPORT_OK = qw(call_python call_python_batch call_python_async wait_python date2time time2date set_port set_key close_session);
 %EXPORT_TAGS = (all => \@EXPORT_OK);
 
 STDOUT->autoflush(1);
@@ -24,6 +27,33 @@ my $PORT = 40000;
 my $KEY = "fff";
 my $VERBOSE = 1;
 
+# Persistent session with the server: one connection that carries all the commands
+# of the run (requests and responses matched by id).
+my $PERSISTENT = 1;
+my $SESSION;
+my $REQUEST_ID = 0;
+
+# Responses read from the session for requests other than the one being waited
+# for.  With a server thread or process pool these can come back out of order.
+my %PENDING;
+
+# Set once the persistent session has been lost.  Commands are never resent on a
+# new session, since a command may already have run and a daemon keeps the state
+# of the run, so every later command fails.
+my $SESSION_LOST = 0;
+
+# Optional Unix domain socket transport.  If a socket path is set, commands and
+# responses are length-prefixed frames (4-byte big-endian length then payload)
+# encoded as JSON or MessagePack, instead of newline-delimited JSON over TCP.
+my $SOCKET_PATH;
+
+# File that the server writes once it is listening.  If set, the first connection
+# waits for this instead of retrying connections.
+my $READY_FILE;
+my $READY_TIMEOUT = 120;
+my $ENCODING = "json";
+my $MSGPACK;
+
 sub set_port {
     $PORT = shift;
 }
@@ -36,47 +66,276 @@ sub set_debug {
     $VERBOSE = shift;
 }
 
-sub call_python {
-    my $func = shift;
-    my $args = shift;
-    my $kwargs = shift;
-    if (!defined $args) { $args = []; }
-    if (!defined $kwargs) { $kwargs = {}; }
+sub set_persistent {
+    $PERSISTENT = shift;
+}
 
-    my $command = {
-        "func" => $func,
-        "args" => $args,
-        "kwargs" => $kwargs,
-        "key" => $KEY,
-    };
-    my $command_json = encode_json $command;
+sub set_socket_path {
+    $SOCKET_PATH = shift;
+}
 
-    if ($VERBOSE gt 2) {
-        print STDERR "CLIENT: Sending command $command_json\n";
+sub set_ready_file {
+    $READY_FILE = shift;
+}
+
+sub set_encoding {
+    $ENCODING = shift;
+    if ($ENCODING eq 'msgpack') {
+        require Data::MessagePack;
+        $MSGPACK = Data::MessagePack->new->utf8;
+    }
+}
+
+sub server_address {
+    return defined $SOCKET_PATH ? "socket $SOCKET_PATH" : "port $PORT on $HOST";
+}
+
+sub wait_ready {
+    # Wait for the server to write the ready file (once)
+    return if not defined $READY_FILE;
+    my $wait = 0;
+    while (not -e $READY_FILE) {
+        die "starcheck.server not ready after ${READY_TIMEOUT}s" if $wait > $READY_TIMEOUT;
+        sleep 0.01;
+        $wait += 0.01;
     }
+    undef $READY_FILE;
+}
+
+sub connect_server {
+    wait_ready();
     my $handle;
     my $iter = 0;
     while ($iter++ < 10) {
-        $handle = IO::Socket::INET->new(
+        $handle =
+          defined $SOCKET_PATH
+          ? IO::Socket::UNIX->new(
+            Type => SOCK_STREAM(),
+            Peer => $SOCKET_PATH
+          )
+          : IO::Socket::INET->new(
             Proto => "tcp",
             PeerAddr => $HOST,
             PeerPort => $PORT
-        );
+          );
         last if defined($handle);
         sleep 1;
     }
     if (!defined($handle)) {
-        die "Unable to connect to port $PORT on $HOST: $!";
+        die "Unable to connect to " . server_address() . ": $!";
     }
     $handle->autoflush(1);    # so output gets there right away
-    $handle->write("$command_json\n");
+    return $handle;
+}
+
+sub attach_daemon {
+    # Use the starcheck.server daemon listening on Unix domain socket $socket_path,
+    # first starting it with command @start_cmd if it is not running.  The daemon
+    # writes its key, encoding and pid to "$socket_path.json" once it is listening.
+    # Returns that info as a hash ref.
+    my $socket_path = shift;
+    my @start_cmd = @_;
+    my $info_file = "$socket_path.json";
+
+    # Check the daemon process from its info file instead of connecting, since a
+    # connection would be a session that waits behind any run using the daemon.
+    my $running = 0;
+    if (-e $info_file and -S $socket_path) {
+        my $info = read_daemon_info($info_file);
+        $running = (defined $info->{pid} and kill(0, $info->{pid}));
+    }
+    if (not $running) {
+        unlink $info_file;
+        my $daemon_pid = fork();
+        die "Unable to fork to start starcheck.server daemon: $!" if not defined $daemon_pid;
+        if ($daemon_pid == 0) {
+            # Detach from the starcheck run so the daemon outlives it
+            POSIX::setsid();
+            open(STDIN, '<', '/dev/null');
+            open(STDOUT, '>>', "$socket_path.log");
+            open(STDERR, '>&', \*STDOUT);
+            exec(@start_cmd) or POSIX::_exit(1);
+        }
+        my $wait = 0;
+        while (not -e $info_file) {
+            die "starcheck.server daemon did not start on $socket_path (see $socket_path.log)"
+              if $wait > 120;
+            sleep 0.1;
+            $wait += 0.1;
+        }
+    }
+
+    my $info = read_daemon_info($info_file);
+    set_socket_path($socket_path);
+    set_key($info->{key});
+    set_encoding($info->{encoding});
+    return $info;
+}
 
-    my $response = <$handle>;
-    $handle->close();
+sub read_daemon_info {
+    my $info_file = shift;
+    open(my $fh, '<', $info_file) or die "Unable to read $info_file: $!";
+    my $info = decode_json(do { local $/; <$fh> });
+    close($fh);
+    return $info;
+}
+
+sub begin_daemon_run {
+    # Start this run on the daemon with the begin_run command.  The daemon runs one
+    # session at a time, so if it is busy with another run wait up to $timeout
+    # secs for that run to finish, then give up.
+    my $timeout = shift;
+    my $command = make_command("begin_run");
+    local $SIG{PIPE} = 'IGNORE';
+    lose_session($command) if not send_request(encode_command($command));
+    my $select = IO::Select->new($SESSION);
+    if (not $select->can_read(5)) {
+        print STDERR "CLIENT: starcheck.server daemon on "
+          . server_address()
+          . " is busy with another run, waiting up to ${timeout}s\n";
+        if (not $select->can_read($timeout)) {
+            close_session();
+            $SESSION_LOST = 1;
+            die "starcheck.server daemon on "
+              . server_address()
+              . " still busy with another run after ${timeout}s\n";
+        }
+    }
+    return check_response($command, read_session_response($command));
+}
+
+sub session_lost {
+    return $SESSION_LOST;
+}
+
+sub close_session {
+    if (defined $SESSION) {
+        $SESSION->close();
+        undef $SESSION;
+    }
+    %PENDING = ();
+}
+
+sub encode_command {
+    my $command = shift;
+    if (not defined $SOCKET_PATH) {
+        return encode_json($command) . "\n";
+    }
+    my $payload =
+      ($ENCODING eq 'msgpack') ? $MSGPACK->pack($command) : encode_json($command);
+    return pack("N", length($payload)) . $payload;
+}
 
-    my $data = decode_json $response;
+sub read_bytes {
+    my $handle = shift;
+    my $size = shift;
+    my $buf = '';
+    while (length($buf) < $size) {
+        my $n = $handle->read($buf, $size - length($buf), length($buf));
+        return undef if not $n;
+    }
+    return $buf;
+}
+
+sub read_response {
+    # Read one response from $handle and return it decoded, or undef at end of stream
+    my $handle = shift;
+    if (not defined $SOCKET_PATH) {
+        my $line = <$handle>;
+        return defined $line ? decode_json($line) : undef;
+    }
+    my $header = read_bytes($handle, 4);
+    return undef if not defined $header;
+    my $payload = read_bytes($handle, unpack("N", $header));
+    return undef if not defined $payload;
+    return ($ENCODING eq 'msgpack') ? $MSGPACK->unpack($payload) : decode_json($payload);
+}
+
+sub send_request {
+    # Send one command over the persistent session, connecting if needed.
+    # Returns true if the write succeeded.
+    my $request = shift;
+    die "Session with the starcheck server on " . server_address() . " was lost\n"
+      if $SESSION_LOST;
+    $SESSION = connect_server() if not defined $SESSION;
+    return $SESSION->print($request);
+}
+
+sub lose_session {
+    # The session closed, e.g. a daemon closed it after being idle.  Fail the run
+    # rather than resend on a new session, since the command may already have run.
+    my $command = shift;
+    close_session();
+    $SESSION_LOST = 1;
+    die "Lost the session with the starcheck server on "
+      . server_address()
+      . " during $command->{func}\n";
+}
+
+sub read_session_response {
+    # Read responses from the session until the one for $command, keeping any other
+    # responses in %PENDING.  Dies if the session is closed first.
+    my $command = shift;
+    my $id = $command->{id};
+    while (not exists $PENDING{$id}) {
+        my $data = read_response($SESSION);
+        lose_session($command) if not defined $data;
+        $PENDING{ defined $data->{id} ? $data->{id} : $id } = $data;
+    }
+    return delete $PENDING{$id};
+}
+
+sub send_command {
+    # Send one command and return the decoded response, either over the persistent
+    # session or over a new connection just for this command.
+    my $command = shift;
+    my $request = encode_command($command);
+
+    # A closed session shows up as a failed write or EOF, not as a signal
+    local $SIG{PIPE} = 'IGNORE';
+
+    if (not $PERSISTENT) {
+        my $handle = connect_server();
+        $handle->print($request);
+        my $data = read_response($handle);
+        $handle->close();
+        return $data;
+    }
+
+    lose_session($command) if not send_request($request);
+    return read_session_response($command);
+}
+
+sub make_command {
+    my $func = shift;
+    my $args = shift;
+    my $kwargs = shift;
+    if (!defined $args) { $args = []; }
+    if (!defined $kwargs) { $kwargs = {}; }
+
+    my $command = {
+        "func" => $func,
+        "args" => $args,
+        "kwargs" => $kwargs,
+        "key" => $KEY,
+        "id" => ++$REQUEST_ID,
+    };
     if ($VERBOSE gt 2) {
-        print STDERR "CLIENT: Got response: $response\n";
+        print STDERR "CLIENT: Sending command " . encode_json($command) . "\n";
+    }
+    return $command;
+}
+
+sub check_response {
+    # Return the result from the response $data to $command or die
+    my $command = shift;
+    my $data = shift;
+    if (!defined($data)) {
+        die "No response from server on " . server_address() . " for $command->{func}";
+    }
+
+    if ($VERBOSE gt 2) {
+        print STDERR "CLIENT: Got response:\n";
         print STDERR Dumper($data);
     }
     if (defined $data->{exception}) {
@@ -89,6 +348,50 @@ sub call_python {
     return $data->{result};
 }
 
+sub call_python {
+    my $command = make_command(@_);
+    my $data = send_command($command);
+    return check_response($command, $data);
+}
+
+sub call_python_async {
+    # Send a call to the server without waiting for the response, which lets the
+    # server work on several calls at once (if it has a thread or process pool).
+    # Returns a handle to pass to wait_python() to get the result.  This needs
+    # the persistent session.
+    my $command = make_command(@_);
+    if (not $PERSISTENT) {
+        die "call_python_async requires a persistent server session";
+    }
+    local $SIG{PIPE} = 'IGNORE';
+    lose_session($command) if not send_request(encode_command($command));
+    return $command;
+}
+
+sub wait_python {
+    # Wait for and return the result of a call_python_async() call
+    my $command = shift;
+    local $SIG{PIPE} = 'IGNORE';
+    my $data = read_session_response($command);
+    return check_response($command, $data);
+}
+
+sub call_python_batch {
+    # Run a list of calls in one round-trip to the server.  Each call is a hash
+    # ref with keys func, args (optional) and kwargs (optional).  Returns an array
+    # ref with a hash ref {result, exception} for each call, in order.  An exception
+    # in one call is returned for that item and does not fail the batch.
+    my $calls = shift;
+    my @items = map {
+        +{
+            "func" => $_->{func},
+            "args" => (defined $_->{args} ? $_->{args} : []),
+            "kwargs" => (defined $_->{kwargs} ? $_->{kwargs} : {}),
+        }
+    } @{$calls};
+    return call_python("batch", [ \@items ]);
+}
+
 sub date2time {
     my $date = shift;
 
@@ -103,3 +406,4 @@ sub time2date {
     return call_python("utils.time2date", [$time]);
 }
 
+1;
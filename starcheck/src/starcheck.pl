@@ -20,6 +20,7 @@ use Sys::Hostname;
 use English;
 use File::Basename;
 use File::Copy;
+use File::Temp qw(tempdir);
 use Scalar::Util qw(looks_like_number);
 
 use PoorTextFormat;
@@ -50,6 +51,13 @@ my %par = (
     verbose => 1,
     maude => 0,
     max_obsids => 0,
+    server_session => 1,
+    server_transport => 'tcp',
+    server_encoding => 'json',
+    server_threads => 0,
+    server_processes => 0,
+    server_daemon => '',
+    server_daemon_wait => 600,
 );
 
 GetOptions(
@@ -69,41 +77,27 @@ GetOptions(
     'run_start_time=s',
     'maude!',
     'max_obsids:i',
+    'server_session!',
+    'server_transport=s',
+    'server_encoding=s',
+    'server_threads=i',
+    'server_processes=i',
+    'server_daemon=s',
+    'server_daemon_wait=i',
 ) || exit(1);
 
 usage(1)
   if $par{help};
 
-my $sock = IO::Socket::INET->new(
-    LocalAddr => '',
-    LocalPort => 0,
-    Proto => 'tcp',
-    Listen => 1
-);
-my $server_port = $sock->sockport();
-close($sock);
-
-# Generate a 16-character random string of letters and numbers that gets used
-# as a key to authenticate the client to the server.
-my $server_key = join '', map +(0 .. 9, 'a' .. 'z', 'A' .. 'Z')[ rand 62 ], 1 .. 16;
-
 # Configure the Python interface
-Ska::Starcheck::Python::set_port($server_port);
-Ska::Starcheck::Python::set_key($server_key);
 Ska::Starcheck::Python::set_debug($par{verbose});
-if ($par{verbose} gt 1) {
-    print STDERR "CLIENT: starcheck.server started on port $server_port\n";
-    print STDERR "CLIENT: starcheck.server key $server_key\n";
-}
-
-# Start a server that can call functions in the starcheck package
-my $pid = open(SERVER, "| python -m starcheck.server");
-SERVER->autoflush(1);
+Ska::Starcheck::Python::set_persistent($par{server_session});
 
-# Send the port, key, and verbosity to the server
-print SERVER "$server_port\n";
-print SERVER "$server_key\n";
-print SERVER "$par{verbose}\n";
+# Start a server that can call functions in the starcheck package, or attach to
+# a running starcheck.server daemon.  $pid is only defined for a server that
+# belongs to this run.
+my $pid = $par{server_daemon} ? attach_server_daemon() : start_server();
+my $server_running = 1;
 
 # DEBUG, limit number of obsids.
 # Set to undef for no limit (though option defaults to 0)
@@ -559,7 +553,12 @@ sub force_numbers {
 sub json_obsids {
 
     my @all_obs;
-    my %exclude = ('next' => 1, 'prev' => 1, 'agasc_hash' => 1);
+    # Leave out the links between observations and the internal state used
+    # within a run (server cone handles and batched Python results)
+    my %exclude = map { $_ => 1 } qw(
+      next prev agasc_cone proseco_probs guide_counts acq_mag_limits
+      dbhist_ids
+    );
     foreach my $obsid (@obsid_id) {
         my %obj = ();
         for my $tkey (keys(%{ $obs{$obsid} })) {
@@ -578,6 +577,10 @@ sub json_obsids {
 my $run_start_time =
   call_python("utils.get_run_start_time", [ $par{run_start_time}, $bs[0]->{date} ]);
 
+# Start the plot worker pool.  The thermal plot and the star field plots are
+# rendered there while the checks run, and waited for before writing the HTML.
+call_python("plot_queue.start_plot_queue");
+
 my $json_text = json_obsids();
 my $obsid_temps;
 my $json_obsid_temps;
@@ -609,10 +612,21 @@ if ($obsid_temps) {
     }
 }
 
-# Do main checking
+# Read the AGASC cones for the week, sharing reads between nearby attitudes.
+# Identify the catalog stars and then get their star history for the whole
+# week in one call.
+Ska::Starcheck::Obsid::prefetch_agasc_cones($agasc_file, map { $obs{$_} } @obsid_id);
 foreach my $obsid (@obsid_id) {
     $obs{$obsid}->get_agasc_stars($agasc_file);
     $obs{$obsid}->identify_stars();
+}
+Ska::Starcheck::Obsid::set_star_dbhists(map { $obs{$_} } @obsid_id);
+
+# Get the acquisition mag limits for the week in one call
+Ska::Starcheck::Obsid::set_acq_mag_limits(map { $obs{$_} } @obsid_id);
+
+# Do main checking
+foreach my $obsid (@obsid_id) {
     my $cat = Ska::Starcheck::Obsid::find_command($obs{$obsid}, "MP_STARCAT");
 
     # If the catalog is empty, don't make plots
@@ -629,7 +643,7 @@ foreach my $obsid (@obsid_id) {
             outdir => $STARCHECK,
             agasc_file => $agasc_file
         );
-        call_python("utils.plot_cat_wrapper", [], \%plot_args);
+        call_python("plot_queue.submit_plot_cat", [], \%plot_args);
         $obs{$obsid}->{plot_file} = "$STARCHECK/stars_$obs{$obsid}->{obsid}.png";
         $obs{$obsid}->{plot_field_file} =
           "$STARCHECK/star_view_$obs{$obsid}->{obsid}.png";
@@ -641,10 +655,24 @@ foreach my $obsid (@obsid_id) {
 
         # Get the args that proseco would want
         $obs{$obsid}->{'proseco_args'} = $obs{$obsid}->proseco_args();
+    }
+}
+
+# Get the proseco acq probabilities for the week in one call, then continue the checks
+Ska::Starcheck::Obsid::set_proseco_probs(map { $obs{$_} } @obsid_id);
+foreach my $obsid (@obsid_id) {
+    if (defined Ska::Starcheck::Obsid::find_command($obs{$obsid}, "MP_STARCAT")) {
         $obs{$obsid}->set_proseco_probs_and_check_P2();
         $obs{$obsid}->check_star_catalog($or{$obsid}, $par{vehicle});
         $obs{$obsid}->check_sim_position(@sim_trans) unless $par{vehicle};
         $obs{$obsid}->check_momentum_unload(\@bs);
+    }
+}
+
+# Get the guide counts for the week in one call, then finish the checks
+Ska::Starcheck::Obsid::set_guide_counts(map { $obs{$_} } @obsid_id);
+foreach my $obsid (@obsid_id) {
+    if (defined Ska::Starcheck::Obsid::find_command($obs{$obsid}, "MP_STARCAT")) {
         $obs{$obsid}->check_bright_perigee($radmon);
         $obs{$obsid}->check_guide_count();
         $obs{$obsid}->check_for_srdcs(\@bs);
@@ -893,6 +921,14 @@ $out .= '</PRE>';
 
 my $ptf = PoorTextFormat->new();
 
+# Wait for the plots from the plot queue
+call_python("plot_queue.wait_plots");
+my $plot_cache_stats = call_python("plot_cache.get_plot_cache_stats");
+my $n_plots = $plot_cache_stats->{hits} + $plot_cache_stats->{misses};
+printf(STDERR "Plot cache hits: %d of %d plots (%.0f%%)\n",
+    $plot_cache_stats->{hits}, $n_plots,
+    $n_plots ? 100 * $plot_cache_stats->{hits} / $n_plots : 0);
+
 # Write the HTML
 
 if ($par{html}) {
@@ -1159,6 +1195,86 @@ sub warning {
     print STDERR $text;
 }
 
+##***************************************************************************
+sub start_server {
+##***************************************************************************
+    # Start a starcheck.server for this run and return its pid.
+
+    # The server listens either on a free TCP port on localhost or on a Unix domain
+    # socket in a private temporary directory.  It writes a ready file in that
+    # directory as soon as it is listening.
+    my $server_dir = tempdir("starcheck_server_XXXXXX", TMPDIR => 1, CLEANUP => 1);
+    my $ready_file = "$server_dir/ready";
+    Ska::Starcheck::Python::set_ready_file($ready_file);
+    my $server_address;
+    if ($par{server_transport} eq 'unix') {
+        $server_address = "$server_dir/server.sock";
+        Ska::Starcheck::Python::set_socket_path($server_address);
+        Ska::Starcheck::Python::set_encoding($par{server_encoding});
+    }
+    elsif ($par{server_transport} eq 'tcp') {
+        my $sock = IO::Socket::INET->new(
+            LocalAddr => '',
+            LocalPort => 0,
+            Proto => 'tcp',
+            Listen => 1
+        );
+        $server_address = $sock->sockport();
+        close($sock);
+        Ska::Starcheck::Python::set_port($server_address);
+    }
+    else {
+        die "server_transport must be 'tcp' or 'unix'\n";
+    }
+
+    # Generate a 16-character random string of letters and numbers that gets used
+    # as a key to authenticate the client to the server.
+    my $server_key = join '', map +(0 .. 9, 'a' .. 'z', 'A' .. 'Z')[ rand 62 ], 1 .. 16;
+
+    Ska::Starcheck::Python::set_key($server_key);
+    if ($par{verbose} gt 1) {
+        print STDERR "CLIENT: starcheck.server started on $server_address\n";
+        print STDERR "CLIENT: starcheck.server key $server_key\n";
+    }
+
+    my $server_encoding = $par{server_transport} eq 'unix' ? $par{server_encoding} : 'json';
+    my $pid = open(SERVER,
+            "| python -m starcheck.server --encoding $server_encoding"
+          . " --threads $par{server_threads} --processes $par{server_processes}"
+          . " --ready-file $ready_file");
+    SERVER->autoflush(1);
+
+    # Send the address (port or socket path), key, and verbosity to the server
+    print SERVER "$server_address\n";
+    print SERVER "$server_key\n";
+    print SERVER "$par{verbose}\n";
+
+    return $pid;
+}
+
+##***************************************************************************
+sub attach_server_daemon {
+##***************************************************************************
+    # Use the long-lived starcheck.server daemon on the -server_daemon socket,
+    # starting it if needed.  The daemon is shared by starcheck runs (one at a
+    # time) and keeps its imports and loaded data between runs.
+    die "-server_daemon requires -server_session\n" if not $par{server_session};
+    my $socket_path = $par{server_daemon};
+    my $info = Ska::Starcheck::Python::attach_daemon(
+        $socket_path, "python", "-m", "starcheck.server",
+        "--daemon", "--socket", $socket_path,
+        "--encoding", $par{server_encoding},
+        "--threads", $par{server_threads},
+        "--processes", $par{server_processes}
+    );
+    if ($par{verbose} gt 1) {
+        print STDERR "CLIENT: using starcheck.server daemon pid $info->{pid} on $socket_path\n";
+    }
+    # Start the run, which the daemon ends (restoring its state) on end_run
+    Ska::Starcheck::Python::begin_daemon_run($par{server_daemon_wait});
+    return undef;
+}
+
 ##***************************************************************************
 sub usage
 ##***************************************************************************
@@ -1175,15 +1291,43 @@ END {
     # Keep and return program exit status at end of END.
     my $exit_status = $?;
 
-    # If the Python process id is defined, kill that process and wait
-    if (defined $pid) {
+    # After a lost session no more commands can be sent.  A daemon then resets
+    # the state of this run at the start of the next run.
+    if ($server_running and not Ska::Starcheck::Python::session_lost()) {
         if ($par{verbose} gt 1) {
             my $server_calls = call_python("get_server_calls");
 
-            # print the server_calls hash sorted by value in descending order
+            # print the server_calls hash (the full profile is in server_profile.json)
             print("Python server calls:");
-            print Dumper($server_calls);
+            print Dumper($server_calls->{calls});
+
+            my $cone_stats = call_python("cones.get_cone_stats");
+            printf("AGASC cone reads: %d (cone cache hits: %d)\n",
+                $cone_stats->{reads}, $cone_stats->{hits});
+
+            my $dark_stats = call_python("dark_cal.get_dark_cal_stats");
+            printf(
+                "Dark cal reads: %d (hits: %d), scaled darks: %d (hits: %d)\n",
+                $dark_stats->{misses}, $dark_stats->{hits},
+                $dark_stats->{scaled_misses}, $dark_stats->{scaled_hits}
+            );
         }
+        # Write the server call timing and payload size profile with the outputs
+        if (defined $STARCHECK and -d $STARCHECK) {
+            my $profile_file = "$STARCHECK/server_profile.json";
+            eval { call_python("write_server_profile", [$profile_file]); };
+            warn "Unable to write server profile: $@" if $@;
+        }
+        if ($par{server_daemon}) {
+            eval { call_python("end_run"); };
+            warn "Unable to end the run on the starcheck.server daemon: $@" if $@;
+        }
+        Ska::Starcheck::Python::close_session();
+    }
+
+    # If the Python process id is defined, kill that process and wait.  A daemon
+    # server keeps running for the next starcheck run.
+    if (defined $pid) {
         if ($par{verbose} gt 1) {
             print("Shutting down python starcheck server with pid=$pid\n");
         }
@@ -1251,6 +1395,49 @@ Enable (or disable) generation of report in TEXT format.  Default is TEXT enable
 Use MAUDE for telemetry instead of default cheta cxc archive.
 MAUDE will also be used if no AACCCDPT telemetry can be found in cheta archive for initial conditions.
 
+=item B<-[no]server_session>
+
+Send all calls to the Python starcheck.server over one persistent connection
+(session) instead of opening a new connection for every call.  Default is enabled.
+
+=item B<-server_transport <tcp|unix>>
+
+Transport to the Python starcheck.server.  'tcp' (default) uses newline-delimited
+JSON over a localhost TCP port.  'unix' uses length-prefixed frames over a Unix
+domain socket in a private temporary directory.
+
+=item B<-server_encoding <json|msgpack>>
+
+Frame encoding for the 'unix' server transport.  'msgpack' requires the Perl
+Data::MessagePack module and the Python msgpack package.  Default is 'json'.
+
+=item B<-server_threads <N>>
+
+Number of threads in the Python starcheck.server to run calls.  Default is 0,
+which runs each call inline in the order it is received.
+
+=item B<-server_processes <N>>
+
+Number of worker processes in the Python starcheck.server to run CPU-bound calls
+(hot pixel checks, plots, proseco probabilities).  Default is 0 (none).
+
+=item B<-server_daemon <socket path>>
+
+Use a long-lived Python starcheck.server daemon listening on the given Unix
+domain socket, starting it if it is not running.  The daemon is shared by
+starcheck runs (one at a time) and keeps its imports and loaded data (e.g. mica
+acq and guide stats) warm between runs.  Logging handlers and the kadi scenario
+set by a run are reset when the run ends.  The daemon exits after 8 hours with
+no runs, and is stopped or told to reload starcheck code and data with:
+
+  python -m starcheck.server --socket <socket path> --control shutdown
+  python -m starcheck.server --socket <socket path> --control reload
+
+=item B<-server_daemon_wait <secs>>
+
+Time to wait for a -server_daemon that is busy with another starcheck run
+before giving up.  Default is 600.
+
 =item B<-max_obsids <N>>
 
 Limit starcheck review to first N obsids (for testing).
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from starcheck import bad_pixels
+
+
+@pytest.fixture()
+def pixel_file(tmp_path):
+    """Bad pixel file with a few thousand random blocks of pixels"""
+    rng = np.random.default_rng(0)
+    lines = ["Star.Body.Pixels.BadPixels = [ ..."]
+    for row, col, drow, dcol in zip(
+        rng.integers(-512, 512, 2000),
+        rng.integers(-512, 512, 2000),
+        rng.integers(0, 3, 2000),
+        rng.integers(0, 2, 2000),
+        strict=True,
+    ):
+        lines.append(f" {row:5d}, {row + drow:5d}, {col:5d}, {col + dcol:5d}; ...")
+    lines.append("];")
+    filename = tmp_path / "ACABadPixels"
+    filename.write_text("\n".join(lines) + "\n")
+    return str(filename)
+
+
+def get_closest_scan(index, row, col, dy_max, dz_max):
+    """Closest bad pixel by a scan of every pixel (previous Perl check)"""
+    close = []
+    for pix_row, pix_col in zip(index.rows, index.cols, strict=True):
+        dy = abs(row - pix_row) * 5
+        dz = abs(col - pix_col) * 5
+        if dz < dz_max and dy < dy_max:
+            close.append((np.sqrt(dy**2 + dz**2), (pix_row, pix_col, dy, dz)))
+    return min(close, key=lambda val: val[0])[1] if close else None
+
+
+def test_read_bad_pixels(tmp_path):
+    filename = tmp_path / "ACABadPixels"
+    filename.write_text(
+        "Star.Body.Pixels.BadPixels = [ ...\n"
+        " -245,    -244,  454,  456; ...\n"
+        " -319, -317, -299, -299; ...\n"
+        "];\n"
+    )
+    assert bad_pixels.read_bad_pixels(str(filename)) == 9
+    index = bad_pixels.get_bad_pixels(str(filename))
+    assert index.rows.tolist() == [-245, -245, -245, -244, -244, -244, -319, -318, -317]
+    assert index.cols.tolist() == [454, 455, 456, 454, 455, 456, -299, -299, -299]
+
+
+def test_bad_pixel_index_matches_scan(pixel_file):
+    index = bad_pixels.get_bad_pixels(pixel_file)
+    rng = np.random.default_rng(1)
+    n_close = 0
+    for row, col in rng.uniform(-530, 530, size=(100, 2)):
+        for dy_max, dz_max in ((25, 25), (33, 25), (89, 89)):
+            exp = get_closest_scan(index, row, col, dy_max, dz_max)
+            assert index.get_closest(row, col, dy_max, dz_max) == exp
+            n_close += exp is not None
+    assert n_close > 30
+
+
+def test_bad_pixel_warnings(pixel_file):
+    index = bad_pixels.get_bad_pixels(pixel_file)
+    row, col = index.rows[10], index.cols[10]
+    entries = [
+        {"idx": 3, "row": row + 0.3, "col": col - 0.2},
+        {"idx": 4, "row": 600.0, "col": 600.0},
+    ]
+    warns = bad_pixels.bad_pixel_warnings(pixel_file, entries, None, "8.0")
+    assert list(warns) == ["3"]
+    pix_row, pix_col, dy, dz = index.get_closest(row + 0.3, col - 0.2, 25, 33)
+    assert (dy, dz) == pytest.approx((1.5, 1.0))
+    assert warns["3"] == (
+        f"[ 3] Nearby ACA bad pixel.  row, col ({pix_row}, {pix_col}), dy, dz (1, 0) \n"
+    )
@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from starcheck import cones
+
+
+@pytest.fixture()
+def cone(monkeypatch):
+    """Synthetic cone of stars with handle 'test'"""
+    n_stars = 6
+    stars = Table(
+        {
+            "AGASC_ID": np.arange(1, n_stars + 1) * 100,
+            "CLASS": np.zeros(n_stars, dtype=int),
+            "RA_PMCORR": np.linspace(10, 11, n_stars),
+            "DEC_PMCORR": np.linspace(20, 21, n_stars),
+            "MAG_ACA": [6.0, 12.0, 9.0, 10.5, 8.0, -20.0],
+            "COLOR1": np.full(n_stars, 0.7),
+            "MAG_ACA_ERR": np.full(n_stars, 10),
+            "POS_ERR": np.full(n_stars, 50),
+            "ASPQ1": np.zeros(n_stars, dtype=int),
+            "VAR": np.full(n_stars, -9999),
+            "yang": [0.0, 1.0, -1.2, 30.0, 1000.0, -2000.0],
+            "zang": [0.0, 0.5, 0.3, 20.0, 10.0, 1500.0],
+        }
+    )
+    monkeypatch.setattr(cones, "CONES", {"test": stars})
+    return "test"
+
+
+def test_get_stars_by_id(cone):
+    stars = cones.get_stars_by_id(cone, [300, "100", 999])
+    assert sorted(stars) == ["100", "300"]
+    assert stars["300"]["mag_aca"] == 9.0
+    assert stars["300"]["yag"] == -1.2
+    assert set(stars["300"]) == {
+        "id",
+        "class",
+        "ra",
+        "dec",
+        "mag_aca",
+        "bv",
+        "color1",
+        "mag_aca_err",
+        "poserr",
+        "yag",
+        "zag",
+        "aspq",
+        "var",
+        "aspq1",
+    }
+
+
+def test_get_stars_near(cone):
+    stars = cones.get_stars_near(cone, 0.9, 0.4, dy_max=1.5, dz_max=1.5)
+    # Sorted by distance from (0.9, 0.4)
+    assert [star["id"] for star in stars] == [200, 100]
+
+    # No y limit: every star within 15 arcsec in z
+    stars = cones.get_stars_near(cone, 0.0, 0.0, dz_max=15)
+    assert [star["id"] for star in stars] == [100, 200, 300, 500]
+
+
+def test_identify_stars(cone):
+    positions = [[0.9, 0.4], ["30.5", "20.0"], [500, 500], [-0.3, 0.2]]
+    matches = cones.identify_stars(cone, positions, 1.5)
+    assert [match["star"] and match["star"]["id"] for match in matches] == [
+        200,
+        400,
+        None,
+        100,
+    ]
+    assert [match["n_matches"] for match in matches] == [2, 1, 0, 3]
+    assert [match["ambiguous"] for match in matches] == [True, False, False, True]
+
+    # Same as the closest star from get_stars_near
+    for (yag, zag), match in zip(positions, matches, strict=True):
+        near = cones.get_stars_near(cone, yag, zag, dy_max=1.5, dz_max=1.5)
+        assert match["star"] == (near[0] if near else None)
+
+    # The yag index follows a replaced cone
+    stars = cones.get_stars(cone)
+    cones.CONES[cone] = stars[[0, 3]]
+    matches = cones.identify_stars(cone, positions, 1.5)
+    assert [match["n_matches"] for match in matches] == [1, 1, 0, 1]
+
+
+def test_get_stars_brighter(cone):
+    stars = cones.get_stars_brighter(cone, 10.5)
+    assert [star["id"] for star in stars] == [600, 100, 500, 300, 400]
+    stars = cones.get_stars_brighter(cone, 10.5, max_stars=2)
+    assert [star["id"] for star in stars] == [600, 100]
+
+
+def test_release_cone(cone):
+    cones.release_cone(cone)
+    with pytest.raises(KeyError, match="no AGASC cone"):
+        cones.get_stars(cone)
+
+
+def test_get_cone_matches_agasc_stars():
+    from starcheck.utils import _get_agasc_stars
+
+    args = (83.8, -5.4, 0.0, 1.3)
+    cone = cones.get_cone("obs1", *args, date="2023:001", agasc_file=None)
+    try:
+        stars = _get_agasc_stars(*args, "2023:001", None)
+        assert cone["n_stars"] == len(stars)
+        by_id = cones.get_stars_by_id("obs1", list(stars))
+        assert by_id == stars
+        for star in cone["bad_mag_stars"]:
+            assert star["mag_aca"] < -10 or star["mag_aca_err"] < -10
+    finally:
+        cones.release_cone("obs1")
+
+
+def test_get_cone_stars_cache(monkeypatch):
+    reads = []
+
+    def get_agasc_cone(ra, dec, radius, date, agasc_file):
+        reads.append((ra, dec, radius, date, agasc_file))
+        offsets = np.array([0.0, 0.5, 1.0, 1.25, 1.45])
+        return Table(
+            {
+                "AGASC_ID": np.arange(len(offsets)),
+                "RA_PMCORR": np.full(len(offsets), ra),
+                "DEC_PMCORR": dec + offsets,
+            }
+        )
+
+    monkeypatch.setattr(cones.agasc, "get_agasc_cone", get_agasc_cone)
+    monkeypatch.setattr(cones, "CONE_CACHE", {})
+    monkeypatch.setattr(cones, "CONE_STATS", cones.collections.Counter())
+
+    args = (30.0, 10.0, 0.0)
+    # Checks, plots and proseco radii all come from one AGASC read
+    stars_13 = cones.get_cone_stars(*args, 1.3, date="2023:001", agasc_file=None)
+    stars_15 = cones.get_cone_stars(
+        "30.0", "10", "0", 1.5, date="2023:001", agasc_file=None
+    )
+    stars_12 = cones.get_cone_stars(*args, 1.2, date="2023:001", agasc_file=None)
+    assert reads == [(30.0, 10.0, cones.CONE_RADIUS, "2023:001", None)]
+    assert list(stars_13["AGASC_ID"]) == [0, 1, 2, 3]
+    assert list(stars_15["AGASC_ID"]) == [0, 1, 2, 3, 4]
+    assert list(stars_12["AGASC_ID"]) == [0, 1, 2]
+    assert np.allclose(stars_12["zang"], [0, 1800, 3600], atol=30)
+
+    # A different date or AGASC file is another read
+    cones.get_cone_stars(*args, 1.3, date="2023:002", agasc_file=None)
+    cones.get_cone_stars(*args, 1.3, date="2023:001", agasc_file="agasc.h5")
+    assert cones.get_cone_stats() == {"reads": 3, "hits": 2, "n_cones": 3}
+
+    cones.clear_cones()
+    assert cones.get_cone_stats() == {"reads": 0, "hits": 0, "n_cones": 0}
+
+
+def test_prefetch_cones(monkeypatch):
+    reads = []
+
+    def get_agasc_cone(ra, dec, radius, date, agasc_file):
+        """Stars every 0.1 deg in dec along RA=10 within radius of (ra, dec)"""
+        reads.append((ra, dec, radius, date))
+        decs = np.arange(-400, 400) * 0.1
+        ok = cones.agasc.sphere_dist(ra, dec, 10.0, decs) <= radius
+        n_stars = np.count_nonzero(ok)
+        return Table(
+            {
+                "AGASC_ID": np.flatnonzero(ok),
+                "RA": np.full(n_stars, 10.0),
+                "DEC": decs[ok],
+                "PM_RA": np.zeros(n_stars, dtype=int),
+                "PM_DEC": np.zeros(n_stars, dtype=int),
+                "EPOCH": np.full(n_stars, 2000.0),
+                "RA_PMCORR": np.full(n_stars, 10.0),
+                "DEC_PMCORR": decs[ok],
+            }
+        )
+
+    monkeypatch.setattr(cones.agasc, "get_agasc_cone", get_agasc_cone)
+    monkeypatch.setattr(cones, "CONE_CACHE", {})
+    monkeypatch.setattr(cones, "CONE_STATS", cones.collections.Counter())
+
+    attitudes = [
+        (10.0, 20.0, 0.0, "2023:001"),
+        (10.2, 20.1, 90.0, "2023:001"),
+        (50.0, -30.0, 0.0, "2023:002"),
+        (10.0, 20.0, 0.0, "2023:003"),
+        (10.0, 20.0, 0.0, "2023:001"),
+    ]
+    assert cones.cluster_attitudes(attitudes) == [[0, 1, 3, 4], [2]]
+    stats = cones.prefetch_cones(attitudes, None)
+    assert stats == {"n_cones": 4, "n_clusters": 2, "reads": 2}
+    # The cluster is read as one cone covering every attitude in it
+    assert reads[0][:2] == (10.0, 20.0)
+    assert reads[0][2] > cones.CONE_RADIUS + 0.2
+    assert reads[1] == (50.0, -30.0, cones.CONE_RADIUS, "2023:002")
+
+    # The cones now come from the cache and match a direct read
+    for ra, dec, roll, date in attitudes:
+        stars = cones.get_cone_stars(ra, dec, roll, 1.3, date=date, agasc_file=None)
+        exp = get_agasc_cone(ra, dec, 1.3, date, None)
+        assert list(stars["AGASC_ID"]) == list(exp["AGASC_ID"])
+    assert cones.get_cone_stats() == {"reads": 2, "hits": 5, "n_cones": 4}
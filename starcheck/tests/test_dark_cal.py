@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from chandra_aca.dark_model import dark_temp_scale
+
+from starcheck import dark_cal
+
+
+@pytest.fixture()
+def cache_dir(tmp_path, monkeypatch):
+    """Empty dark cal caches with the on-disk cache in a temporary directory"""
+    monkeypatch.setenv("STARCHECK_DARK_CAL_CACHE", str(tmp_path))
+    dark_cal.clear_dark_cals()
+    yield tmp_path
+    dark_cal.clear_dark_cals()
+
+
+def test_get_dark_cal(cache_dir, monkeypatch):
+    # These dates have the same dark cal (see test_check_dynamic_hot_pix)
+    props1, image1 = dark_cal.get_dark_cal("2023:138")
+    # The dark cal files are only looked at once in the run
+    monkeypatch.setattr(dark_cal, "get_dark_cal_key", None)
+    props2, image2 = dark_cal.get_dark_cal("2023:140")
+    assert props2 is props1
+    assert image2 is image1
+    assert image1.shape == (1024, 1024)
+    assert image1.row0 == -512
+    assert image1.col0 == -512
+    assert props1["key"].startswith(f"{props1['id']}-")
+    assert (cache_dir / f"{props1['key']}.npy").exists()
+    stats = dark_cal.get_dark_cal_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+    # A new server process memory-maps the image from the on-disk cache
+    monkeypatch.undo()
+    dark_cal.clear_dark_cals()
+    props3, image3 = dark_cal.get_dark_cal("2023:140")
+    assert props3["id"] == props1["id"]
+    assert not image3.flags.owndata
+    assert not image3.flags.writeable
+    assert np.all(image3 == image1)
+
+
+def test_get_scaled_dark(cache_dir, monkeypatch):
+    props, image = dark_cal.get_dark_cal("2023:138")
+    _, scaled1 = dark_cal.get_scaled_dark("2023:138", -11.2132)
+    _, scaled2 = dark_cal.get_scaled_dark("2023:140", -11.2098)
+    assert scaled2 is scaled1
+    scale = dark_temp_scale(props["ccd_temp"], -11.21)
+    assert np.allclose(scaled1, image * scale)
+    assert scaled1.row0 == -512
+
+    stats = dark_cal.get_dark_cal_stats()
+    assert stats["scaled_misses"] == 1
+    assert stats["scaled_hits"] == 1
+    assert stats["scaled_bytes"] == scaled1.nbytes
+
+    # Least recently used scaled images are dropped beyond the memory budget
+    monkeypatch.setattr(dark_cal, "SCALED_MAX_BYTES", 2 * scaled1.nbytes)
+    dark_cal.get_scaled_dark("2023:138", -10.0)
+    dark_cal.get_scaled_dark("2023:138", -11.2132)
+    dark_cal.get_scaled_dark("2023:138", -9.0)
+    stats = dark_cal.get_dark_cal_stats()
+    assert stats["n_scaled"] == 2
+    assert stats["scaled_evictions"] == 1
+    assert list(dark_cal.SCALED_DARKS) == [
+        (props["key"], -11.21),
+        (props["key"], -9.0),
+    ]
+
+
+def test_get_dark_cal_reprocessed(cache_dir, monkeypatch):
+    props1, _ = dark_cal.get_dark_cal("2023:140")
+    # Cached image of another dark cal whose id starts with this one
+    other = cache_dir / f"{props1['id']}5-0123456789abcdef.npy"
+    other.write_bytes(b"")
+
+    # A reprocessed dark cal has new files, so a new key, and is read again in the
+    # next run
+    monkeypatch.setattr(
+        dark_cal, "get_dark_cal_key", lambda dark_id: f"{dark_id}-reprocessed"
+    )
+    assert dark_cal.get_dark_cal("2023:140")[0] is props1
+    dark_cal.clear_dark_cal_keys()
+    props2, image2 = dark_cal.get_dark_cal("2023:140")
+    assert props2["id"] == props1["id"]
+    assert props2["key"] == f"{props1['id']}-reprocessed"
+    assert dark_cal.get_dark_cal_stats()["misses"] == 2
+    # Only the cached images of earlier versions of this dark cal are removed
+    assert sorted(path.name for path in cache_dir.glob("*.npy")) == [
+        f"{props1['id']}-reprocessed.npy",
+        other.name,
+    ]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from chandra_aca.star_probs import mag_for_p_acq
+from cxotime import CxoTime
+
+from starcheck import mag_limits
+
+
+def test_mag_for_p_acq_error_bound():
+    rng = np.random.default_rng(0)
+    n = 200
+    p_acqs = rng.uniform(0.1, 0.95, n)
+    t_ccds = rng.uniform(-16.0, 0.0, n)
+    dates = [f"2023:{doy:03d}" for doy in rng.integers(1, 366, n)]
+    mags = mag_limits.mag_for_p_acq(p_acqs, dates, t_ccds)
+    exp = [
+        mag_for_p_acq(p_acq, date, t_ccd)
+        for p_acq, date, t_ccd in zip(p_acqs, dates, t_ccds, strict=True)
+    ]
+    assert np.allclose(mags, exp, rtol=0, atol=mag_limits.MAG_ERROR)
+
+
+def get_bin_edge_dates(date):
+    """Dates at the start, middle and end of the DATE_STEP bin of ``date``"""
+    step = mag_limits.DATE_STEP * 86400.0
+    start = np.floor(CxoTime(date).secs / step) * step
+    return [start, start + 1.0, start + step / 2, start + step - 1.0]
+
+
+# t_ccd across the full range of the surface, including both ends and the cells
+# next to them
+T_CCDS = [
+    mag_limits.T_CCD_MIN,
+    mag_limits.T_CCD_MIN + 0.05,
+    -20.0,
+    -13.37,
+    -10.0,
+    -5.01,
+    0.0,
+    mag_limits.T_CCD_MAX - 0.05,
+    mag_limits.T_CCD_MAX,
+]
+
+
+@pytest.mark.parametrize("t_ccd", T_CCDS)
+@pytest.mark.parametrize("date", ["2018:001", "2023:138", "2030:200"])
+def test_mag_for_p_acq_full_range(t_ccd, date):
+    dates = get_bin_edge_dates(date)
+    for p_acq in (0.1, 0.5, 0.75, 0.95):
+        mags = mag_limits.mag_for_p_acq(
+            [p_acq] * len(dates), dates, [t_ccd] * len(dates)
+        )
+        exp = [mag_for_p_acq(p_acq, date, t_ccd) for date in dates]
+        assert np.allclose(mags, exp, rtol=0, atol=mag_limits.MAG_ERROR)
+
+
+@pytest.mark.parametrize("t_ccd", [-30.0, -11.23, 8.0])
+def test_get_acq_mag_limits(t_ccd):
+    dates = ["2023:138:00:00:00.000", "2024:001:12:00:00.000"]
+    limits = mag_limits.get_acq_mag_limits(dates, [t_ccd, t_ccd])
+    for name, p_acq in (("yellow", 0.75), ("red", 0.5)):
+        exp = [mag_for_p_acq(p_acq, date, t_ccd) for date in dates]
+        assert np.allclose(limits[name], exp, rtol=0, atol=mag_limits.MAG_ERROR)
+
+
+def test_mag_for_p_acq_limits():
+    mags = mag_limits.mag_for_p_acq(
+        [0.9999, 0.0001], ["2023:138", "2023:138"], [-10, -10]
+    )
+    assert mags == [mag_limits.MAG_MIN, mag_limits.MAG_MAX]
+    assert mag_limits.mag_for_p_acq([], [], []) == []
@@ -0,0 +1,177 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from starcheck import mica_stats
+
+
+def get_star_stats_masks(acq_stats, guide_stats, agasc_id, time):
+    """Star stats from boolean masks over the full tables (reference)"""
+    acqs = acq_stats[
+        (acq_stats["agasc_id"] == agasc_id) & (acq_stats["guide_tstart"] < time)
+    ]
+    guides = guide_stats[
+        (guide_stats["agasc_id"] == agasc_id) & (guide_stats["kalman_tstart"] < time)
+    ]
+    mags = np.concatenate(
+        [
+            acqs["mag_obs"][acqs["mag_obs"] != 0],
+            guides["aoacmag_mean"][guides["aoacmag_mean"] != 0],
+        ]
+    )
+    return {
+        "acq": len(acqs),
+        "acq_noid": int(np.count_nonzero(acqs["img_func"] != "star")),
+        "gui": len(guides),
+        "gui_bad": int(np.count_nonzero(guides["f_track"] < 0.95)),
+        "gui_fail": int(np.count_nonzero(guides["f_track"] < 0.01)),
+        "gui_obc_bad": int(np.count_nonzero(guides["f_obc_bad"] > 0.05)),
+        "avg_mag": float(np.mean(mags)) if len(mags) > 0 else 13.94,
+    }
+
+
+@pytest.fixture(scope="module")
+def stats_tables():
+    rng = np.random.default_rng(10)
+    n_acq, n_guide = 2000, 3000
+    acq_stats = Table(
+        {
+            "agasc_id": rng.integers(1, 200, n_acq),
+            # Round times so that some lookups hit a time exactly
+            "guide_tstart": np.round(rng.uniform(0, 1000, n_acq)),
+            "img_func": rng.choice(["star", "none", "spoiler"], n_acq),
+            "mag_obs": np.where(
+                rng.uniform(size=n_acq) < 0.1, 0, rng.uniform(6, 11, n_acq)
+            ),
+        }
+    )
+    guide_stats = Table(
+        {
+            "agasc_id": rng.integers(1, 200, n_guide),
+            "kalman_tstart": np.round(rng.uniform(0, 1000, n_guide)),
+            "aoacmag_mean": np.where(
+                rng.uniform(size=n_guide) < 0.1, 0, rng.uniform(6, 11, n_guide)
+            ),
+            "f_track": rng.choice([0.0, 0.5, 0.96, 1.0], n_guide),
+            "f_obc_bad": rng.choice([0.0, 0.1], n_guide),
+        }
+    )
+    return acq_stats, guide_stats
+
+
+def test_star_index_rows():
+    index, order = mica_stats.StarIndex.from_rows(
+        [5, 3, 5, 3, 5], [30.0, 20.0, 10.0, 10.0, 20.0]
+    )
+    assert list(order) == [3, 1, 2, 4, 0]
+    assert list(index.ids) == [3, 5]
+    assert list(index.times) == [10.0, 20.0, 10.0, 20.0, 30.0]
+    assert index.get_rows(5, 20.0) == slice(2, 3)
+    assert index.get_rows(5, 30.5) == slice(2, 5)
+    assert index.get_rows(3, 5.0) == slice(0, 0)
+    assert index.get_rows(4, 100.0) == slice(0, 0)
+    assert index.get_rows(6, 100.0) == slice(0, 0)
+
+
+def test_star_stats_matches_masks(stats_tables):
+    acq_stats, guide_stats = stats_tables
+    star_stats = mica_stats.StarStats.from_tables(acq_stats, guide_stats)
+    for agasc_id in (0, 1, 50, 100, 199, 300):
+        for time in (-1.0, 0.0, 250.0, 500.5, 1000.0, 2000.0):
+            exp = get_star_stats_masks(acq_stats, guide_stats, agasc_id, time)
+            stats = star_stats.get_star_stats(agasc_id, time)
+            # Only the summation order of avg_mag differs from the tables
+            assert stats == pytest.approx(exp, rel=1e-12, abs=0)
+
+
+def test_star_stats_batch(stats_tables):
+    acq_stats, guide_stats = stats_tables
+    star_stats = mica_stats.StarStats.from_tables(acq_stats, guide_stats)
+    agasc_ids = [50, 0, 1, 199, 300, 50, 100]
+    times = [500.5, 250.0, -1.0, 1000.0, 100.0, 2000.0, 0.0]
+    stats = star_stats.get_star_stats_batch(agasc_ids, times)
+    for idx, (agasc_id, time) in enumerate(zip(agasc_ids, times, strict=True)):
+        exp = get_star_stats_masks(acq_stats, guide_stats, agasc_id, time)
+        assert {key: vals[idx] for key, vals in stats.items()} == pytest.approx(
+            exp, rel=1e-12, abs=0
+        )
+
+    # One time for all stars, and no stars
+    stats = star_stats.get_star_stats_batch(["50", "100"], 600.0)
+    assert stats["acq"] == [
+        get_star_stats_masks(acq_stats, guide_stats, agasc_id, 600.0)["acq"]
+        for agasc_id in (50, 100)
+    ]
+    stats = star_stats.get_star_stats_batch([], [])
+    assert all(vals == [] for vals in stats.values())
+
+
+def test_star_stats_cache(stats_tables, tmp_path, monkeypatch):
+    acq_stats, guide_stats = stats_tables
+    reads = []
+
+    def read_mica_stats():
+        reads.append(1)
+        return acq_stats, guide_stats
+
+    monkeypatch.setattr(mica_stats, "read_mica_stats", read_mica_stats)
+    source_files = [str(tmp_path / "acq_stats.h5"), str(tmp_path / "guide_stats.h5")]
+    for filename in source_files:
+        Path(filename).write_bytes(b"stats")
+    cache_dir = tmp_path / "cache"
+
+    star_stats = mica_stats.load_star_stats(cache_dir, source_files)
+    assert len(reads) == 1
+    for name, dtype in mica_stats.STATS_ARRAYS.items():
+        assert star_stats.arrays[name].dtype == dtype
+
+    # Second load memory-maps the cache
+    cached = mica_stats.load_star_stats(cache_dir, source_files)
+    assert len(reads) == 1
+    assert isinstance(cached.arrays["acq_times"], np.memmap)
+    for agasc_id, time in ((50, 500.5), (100, 2000.0), (300, 1.0)):
+        exp = get_star_stats_masks(acq_stats, guide_stats, agasc_id, time)
+        assert cached.get_star_stats(agasc_id, time) == pytest.approx(exp)
+
+    # Touched with the same contents: the cache is still used
+    os.utime(source_files[0], ns=(0, 0))
+    mica_stats.load_star_stats(cache_dir, source_files)
+    assert len(reads) == 1
+
+    # Changed contents: the cache is rebuilt, replacing the previous arrays
+    Path(source_files[1]).write_bytes(b"new stats")
+    mica_stats.load_star_stats(cache_dir, source_files)
+    assert len(reads) == 2
+    assert len(list(cache_dir.glob("arrays-*"))) == 1
+    mica_stats.load_star_stats(cache_dir, source_files)
+    assert len(reads) == 2
+
+
+def test_star_stats_cache_locked(stats_tables, tmp_path, monkeypatch):
+    acq_stats, guide_stats = stats_tables
+    monkeypatch.setattr(mica_stats, "read_mica_stats", lambda: (acq_stats, guide_stats))
+    source_files = [str(tmp_path / "acq_stats.h5"), str(tmp_path / "guide_stats.h5")]
+    for filename in source_files:
+        Path(filename).write_bytes(b"stats")
+    cache_dir = tmp_path / "cache"
+    mica_stats.load_star_stats(cache_dir, source_files)
+    arrays_dir = next(cache_dir.glob("arrays-*"))
+
+    # A rebuild waits for a process that holds the shared lock while opening the
+    # current arrays, so it cannot remove them under that process.
+    Path(source_files[1]).write_bytes(b"new stats")
+    with mica_stats.cache_lock(cache_dir, exclusive=False):
+        thread = threading.Thread(
+            target=mica_stats.load_star_stats, args=(cache_dir, source_files)
+        )
+        thread.start()
+        thread.join(timeout=0.5)
+        assert thread.is_alive()
+        assert arrays_dir.exists()
+    thread.join(timeout=10)
+    assert not arrays_dir.exists()
+    assert len(list(cache_dir.glob("arrays-*"))) == 1
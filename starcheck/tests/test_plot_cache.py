@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+from starcheck import plot_cache
+
+
+def write_plot(path, text):
+    path.write_text(text)
+
+
+def test_get_plot_key():
+    catalog = [{"idx": 1, "type": "BOT", "yang": 100.0, "zang": -200.0}]
+    key = plot_cache.get_plot_key("stars", [1.0, 2.0, 3.0], catalog, "2023:140")
+    assert key == plot_cache.get_plot_key(
+        "stars", [1.0, 2.0, 3.0], [dict(reversed(catalog[0].items()))], "2023:140"
+    )
+    assert key != plot_cache.get_plot_key("stars", [1.0, 2.0, 3.1], catalog, "2023:140")
+    assert key != plot_cache.get_plot_key("temps", [1.0, 2.0, 3.0], catalog, "2023:140")
+
+    temps = np.array([-10.0, -9.5])
+    key = plot_cache.get_plot_key("temps", temps)
+    assert key == plot_cache.get_plot_key("temps", temps.copy())
+    assert key != plot_cache.get_plot_key("temps", temps.astype(np.float32))
+    assert key != plot_cache.get_plot_key("temps", temps + 0.1)
+
+
+def test_plot_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    outfile = tmp_path / "stars_1.png"
+    plot_cache.clear_plot_cache_stats()
+
+    assert not plot_cache.get_cached_plot("abc", outfile, cache_dir)
+    plot_cache.make_cached_plot(
+        write_plot,
+        (outfile, "plot"),
+        {},
+        key="abc",
+        outfile=outfile,
+        cache_dir=cache_dir,
+    )
+    assert (cache_dir / "abc.png").read_text() == "plot"
+
+    outfile2 = tmp_path / "stars_2.png"
+    assert plot_cache.get_cached_plot("abc", outfile2, cache_dir)
+    assert outfile2.read_text() == "plot"
+    assert plot_cache.get_plot_cache_stats() == {"hits": 1, "misses": 1}
+
+    # The plot is a copy, so a change to the cache does not change the plot file
+    assert not outfile2.samefile(cache_dir / "abc.png")
+    (cache_dir / "abc.png").write_text("changed")
+    assert outfile2.read_text() == "plot"
+    (cache_dir / "abc.png").write_text("plot")
+
+    # Rendering over a plot from the cache does not change the cache
+    plot_cache.make_cached_plot(
+        write_plot,
+        (outfile2, "new"),
+        {},
+        key="def",
+        outfile=outfile2,
+        cache_dir=cache_dir,
+    )
+    assert outfile2.read_text() == "new"
+    assert (cache_dir / "abc.png").read_text() == "plot"
+
+
+def test_prune_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    for idx, key in enumerate(["a", "b", "c", "d"]):
+        path = cache_dir / f"{key}.png"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, ns=(idx * 10**9, idx * 10**9))
+    (cache_dir / ".tmp123").write_bytes(b"x" * 1000)
+
+    # Use "a" so it is the most recently used
+    assert plot_cache.get_cached_plot("a", tmp_path / "out.png", cache_dir)
+    assert plot_cache.prune_cache(cache_dir, max_bytes=250) == 2
+    assert sorted(path.name for path in cache_dir.iterdir()) == [
+        ".tmp123",
+        "a.png",
+        "d.png",
+    ]
+    assert plot_cache.prune_cache(cache_dir, max_bytes=250) == 0
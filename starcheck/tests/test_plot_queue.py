@@ -0,0 +1,62 @@
+import pytest
+
+from starcheck import plot_queue
+
+
+def write_plot(path, text):
+    path.write_text(text)
+
+
+def fail_plot(path):
+    raise ValueError(f"no plot {path.name}")
+
+
+def test_plot_queue_inline(tmp_path, monkeypatch):
+    monkeypatch.setenv("STARCHECK_PLOT_CACHE", str(tmp_path / "cache"))
+    assert plot_queue.PLOT_POOL is None
+    done = []
+    plot_queue.submit_plot(
+        write_plot, tmp_path / "plot.png", "inline", on_success=lambda: done.append(1)
+    )
+    assert (tmp_path / "plot.png").read_text() == "inline"
+    assert done == [1]
+    assert plot_queue.wait_plots() == 0
+
+
+def test_plot_queue_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("STARCHECK_PLOT_CACHE", str(tmp_path / "cache"))
+    assert plot_queue.start_plot_queue(2) == 2
+    try:
+        paths = [tmp_path / f"stars_{idx}.png" for idx in range(6)]
+        for path in paths:
+            plot_queue.submit_plot(write_plot, path, text=path.name)
+        assert plot_queue.wait_plots() == len(paths)
+        assert [path.read_text() for path in paths] == [path.name for path in paths]
+
+        # on_success is called once a plot is made, and not for a failed plot
+        done = []
+        plot_queue.submit_plot(
+            write_plot, tmp_path / "ok.png", "ok", on_success=lambda: done.append("ok")
+        )
+        plot_queue.submit_plot(
+            fail_plot, tmp_path / "bad.png", on_success=lambda: done.append("bad")
+        )
+        assert done == []
+        with pytest.raises(ValueError, match="no plot bad.png"):
+            plot_queue.wait_plots()
+        assert (tmp_path / "ok.png").read_text() == "ok"
+        assert done == ["ok"]
+        assert plot_queue.wait_plots() == 0
+    finally:
+        plot_queue.stop_plot_queue()
+    assert plot_queue.PLOT_POOL is None
+
+
+def test_get_n_plot_processes(monkeypatch):
+    monkeypatch.delenv("STARCHECK_PLOT_PROCESSES", raising=False)
+    monkeypatch.setattr(plot_queue.os, "sched_getaffinity", lambda pid: set(range(64)))
+    assert plot_queue.get_n_plot_processes() == plot_queue.PLOT_MAX_PROCESSES
+    monkeypatch.setattr(plot_queue.os, "sched_getaffinity", lambda pid: {0, 1})
+    assert plot_queue.get_n_plot_processes() == 2
+    monkeypatch.setenv("STARCHECK_PLOT_PROCESSES", "8")
+    assert plot_queue.get_n_plot_processes() == 8
@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import socket
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from starcheck import server
+
+
+@pytest.fixture(params=["inline", "pools"])
+def server_port(request, monkeypatch):
+    """Run a starcheck.server in a thread and return the port"""
+    monkeypatch.setattr(server, "KEY", "testkey")
+    dispatcher = server.Dispatcher(n_threads=2 if request.param == "pools" else 0)
+    monkeypatch.setattr(server, "DISPATCHER", dispatcher)
+    srv = server.PythonServer((server.HOST, 0), server.MyTCPHandler)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv.server_address[1]
+    srv.shutdown()
+    srv.server_close()
+    for pool in dispatcher.pools.values():
+        pool.shutdown()
+
+
+def send_commands(port, cmds):
+    """Send ``cmds`` over one session and return the decoded responses"""
+    with (
+        socket.create_connection((server.HOST, port)) as sock,
+        sock.makefile("rb") as rfile,
+    ):
+        resps = []
+        for cmd in cmds:
+            sock.sendall((json.dumps(cmd) + "\n").encode())
+            resps.append(json.loads(rfile.readline()))
+    return resps
+
+
+def make_cmd(func, args=None, kwargs=None, key="testkey", idx=None):
+    return {
+        "func": func,
+        "args": args or [],
+        "kwargs": kwargs or {},
+        "key": key,
+        "id": idx,
+    }
+
+
+def test_session_many_commands(server_port):
+    cmds = [
+        make_cmd("utils.date2time", ["2023:001:00:00:00.000"], idx=1),
+        # The key is only checked on the first command of the session
+        make_cmd("utils.time2date", [788918469.184], key=None, idx=2),
+        make_cmd("get_server_calls", idx=3),
+    ]
+    resps = send_commands(server_port, cmds)
+    assert [resp["id"] for resp in resps] == [1, 2, 3]
+    assert all(resp["exception"] is None for resp in resps)
+    assert resps[1]["result"] == "2023:001:00:00:00.000"
+    assert resps[2]["result"]["calls"]["utils.date2time"] == 1
+
+
+def test_session_bad_key(server_port):
+    with socket.create_connection((server.HOST, server_port)) as sock:
+        sock.sendall(
+            (json.dumps(make_cmd("get_server_calls", key="bad")) + "\n").encode()
+        )
+        # Server closes the session without a response
+        assert sock.makefile("rb").readline() == b""
+
+
+def test_batch_error_isolation(server_port):
+    items = [
+        {"func": "utils.date2time", "args": ["2023:001:00:00:00.000"]},
+        {"func": "utils.date2time", "args": ["not a date"]},
+        {"func": "utils.no_such_function"},
+        {"func": "utils.time2date", "args": [788918469.184], "kwargs": {}},
+    ]
+    (resp,) = send_commands(server_port, [make_cmd("batch", [items], idx=10)])
+    assert resp["id"] == 10
+    assert resp["exception"] is None
+    results = resp["result"]
+    assert len(results) == 4
+    assert results[0]["exception"] is None
+    assert results[1]["exception"] is not None
+    assert results[1]["result"] is None
+    assert "AttributeError" in results[2]["exception"]
+    assert results[3]["result"] == "2023:001:00:00:00.000"
+
+
+def test_batch_in_pool(monkeypatch):
+    # Both items must be running at once to get past the barrier
+    barrier = threading.Barrier(2, timeout=10)
+
+    def timed_call_func(func_name, args, kwargs):
+        barrier.wait()
+        if args[0] < 0:
+            return None, "ValueError", 0.0, 0.0
+        return args[0] * 2, None, 0.0, 0.0
+
+    monkeypatch.setattr(server, "timed_call_func", timed_call_func)
+    dispatcher = server.Dispatcher(n_threads=2)
+    try:
+        items = [
+            {"func": "utils.check_hot_pix", "args": [1]},
+            {"func": "utils.check_hot_pix", "args": [-1]},
+        ]
+        cmd = {"func": "batch", "args": [items], "kwargs": {}}
+        results, exc = dispatcher.submit(cmd).result(timeout=10)
+        assert exc is None
+        assert results == [
+            {"result": 2, "exception": None},
+            {"result": None, "exception": "ValueError"},
+        ]
+        assert dispatcher.submit({**cmd, "args": [[]]}).result() == ([], None)
+        assert dispatcher.queue_depth["thread"] == 0
+    finally:
+        dispatcher.pools["thread"].shutdown()
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+def test_unix_socket_frames(encoding, tmp_path, monkeypatch):
+    if encoding == "msgpack":
+        pytest.importorskip("msgpack")
+    monkeypatch.setattr(server, "KEY", "testkey")
+    path = str(tmp_path / "server.sock")
+    srv = server.PythonUnixServer(path, server.FramedHandler, encoding=encoding)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    dumps, loads = server.get_codec(encoding)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            resps = []
+            with sock.makefile("rb") as rfile:
+                for idx in (1, 2):
+                    data = dumps(make_cmd("get_server_calls", idx=idx))
+                    sock.sendall(server.FRAME_HEADER.pack(len(data)) + data)
+                    (size,) = server.FRAME_HEADER.unpack(rfile.read(4))
+                    resps.append(loads(rfile.read(size)))
+    finally:
+        srv.shutdown()
+        srv.server_close()
+    assert [resp["id"] for resp in resps] == [1, 2]
+    assert resps[1]["exception"] is None
+
+
+def test_pipelined_commands(server_port):
+    """Send several commands before reading any response"""
+    dates = [f"2023:{doy:03d}:00:00:00.000" for doy in range(1, 11)]
+    with (
+        socket.create_connection((server.HOST, server_port)) as sock,
+        sock.makefile("rb") as rfile,
+    ):
+        for idx, date in enumerate(dates):
+            cmd = make_cmd("utils.date2time", [date], idx=idx)
+            sock.sendall((json.dumps(cmd) + "\n").encode())
+        resps = [json.loads(rfile.readline()) for _ in dates]
+        cmd = make_cmd("get_server_calls", idx=100)
+        sock.sendall((json.dumps(cmd) + "\n").encode())
+        server_calls = json.loads(rfile.readline())["result"]
+
+    # Responses can come back in any order when using pools
+    resps = sorted(resps, key=lambda resp: resp["id"])
+    times = [resp["result"] for resp in resps]
+    assert np.all(np.diff(times) == 86400)
+    assert server_calls["calls"]["utils.date2time"] == len(dates)
+    assert all(depth == 0 for depth in server_calls["queue_depth"].values())
+
+
+def test_server_profile(server_port, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "PROFILE", server.ServerProfile())
+    filename = tmp_path / "server_profile.json"
+    items = [{"func": "utils.date2time", "args": ["2023:001:00:00:00.000"]}]
+    cmds = [
+        make_cmd("utils.date2time", ["2023:001:00:00:00.000"], idx=1),
+        make_cmd("batch", [items], idx=2),
+        make_cmd("write_server_profile", [str(filename)], idx=3),
+    ]
+    resps = send_commands(server_port, cmds)
+    assert all(resp["exception"] is None for resp in resps)
+
+    profile = json.loads(filename.read_text())["profile"]
+    stats = profile["utils.date2time"]
+    assert stats["n_calls"] == 2
+    assert sum(stats["wall_hist"]) == 2
+    assert stats["wall_min"] <= stats["wall_p50"] <= stats["wall_max"]
+    assert stats["request_bytes"] > 0
+    assert stats["response_bytes"] > 0
+    assert profile["batch"]["request_bytes"] > 0
+
+
+def test_profile_summary():
+    profile = server.ServerProfile()
+    for wall_time in (0.5, 0.001, 0.02, 2e-5):
+        profile.add_call("utils.func", wall_time, 0.25)
+    profile.add_request("utils.func", 100, 0.125)
+    profile.add_response("utils.func", 20, 0.5)
+
+    stats = profile.summary()["utils.func"]
+    assert stats["n_calls"] == 4
+    assert stats["wall_total"] == pytest.approx(0.52102)
+    assert stats["wall_min"] == 2e-5
+    assert stats["wall_max"] == 0.5
+    assert stats["wall_p50"] == 0.001
+    assert stats["wall_p95"] == 0.5
+    assert stats["wall_hist"] == [1, 1, 0, 1, 1, 0, 0]
+    assert stats["cpu_total"] == 1.0
+    assert stats["request_bytes"] == 100
+    assert stats["response_bytes"] == 20
+    assert stats["decode_time"] == 0.125
+    assert stats["encode_time"] == 0.5
+
+
+def test_memo_cache(monkeypatch):
+    calls = []
+
+    def timed_call_func(func_name, args, kwargs):
+        calls.append(args)
+        if args[0] < 0:
+            return None, "ValueError", 0.0, 0.0
+        return args[0] * 2, None, 0.0, 0.0
+
+    monkeypatch.setattr(server, "timed_call_func", timed_call_func)
+    cache = server.MemoCache(maxsize=2)
+    for arg in (1, 2, 1, 3, 2, -1, -1):
+        cache.call("utils.func", [arg], {})
+    # 1 is a hit, 3 evicts 2, then 2 evicts 1, exceptions are not cached
+    assert calls == [[1], [2], [3], [2], [-1], [-1]]
+    assert cache.call("utils.func", [3], {})[:2] == (6, None)
+    assert cache.stats() == {
+        "maxsize": 2,
+        "size": 2,
+        "hits": {"utils.func": 2},
+        "misses": {"utils.func": 6},
+        "evictions": 2,
+    }
+
+    # Keyword argument order does not matter
+    key1 = cache.get_key("utils.func", [], {"a": 1, "b": 2})
+    key2 = cache.get_key("utils.func", [], {"b": 2, "a": 1})
+    assert key1 == key2
+
+
+def test_server_memo(server_port, monkeypatch):
+    monkeypatch.setattr(server, "MEMO_CACHE", server.MemoCache())
+    date = "2023:001:00:00:00.000"
+    items = [{"func": "utils.date2time", "args": [date]}]
+    cmds = [
+        make_cmd("utils.date2time", [date], idx=1),
+        make_cmd("batch", [items], idx=2),
+        make_cmd("get_server_calls", idx=3),
+    ]
+    resps = send_commands(server_port, cmds)
+    assert resps[1]["result"][0]["result"] == resps[0]["result"]
+    memo = resps[2]["result"]["memo"]
+    assert memo["hits"] == {"utils.date2time": 1}
+    assert memo["misses"] == {"utils.date2time": 1}
+
+
+def test_run_state_restore(monkeypatch):
+    monkeypatch.delenv("KADI_SCENARIO", raising=False)
+    kadi_logger = logging.getLogger("kadi")
+    handlers = list(kadi_logger.handlers)
+
+    run_state = server.RunState()
+    os.environ["KADI_SCENARIO"] = "flight"
+    handler = logging.StreamHandler()
+    kadi_logger.addHandler(handler)
+    run_state.restore()
+
+    assert "KADI_SCENARIO" not in os.environ
+    assert kadi_logger.handlers == handlers
+
+
+def test_daemon_sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "KEY", "testkey")
+    monkeypatch.setattr(server, "SHUTDOWN", threading.Event())
+    monkeypatch.setattr(server, "CURRENT_RUN", None)
+    monkeypatch.delenv("KADI_SCENARIO", raising=False)
+    path = str(tmp_path / "daemon.sock")
+    srv = server.PythonUnixServer(path, server.FramedHandler)
+    srv.daemon = True
+    server.write_daemon_info(path, "json")
+    info = json.loads(Path(server.get_daemon_info_file(path)).read_text())
+    assert info["key"] == "testkey"
+    assert info["encoding"] == "json"
+
+    def send(*funcs):
+        """Send ``funcs`` over one session and return the responses"""
+        resps = []
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            with sock.makefile("rb") as rfile:
+                for idx, func in enumerate(funcs):
+                    data = json.dumps(make_cmd(func, idx=idx)).encode()
+                    sock.sendall(server.FRAME_HEADER.pack(len(data)) + data)
+                    (size,) = server.FRAME_HEADER.unpack(rfile.read(4))
+                    resps.append(json.loads(rfile.read(size)))
+        return resps
+
+    def serve():
+        while not server.SHUTDOWN.is_set():
+            srv.handle_request()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        send("begin_run", "get_server_calls")
+        os.environ["KADI_SCENARIO"] = "flight"
+        # A closed session does not end the run
+        assert send("get_server_calls")[0]["exception"] is None
+        assert server.CURRENT_RUN is not None
+        assert os.environ["KADI_SCENARIO"] == "flight"
+
+        # Each run starts with fresh call statistics, ending an unfinished run
+        resp = send("begin_run", "get_server_calls")[1]
+        assert resp["result"]["calls"] == {}
+        assert "KADI_SCENARIO" not in os.environ
+        assert resp["result"]["profile"]["get_server_calls"]["n_calls"] == 0
+
+        # end_run restores the state saved by begin_run
+        os.environ["KADI_SCENARIO"] = "flight"
+        assert send("end_run")[0]["exception"] is None
+        assert server.CURRENT_RUN is None
+        assert "KADI_SCENARIO" not in os.environ
+
+        assert send("shutdown_server")[0]["exception"] is None
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+    finally:
+        srv.server_close()
+
+
+def test_reload_server_stops_plot_pool(monkeypatch):
+    from starcheck import plot_queue
+
+    monkeypatch.setattr(server.importlib, "reload", lambda module: module)
+    monkeypatch.setattr(server, "DISPATCHER", server.Dispatcher())
+    plot_queue.start_plot_queue(1)
+    pool = plot_queue.PLOT_POOL
+    try:
+        assert "starcheck.plot_queue" in server.reload_server()
+        assert plot_queue.PLOT_POOL is None
+        # The workers are shut down, so the pool cannot take more plots
+        with pytest.raises(RuntimeError):
+            pool.submit(print)
+    finally:
+        plot_queue.stop_plot_queue()
+
+
+def test_write_ready_file(tmp_path):
+    ready_file = tmp_path / "ready"
+    server.write_ready_file(str(ready_file))
+    assert int(ready_file.read_text()) == os.getpid()
+    assert list(tmp_path.iterdir()) == [ready_file]
@@ -0,0 +1,95 @@
+import pytest
+from astropy.table import Table
+
+from starcheck import cones, spoilers
+
+
+@pytest.fixture()
+def cone(monkeypatch):
+    """Synthetic cone of stars around a guide star (1001) and a fid light"""
+    stars = Table(
+        {
+            "AGASC_ID": [1001, 1002, 1003, 1004, 1005, 1006],
+            "MAG_ACA": [9.0, 9.5, 8.0, 3.0, 10.0, 11.5],
+            "yang": [100.0, 110.0, 90.0, 1500.0, -500.0, -530.0],
+            "zang": [100.0, 105.0, 98.0, 120.0, -500.0, -505.0],
+        }
+    )
+    monkeypatch.setattr(cones, "CONES", {"test": stars})
+    return "test"
+
+
+def get_entry(*vals):
+    return dict(zip(["idx", "type", "id", "yag", "zag", "mag"], vals, strict=True))
+
+
+def test_spoiler_warnings(cone):
+    catalog = [
+        get_entry(1, "FID", "1", -510, -505, "7.000"),
+        get_entry(2, "GUI", "1001", "100", "100", "9.000"),
+        get_entry(3, "BOT", "", 110.5, 105.5, 9.55),
+        get_entry(4, "BOT", "9", 80, 95, "---"),
+        get_entry(5, "MON", "", 100, 100, 20.0),
+    ]
+    warns = spoilers.spoiler_warnings(cone, catalog, "8.0", None, id_dist_limit=1.5)
+    assert warns == {
+        "1": [
+            [
+                "warn",
+                "[ 1] Fid spoiler.        1005: Y,Z,Radial,Mag seps:  10   5  11 -3.0\n",
+            ],
+            [
+                "yellow_warn",
+                "[ 1] Fid spoiler.        1006: Y,Z,Radial,Mag seps:  20   0  20 -4.5\n",
+            ],
+        ],
+        # 1001 is the catalog star (same id).  1003 is closer than 1002.
+        "2": [
+            [
+                "warn",
+                "[ 2] Spoiler.       1003: Y,Z,Radial,Mag seps:  10   2  10  1.0\n",
+            ],
+            [
+                "yellow_warn",
+                "[ 2] Spoiler.       1002: Y,Z,Radial,Mag seps:  10   5  11 -0.5\n",
+            ],
+            ["warn", "[ 2] Common Column.       1004 at Y,Z,Mag:  1500   120  3.00\n"],
+        ],
+        # 1002 is the catalog star (same position and mag)
+        "3": [
+            [
+                "warn",
+                "[ 3] Spoiler.       1001: Y,Z,Radial,Mag seps:  10   5  11  0.6\n",
+            ],
+            [
+                "warn",
+                "[ 3] Spoiler.       1003: Y,Z,Radial,Mag seps:  20   7  21  1.6\n",
+            ],
+            ["warn", "[ 3] Common Column.       1004 at Y,Z,Mag:  1500   120  3.00\n"],
+        ],
+        # No mag: mag difference 0 and shown as '?'
+        "4": [
+            [
+                "warn",
+                "[ 4] Spoiler.       1003: Y,Z,Radial,Mag seps:  10   3  10    ?\n",
+            ],
+            [
+                "warn",
+                "[ 4] Spoiler.       1001: Y,Z,Radial,Mag seps:  20   5  20    ?\n",
+            ],
+        ],
+        "5": [],
+    }
+
+
+def test_spoiler_warnings_zero_yag(cone):
+    """No common column check (and no division by zero) for a star at yag=0"""
+    catalog = [get_entry(1, "GUI", "", 0, 110, 15.0)]
+    assert spoilers.spoiler_warnings(cone, catalog, 8, 8) == {"1": []}
+
+
+@pytest.mark.parametrize(
+    "val,exp", [(None, 0.0), ("---", 0.0), (" 9.5 ", 9.5), ("1e2x", 100.0), (3, 3.0)]
+)
+def test_perl_float(val, exp):
+    assert spoilers.perl_float(val) == exp
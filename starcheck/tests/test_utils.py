@@ -1,7 +1,17 @@
-from starcheck.utils import check_hot_pix
+import numpy as np
 
+from starcheck.utils import (
+    check_hot_pix,
+    guide_count,
+    guide_count_batch,
+    proseco_probs,
+    proseco_probs_batch,
+)
+
+
+def test_check_dynamic_hot_pix(tmp_path, monkeypatch):
+    monkeypatch.setenv("STARCHECK_DARK_CAL_CACHE", str(tmp_path))
 
-def test_check_dynamic_hot_pix():
     # Parameters of obsid 25274 from JUL0323A
     idxs = [1, 2, 3, 4, 5, 6, 7, 8]
     yags = [
@@ -65,3 +75,73 @@ def test_check_dynamic_hot_pix():
             assert imposter2["t_ccd"] == imposter1["t_ccd"] - dyn_bgd_dt_ccd
             assert imposter1["bad2_mag"] < imposter2["bad2_mag"]
             assert imposter1["offset"] > imposter2["offset"]
+
+
+def test_guide_count_batch():
+    mags = [[7.0, 8.217, 9.052, 9.75, 10.407, 10.503], [9.0, 10.1, 10.3], []]
+    t_ccds = [-11.2, -8.5, -10.0]
+    dates = ["2023:138", "2023:140", "2023:140"]
+    dyn_bgds = [1, 0, 1]
+    counts = guide_count_batch(mags, t_ccds, dates, dyn_bgds)
+    for cat_mags, t_ccd, date, dyn_bgd, count, count_9th in zip(
+        mags,
+        t_ccds,
+        dates,
+        dyn_bgds,
+        counts["guide_count"],
+        counts["guide_count_9th"],
+        strict=True,
+    ):
+        assert count == guide_count(cat_mags, t_ccd, 0, date, dyn_bgd=dyn_bgd)
+        assert count_9th == guide_count(cat_mags, t_ccd, 1, date)
+
+    assert guide_count_batch([], [], [], []) == {
+        "guide_count": [],
+        "guide_count_9th": [],
+    }
+
+
+def get_proseco_kwargs(ra, t_ccd):
+    """Get proseco_probs keywords for the acq catalog proseco picks at ``ra``"""
+    from proseco.catalog import get_aca_catalog
+    from Quaternion import Quat
+
+    att = Quat([ra, 20, 30]).q.tolist()
+    kwargs = {
+        "obsid": 0,
+        "att": att,
+        "date": "2023:140",
+        "man_angle": 90,
+        "t_ccd_acq": t_ccd,
+        "t_ccd_guide": t_ccd,
+        "dither_acq": [8, 8],
+        "dither_guide": [8, 8],
+        "detector": "ACIS-S",
+        "sim_offset": 0,
+    }
+    aca = get_aca_catalog(**kwargs, n_fid=0, n_guide=0, focus_offset=0)
+    kwargs["include_ids_acq"] = [int(val) for val in aca.acqs["id"]]
+    kwargs["include_halfws_acq"] = [int(val) for val in aca.acqs["halfw"]]
+    kwargs["n_acq"] = len(aca.acqs)
+    return kwargs
+
+
+def test_proseco_probs_batch():
+    obs_kwargs = [
+        get_proseco_kwargs(ra, t_ccd)
+        for ra, t_ccd in ((10, -12.0), (20, -8.0), (30, -10.0))
+    ]
+    exp = [list(proseco_probs(**kw)) for kw in obs_kwargs]
+    assert proseco_probs_batch(obs_kwargs, n_processes=2) == exp
+    assert proseco_probs_batch(obs_kwargs, n_processes=1) == exp
+    assert proseco_probs_batch([]) == []
+
+
+def test_proseco_probs_acq_only():
+    for t_ccd in (-12.0, -5.0):
+        kwargs = get_proseco_kwargs(10, t_ccd)
+        p_acqs, P2, expected = proseco_probs(**kwargs)
+        exp_p_acqs, exp_P2, exp_expected = proseco_probs(**kwargs, full_catalog=True)
+        assert np.allclose(p_acqs, exp_p_acqs, rtol=0, atol=1e-8)
+        assert np.isclose(P2, exp_P2, rtol=0, atol=1e-8)
+        assert np.isclose(expected, exp_expected, rtol=0, atol=1e-8)
@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import warnings
@@ -6,37 +7,30 @@ from pathlib import Path
 import agasc
 import chandra_aca.star_probs
 import cxotime
-import kadi.commands.states as kadi_states
-import mica.stats.acq_stats
-import mica.stats.guide_stats
 import numpy as np
 import Quaternion
-import sparkles
 from astropy.table import Table
-from bs4 import BeautifulSoup
 from Chandra.Time import DateTime
-from chandra_aca.dark_model import dark_temp_scale
 from chandra_aca.drift import (
     get_fid_offset,  # noqa: F401 - need import for starcheck server
 )
 from chandra_aca.star_probs import mag_for_p_acq
 from chandra_aca.transform import mag_to_count_rate, pixels_to_yagzag, yagzag_to_pixels
 from cxotime import CxoTime
-from mica.archive import aca_dark
 from parse_cm import read_backstop_as_list, write_backstop
-from proseco.catalog import get_aca_catalog
-from proseco.core import ACABox
-from proseco.guide import get_imposter_mags
-from ska_quatutil import radec2yagzag
 from testr import test_helper
 
 import starcheck
 from starcheck import __version__ as version
-from starcheck.calc_ccd_temps import get_ccd_temps
-from starcheck.plot import make_plots_for_obsid
+from starcheck import cones, dark_cal, mica_stats
 
-ACQS = mica.stats.acq_stats.get_stats()
-GUIDES = mica.stats.guide_stats.get_stats()
+logger = logging.getLogger(__name__)
+
+# Heavy packages (proseco, sparkles, kadi states, the mica dark archive, bs4,
+# and the xija / plotting modules) are imported in the functions that use them,
+# and the mica acq and guide stats are loaded on first use (starcheck.mica_stats),
+# so that the starcheck server can answer simple calls as soon as it starts.  Call
+# preload() to do all of that up front, e.g. in a background thread.
 
 # Ignore warnings about clipping the acquisition model magnitudes
 # from chandra_aca.star_probs
@@ -53,6 +47,7 @@ def get_agasc_file():
 
 def prehtml2text(html_text):
     """Convert the starcheck report html to plain text."""
+    from bs4 import BeautifulSoup
 
     soup = BeautifulSoup(html_text, "lxml")
 
@@ -94,10 +89,14 @@ def time2date(val):
 
 
 def ccd_temp_wrapper(**kwargs):
+    from starcheck.calc_ccd_temps import get_ccd_temps
+
     return get_ccd_temps(**kwargs)
 
 
 def plot_cat_wrapper(**kwargs):
+    from starcheck.plot import make_plots_for_obsid
+
     return make_plots_for_obsid(**kwargs)
 
 
@@ -114,6 +113,8 @@ def set_kadi_scenario_default():
 
 
 def get_cheta_source():
+    import starcheck.calc_ccd_temps
+
     sources = starcheck.calc_ccd_temps.fetch.data_source.sources()
     if len(sources) == 1 and sources[0] == "cxc":
         return "cxc"
@@ -131,6 +132,8 @@ def get_data_dir():
 
 
 def get_dither_kadi_state(date):
+    import kadi.commands.states as kadi_states
+
     cols = [
         "dither",
         "dither_ampl_pitch",
@@ -265,6 +268,25 @@ def _yagzag_to_pixels(yag, zag):
     return row.tolist(), col.tolist()
 
 
+# Dynamic background bonus: t_ccd offset (degC) for the dyn_bgd_n_faint faintest
+# guide stars, with dyn_bgd_n_faint set to 2 after the PEA patch uplink and
+# activation on 2023:139 (0 before).
+DYN_BGD_DT_CCD = -4.0
+DYN_BGD_N_FAINT = 2
+DYN_BGD_START = "2023:139"
+
+
+def get_dyn_bgd_n_faint(date):
+    """
+    Get the number of faint guide stars with the dynamic background bonus.
+
+    :param date: date (or array of dates)
+    :returns: dyn_bgd_n_faint (int, or array of int)
+    """
+    n_faint = np.where(CxoTime(date).date >= DYN_BGD_START, DYN_BGD_N_FAINT, 0)
+    return n_faint.tolist()
+
+
 def apply_t_ccds_bonus(mags, t_ccd, date):
     """
     Apply dynamic background bonus temperatures.
@@ -279,10 +301,10 @@ def apply_t_ccds_bonus(mags, t_ccd, date):
                  dyn_bgd_n_faint to 2 after PEA patch uplink and activation on 2023:139.
     :returns: list of dynamic background bonus temperatures (degC) in the order of mags
     """
-    dyn_bgd_dt_ccd = -4.0
-    # Set dyn_bgd_n_faint to 2 after PEA patch uplink and activation on 2023:139
-    dyn_bgd_n_faint = 2 if CxoTime(date).date >= "2023:139" else 0
-    return sparkles.get_t_ccds_bonus(mags, t_ccd, dyn_bgd_n_faint, dyn_bgd_dt_ccd)
+    import sparkles
+
+    dyn_bgd_n_faint = get_dyn_bgd_n_faint(date)
+    return sparkles.get_t_ccds_bonus(mags, t_ccd, dyn_bgd_n_faint, DYN_BGD_DT_CCD)
 
 
 def guide_count(mags, t_ccd, count_9th, date, dyn_bgd=True):
@@ -310,6 +332,75 @@ def guide_count(mags, t_ccd, count_9th, date, dyn_bgd=True):
     )
 
 
+def guide_count_batch(mags, t_ccds, dates, dyn_bgds):
+    """
+    Get the guide count and the count_9th guide count for many catalogs.
+
+    This is ``guide_count`` with ``count_9th`` False (applying the dynamic
+    background bonus if the catalog ``dyn_bgd`` is set) and True (always applying
+    the bonus) for each catalog, in one call.  The dates are converted once for
+    all the catalogs and the bonus is computed once per catalog.
+
+    :param mags: list (one per catalog) of lists of guide star magnitudes
+    :param t_ccds: list of estimated t_ccd for each catalog (without penalty)
+    :param dates: list of dates of the observations
+    :param dyn_bgds: list of whether to apply the dynamic background bonus to the
+        guide count (bool or 0 or 1) for each catalog
+    :returns: dict with keys guide_count and guide_count_9th, each a list of
+        fractional guide counts (float) in the order of the catalogs
+    """
+    import sparkles
+
+    out = {"guide_count": [], "guide_count_9th": []}
+    if len(mags) == 0:
+        return out
+
+    dyn_bgd_n_faints = get_dyn_bgd_n_faint(dates)
+    for cat_mags, t_ccd, dyn_bgd_n_faint, dyn_bgd in zip(
+        mags, t_ccds, dyn_bgd_n_faints, dyn_bgds, strict=True
+    ):
+        t_ccds_bonus = sparkles.get_t_ccds_bonus(
+            cat_mags, t_ccd, dyn_bgd_n_faint, DYN_BGD_DT_CCD
+        )
+        count_9th = chandra_aca.star_probs.guide_count(
+            np.array(cat_mags), t_ccds_bonus, True
+        )
+        count = chandra_aca.star_probs.guide_count(
+            np.array(cat_mags),
+            t_ccds_bonus if dyn_bgd else [t_ccd] * len(cat_mags),
+            False,
+        )
+        out["guide_count"].append(float(count))
+        out["guide_count_9th"].append(float(count_9th))
+    return out
+
+
+def _get_imposter_mags(entries, dark, dither):
+    """
+    Call proseco.guide.get_imposter_mags for all the candidates in ``entries``.
+
+    If the call fails (most likely for a candidate completely off the CCD), each
+    candidate is tried on its own so that only the failed ones are lost.
+
+    :param entries: Table of candidates with columns row and col
+    :param dark: dark current image (ACAImage)
+    :param dither: dither ACABox
+    :returns: list of (imposter mag, row, col) or None (failed) per candidate
+    """
+    from proseco.guide import get_imposter_mags
+
+    try:
+        imp_mags, imp_rows, imp_cols = get_imposter_mags(entries, dark, dither)
+        return list(zip(imp_mags, imp_rows, imp_cols, strict=True))
+    except Exception:
+        if len(entries) == 1:
+            return [None]
+    return [
+        _get_imposter_mags(entries[i : i + 1], dark, dither)[0]
+        for i in range(len(entries))
+    ]
+
+
 def check_hot_pix(idxs, yags, zags, mags, types, t_ccd, date, dither_y, dither_z):
     """
     Check for hot pixels.
@@ -325,6 +416,10 @@ def check_hot_pix(idxs, yags, zags, mags, types, t_ccd, date, dither_y, dither_z
     the brightest 2x2 for each and calculates the mag for that region.  The
     worse case offset is then added to an entry for the star index.
 
+    The dark cal and its scaled images for each t_ccd (rounded to 0.01 C) come
+    from the server cache in ``starcheck.dark_cal``, and all candidates with the
+    same t_ccd and dither are evaluated in one get_imposter_mags call.
+
     :param idxs: catalog indexes as list or array
     :param yags: catalog yangs as list or array
     :param zags: catalog zangs as list or array
@@ -341,12 +436,9 @@ def check_hot_pix(idxs, yags, zags, mags, types, t_ccd, date, dither_y, dither_z
              the imposter mag ran successfully, calculated centroid offset, and
              star or fid info to make a warning.
     """
+    from proseco.core import ACABox
 
-    dark_props = aca_dark.get_dark_cal_props(
-        date=date, include_image=True, aca_image=True
-    )
-    dark = dark_props["image"]
-    dark_t_ccd = dark_props["ccd_temp"]
+    dark_props, _ = dark_cal.get_dark_cal(date)
 
     def imposter_offset(cand_mag, imposter_mag):
         """
@@ -371,47 +463,55 @@ def check_hot_pix(idxs, yags, zags, mags, types, t_ccd, date, dither_y, dither_z
     guide_t_ccds = apply_t_ccds_bonus(guide_mags, t_ccd, date)
     guide_t_ccd_dict = dict(zip(guide_idxs, guide_t_ccds, strict=False))
 
-    imposters = []
+    # Candidates (guide stars and fids) in catalog order, grouped by t_ccd and dither
+    cands = []
+    groups = {}
     for idx, yag, zag, mag, ctype in zip(idxs, yags, zags, mags, types, strict=False):
         if ctype in ["BOT", "GUI", "FID"]:
             if ctype in ["BOT", "GUI"]:
                 t_ccd_i = guide_t_ccd_dict[idx]
-                dither = ACABox((dither_y, dither_z))
+                dither = (dither_y, dither_z)
             else:
                 t_ccd_i = t_ccd
-                dither = ACABox((5.0, 5.0))
-            row, col = yagzag_to_pixels(yag, zag, allow_bad=True)
-            # Handle any errors in get_imposter_mags with a try/except.  This doesn't
-            # try to pass back a message.  Most likely this will only fail if the star
-            # or fid is completely off the CCD and will have other warning.
-            try:
-                # get_imposter_mags takes a Table of candidates as its first argument, so construct
-                # a single-candidate table `entries`
-                entries = Table(
-                    [{"idx": idx, "row": row, "col": col, "mag": mag, "type": ctype}]
-                )
-                scale = dark_temp_scale(dark_t_ccd, t_ccd_i)
-                imp_mags, imp_rows, imp_cols = get_imposter_mags(entries, dark, dither)
-                imp_mags, imp_rows, imp_cols = get_imposter_mags(
-                    entries, dark * scale, dither
-                )
-                offset = imposter_offset(mag, imp_mags[0])
-                imposters.append(
-                    {
-                        "idx": int(idx),
-                        "status": int(0),
-                        "entry_row": float(row),
-                        "entry_col": float(col),
-                        "bad2_row": float(imp_rows[0]),
-                        "bad2_col": float(imp_cols[0]),
-                        "bad2_mag": float(imp_mags[0]),
-                        "offset": float(offset),
-                        "t_ccd": float(t_ccd_i),
-                        "dark_date": dark_props["date"],
-                    }
-                )
-            except Exception:
-                imposters.append({"idx": int(idx), "status": int(1)})
+                dither = (5.0, 5.0)
+            groups.setdefault((t_ccd_i, dither), []).append(len(cands))
+            cands.append(
+                {"idx": idx, "yag": yag, "zag": zag, "mag": mag, "type": ctype}
+            )
+    if not cands:
+        return []
+
+    cands = Table(cands)
+    cands["row"], cands["col"] = yagzag_to_pixels(
+        np.array(cands["yag"], dtype=float),
+        np.array(cands["zag"], dtype=float),
+        allow_bad=True,
+    )
+
+    # Handle any errors in get_imposter_mags by candidate.  This doesn't try to
+    # pass back a message.  Most likely this will only fail if the star or fid is
+    # completely off the CCD and will have other warning.
+    imposters = [{"idx": int(idx), "status": int(1)} for idx in cands["idx"]]
+    for (t_ccd_i, dither), group in groups.items():
+        _, dark = dark_cal.get_scaled_dark(date, t_ccd_i)
+        imps = _get_imposter_mags(cands[group], dark, ACABox(dither))
+        for i, imp in zip(group, imps, strict=True):
+            if imp is None:
+                continue
+            cand = cands[i]
+            imp_mag, imp_row, imp_col = imp
+            imposters[i] = {
+                "idx": int(cand["idx"]),
+                "status": int(0),
+                "entry_row": float(cand["row"]),
+                "entry_col": float(cand["col"]),
+                "bad2_row": float(imp_row),
+                "bad2_col": float(imp_col),
+                "bad2_mag": float(imp_mag),
+                "offset": float(imposter_offset(cand["mag"], imp_mag)),
+                "t_ccd": float(t_ccd_i),
+                "dark_date": dark_props["date"],
+            }
     return imposters
 
 
@@ -421,44 +521,30 @@ def _get_agasc_stars(ra, dec, roll, radius, date, agasc_file):
 
     Update the table with the yag and zag of each star.
     Return as a dictionary with the agasc ids as keys and all of the values as
-    simple Python types (int, float)
-    """
-    stars = agasc.get_agasc_cone(
-        float(ra),
-        float(dec),
-        float(radius),
-        date,
-        agasc_file,
+    simple Python types (int, float).  See also starcheck.cones for keeping the
+    cone in the server and querying it by handle.
+    """
+    stars = cones.get_cone_stars(
+        ra, dec, roll, radius, date=date, agasc_file=agasc_file
     )
-    q_aca = Quaternion.Quat([float(ra), float(dec), float(roll)])
-    yags, zags = radec2yagzag(stars["RA_PMCORR"], stars["DEC_PMCORR"], q_aca)
-    yags *= 3600
-    zags *= 3600
-    stars["yang"] = yags
-    stars["zang"] = zags
-
-    # Get a dictionary of the stars with the columns that are used
-    # This needs to be de-numpy-ified to pass back into Perl
-    stars_dict = {}
-    for star in stars:
-        stars_dict[str(star["AGASC_ID"])] = {
-            "id": int(star["AGASC_ID"]),
-            "class": int(star["CLASS"]),
-            "ra": float(star["RA_PMCORR"]),
-            "dec": float(star["DEC_PMCORR"]),
-            "mag_aca": float(star["MAG_ACA"]),
-            "bv": float(star["COLOR1"]),
-            "color1": float(star["COLOR1"]),
-            "mag_aca_err": float(star["MAG_ACA_ERR"]),
-            "poserr": float(star["POS_ERR"]),
-            "yag": float(star["yang"]),
-            "zag": float(star["zang"]),
-            "aspq": int(star["ASPQ1"]),
-            "var": int(star["VAR"]),
-            "aspq1": int(star["ASPQ1"]),
-        }
-
-    return stars_dict
+    return {str(star["id"]): star for star in cones.stars_to_dicts(stars)}
+
+
+def preload():
+    """
+    Import the heavy modules used by starcheck and load the mica stats.
+
+    The starcheck server runs this in a background thread once it is listening.
+    """
+    import kadi.commands.states  # noqa: F401
+    import proseco.catalog  # noqa: F401
+    import sparkles  # noqa: F401
+    from mica.archive import aca_dark  # noqa: F401
+
+    import starcheck.calc_ccd_temps
+    import starcheck.plot  # noqa: F401
+
+    mica_stats.get_star_stats_index()
 
 
 def get_mica_star_stats(agasc_id, time):
@@ -466,43 +552,33 @@ def get_mica_star_stats(agasc_id, time):
     Get the acq and guide star statistics for a star before a given time.
 
     The time filter is just there to make this play well when run in regression.
-    The mica acq and guide stats are fetched into globals ACQS and GUIDES
-    and this method just filters for the relevant ones for a star and returns
-    a dictionary of summarized statistics.
+    The mica acq and guide stats are fetched and indexed by star once (see
+    ``starcheck.mica_stats``) and this method just looks up the relevant ones for
+    a star and returns a dictionary of summarized statistics.
 
     :param agasc_id: agasc id of star
     :param time: time used as end of range to retrieve statistics.
 
     :return: dictionary of stats for the observed history of the star
     """
+    return mica_stats.get_star_stats(agasc_id, time)
 
-    # Cast the inputs
-    time = float(time)
-    agasc_id = int(agasc_id)
 
-    acqs = Table(ACQS[(ACQS["agasc_id"] == agasc_id) & (ACQS["guide_tstart"] < time)])
-    ok = acqs["img_func"] == "star"
-    guides = Table(
-        GUIDES[(GUIDES["agasc_id"] == agasc_id) & (GUIDES["kalman_tstart"] < time)]
-    )
-    mags = np.concatenate(
-        [
-            acqs["mag_obs"][acqs["mag_obs"] != 0],
-            guides["aoacmag_mean"][guides["aoacmag_mean"] != 0],
-        ]
-    )
+def get_mica_star_stats_batch(agasc_ids, times):
+    """
+    Get the acq and guide star statistics for many stars before given times.
 
-    avg_mag = float(np.mean(mags)) if (len(mags) > 0) else float(13.94)
-    stats = {
-        "acq": len(acqs),
-        "acq_noid": int(np.count_nonzero(~ok)),
-        "gui": len(guides),
-        "gui_bad": int(np.count_nonzero(guides["f_track"] < 0.95)),
-        "gui_fail": int(np.count_nonzero(guides["f_track"] < 0.01)),
-        "gui_obc_bad": int(np.count_nonzero(guides["f_obc_bad"] > 0.05)),
-        "avg_mag": avg_mag,
-    }
-    return stats
+    This is ``get_mica_star_stats`` for a list of stars (e.g. all the identified
+    stars in a week of catalogs) in one call.
+
+    :param agasc_ids: list of agasc ids
+    :param times: list of times (one per star) used as end of range to retrieve
+        statistics
+
+    :return: dictionary of lists of stats (keys acq, acq_noid, gui, gui_bad,
+        gui_fail, gui_obc_bad, avg_mag), with one item per star
+    """
+    return mica_stats.get_star_stats_batch(agasc_ids, times)
 
 
 def _mag_for_p_acq(p_acq, date, t_ccd):
@@ -512,31 +588,14 @@ def _mag_for_p_acq(p_acq, date, t_ccd):
     return mag_for_p_acq(float(p_acq), date, float(t_ccd))
 
 
-def proseco_probs(**kw):
+def get_proseco_args(kw):
     """
-    Calculate proseco acquisition probabilities.
-
-    Call proseco's get_acq_catalog with the parameters supplied in `kwargs` for
-    a specific obsid catalog and return the individual acq star probabilities,
-    the P2 value for the catalog, and the expected number of acq stars.
-
-    `kwargs` will be a Perl hash converted to dict of the expected
-    keyword params. These keys must be defined:
-
-    'q1', 'q2', 'q3', 'q4' = the target quaternion 'man_angle' the maneuver
-    angle to the target quaternion in degrees. 'acq_ids' list of acq star ids
-    'halfwidths' list of acq star halfwidths in arcsecs 't_ccd_acq' acquisition
-    temperature in deg C 'date' observation date (in Chandra.Time compatible
-    format) 'detector' science detector 'sim_offset' SIM offset
-
-    As these values are from a Perl hash, bytestrings will be converted by
-    de_bytestr early in this method.
-
-    :param **kw: dict of expected keywords
-    :return tuple: (list of floats of star acq probabilties, float P2, float
-        expected acq stars)
+    Get the get_aca_catalog arguments for the proseco_probs keywords ``kw``.
 
+    :param kw: dict of proseco_probs keywords
+    :returns: dict of get_aca_catalog keyword arguments
     """
+    from proseco.core import ACABox
 
     args = {
         "obsid": 0,
@@ -556,18 +615,156 @@ def proseco_probs(**kw):
         "n_guide": 0,
         "focus_offset": 0,
     }
-    aca = get_aca_catalog(**args)
-    acq_cat = aca.acqs
+    return args
+
+
+def get_proseco_probs(args, full_catalog=False):
+    """
+    Get the acq star probabilities, P2 and expected acq stars from proseco.
+
+    By default only the acquisition catalog is made, with proseco's
+    get_acq_catalog for exactly the stars and halfwidths in include_ids_acq and
+    include_halfws_acq (the get_aca_catalog acq arguments).  proseco fetches the
+    AGASC stars itself in both cases.  The guide and fid selection and the ACATable
+    set up of get_aca_catalog have no effect on the acq probabilities with n_guide
+    and n_fid of 0, so this matches the full catalog (``full_catalog=True``) to
+    within numerical precision (see validate/validate_proseco_probs.py).
+
+    :param args: dict of get_aca_catalog keyword arguments (from get_proseco_args)
+    :param full_catalog: make the full catalog with get_aca_catalog
+    :returns: tuple of (list of acq star probabilities in the order of
+        include_ids_acq, P2, expected acq stars)
+    """
+    if full_catalog:
+        from proseco.catalog import get_aca_catalog
+
+        acq_cat = get_aca_catalog(**args).acqs
+    else:
+        from proseco.acq import get_acq_catalog
+
+        acq_cat = get_acq_catalog(
+            obsid=args["obsid"],
+            att=args["att"],
+            date=args["date"],
+            n_acq=args["n_acq"],
+            man_angle=args["man_angle"],
+            t_ccd=args["t_ccd_acq"],
+            dither=args["dither_acq"],
+            detector=args["detector"],
+            sim_offset=args["sim_offset"],
+            focus_offset=args["focus_offset"],
+            include_ids=args["include_ids_acq"],
+            include_halfws=args["include_halfws_acq"],
+        )
 
     # Assign the proseco probabilities back into an array.
     p_acqs = [
         float(acq_cat["p_acq"][acq_cat["id"] == acq_id][0])
-        for acq_id in kw["include_ids_acq"]
+        for acq_id in args["include_ids_acq"]
     ]
 
     return p_acqs, float(-np.log10(acq_cat.calc_p_safe())), float(np.sum(p_acqs))
 
 
+def proseco_probs(**kw):
+    """
+    Calculate proseco acquisition probabilities.
+
+    Call proseco's get_acq_catalog with the parameters supplied in `kwargs` for
+    a specific obsid catalog and return the individual acq star probabilities,
+    the P2 value for the catalog, and the expected number of acq stars.
+
+    `kwargs` will be a Perl hash converted to dict of the expected
+    keyword params. These keys must be defined:
+
+    'q1', 'q2', 'q3', 'q4' = the target quaternion 'man_angle' the maneuver
+    angle to the target quaternion in degrees. 'acq_ids' list of acq star ids
+    'halfwidths' list of acq star halfwidths in arcsecs 't_ccd_acq' acquisition
+    temperature in deg C 'date' observation date (in Chandra.Time compatible
+    format) 'detector' science detector 'sim_offset' SIM offset
+
+    As these values are from a Perl hash, bytestrings will be converted by
+    de_bytestr early in this method.
+
+    If 'full_catalog' is true then the full proseco catalog is made instead of
+    just the acquisition catalog (see ``get_proseco_probs``).
+
+    :param **kw: dict of expected keywords
+    :return tuple: (list of floats of star acq probabilties, float P2, float
+        expected acq stars)
+
+    """
+    return get_proseco_probs(
+        get_proseco_args(kw), full_catalog=bool(kw.get("full_catalog"))
+    )
+
+
+def get_n_proseco_processes(n_obs):
+    """
+    Get the number of processes for ``proseco_probs_batch``.
+
+    This is the number of cores available to this process, or
+    ``$STARCHECK_PROSECO_PROCESSES`` if set, and at most ``n_obs``.
+
+    :param n_obs: number of observations
+    :returns: int number of processes
+    """
+    n_processes = os.environ.get("STARCHECK_PROSECO_PROCESSES")
+    if n_processes:
+        n_processes = int(n_processes)
+    elif hasattr(os, "sched_getaffinity"):
+        n_processes = len(os.sched_getaffinity(0))
+    else:
+        n_processes = os.cpu_count() or 1
+    return max(min(n_processes, n_obs), 1)
+
+
+def proseco_probs_batch(obs_kwargs, n_processes=None, full_catalog=False):
+    """
+    Calculate proseco acquisition probabilities for many observations.
+
+    This is ``proseco_probs`` for each item of ``obs_kwargs``, with the proseco
+    calls spread over a pool of processes.  Each result depends only on its own
+    arguments, so the results are identical to calling ``proseco_probs`` in turn.
+    With one process (or if the pool cannot be started) the observations are done
+    serially here.
+
+    :param obs_kwargs: list of dict of proseco_probs keywords
+    :param n_processes: number of processes (default from get_n_proseco_processes)
+    :param full_catalog: make the full proseco catalogs (see get_proseco_probs)
+    :returns: list of [list of acq star probabilities, P2, expected acq stars] in
+        the order of ``obs_kwargs``
+    """
+    args_list = [get_proseco_args(kw) for kw in obs_kwargs]
+    if n_processes is None:
+        n_processes = get_n_proseco_processes(len(args_list))
+
+    results = None
+    if n_processes > 1 and len(args_list) > 1:
+        import concurrent.futures
+        import multiprocessing
+
+        try:
+            # Use spawn since the starcheck server process has threads
+            with concurrent.futures.ProcessPoolExecutor(
+                n_processes, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                results = list(
+                    pool.map(
+                        functools.partial(get_proseco_probs, full_catalog=full_catalog),
+                        args_list,
+                    )
+                )
+        except (OSError, concurrent.futures.process.BrokenProcessPool) as err:
+            logger.warning(f"proseco process pool failed, running serially: {err}")
+    if results is None:
+        results = [
+            get_proseco_probs(args, full_catalog=full_catalog) for args in args_list
+        ]
+
+    return [list(result) for result in results]
+
+
 def vehicle_filter_backstop(backstop_file, outfile):
     """
     Filter the backstop file to remove SCS 131, 132, 133 except MP_OBSID commands.
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmark ``starcheck.utils.check_hot_pix`` against the previous implementation.
+
+The previous implementation made a one-row candidates table and called
+``proseco.guide.get_imposter_mags`` twice for each guide star and fid (once on
+the raw dark and once on a full scaled copy of the dark).  The current one
+scales the dark once per distinct t_ccd and evaluates the candidates with the
+same t_ccd and dither in one call.  Both use the inputs of
+``starcheck/tests/test_utils.py::test_check_dynamic_hot_pix`` (obsid 25274 from
+JUL0323A) and the results are checked to match.
+
+% python validate/bench_check_hot_pix.py --n-iter 10
+"""
+
+import argparse
+import time
+
+from astropy.table import Table
+from chandra_aca.dark_model import dark_temp_scale
+from chandra_aca.transform import mag_to_count_rate, yagzag_to_pixels
+from mica.archive import aca_dark
+from proseco.core import ACABox
+from proseco.guide import get_imposter_mags
+
+from starcheck.utils import apply_t_ccds_bonus, check_hot_pix
+
+# Parameters of obsid 25274 from JUL0323A (see test_check_dynamic_hot_pix)
+KWARGS = {
+    "idxs": [1, 2, 3, 4, 5, 6, 7, 8],
+    "yags": [
+        -773.135672595873,
+        2140.37683262341,
+        -1826.2356726102,
+        -1380.0856717436,
+        -713.835673125859,
+        -1322.09192254126,
+        -2185.44191819395,
+        101.314326039055,
+    ],
+    "zags": [
+        -1741.99192158156,
+        166.726825875404,
+        160.264325897248,
+        -2469.16691506774,
+        -436.641923465157,
+        -1728.21692250903,
+        -1033.99192330043,
+        1259.22057376853,
+    ],
+    "mags": [7, 7, 7, 8.217, 9.052, 9.75, 10.407, 10.503],
+    "types": ["FID", "FID", "FID", "BOT", "BOT", "BOT", "BOT", "BOT"],
+    "t_ccd": -11.2132562902057,
+    "dither_y": 7.9989482672109,
+    "dither_z": 7.9989482672109,
+}
+
+
+def get_opt(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark check_hot_pix")
+    parser.add_argument(
+        "--date", default="2023:140", help="Observation date (default=2023:140)"
+    )
+    parser.add_argument(
+        "--n-iter", default=10, type=int, help="Number of calls of each version"
+    )
+    opt = parser.parse_args(args)
+    return opt
+
+
+def check_hot_pix_prev(
+    *, idxs, yags, zags, mags, types, t_ccd, date, dither_y, dither_z
+):
+    """Previous check_hot_pix: two get_imposter_mags calls per candidate"""
+    dark_props = aca_dark.get_dark_cal_props(
+        date=date, include_image=True, aca_image=True
+    )
+    dark = dark_props["image"]
+    dark_t_ccd = dark_props["ccd_temp"]
+
+    def imposter_offset(cand_mag, imposter_mag):
+        cand_counts = mag_to_count_rate(cand_mag)
+        spoil_counts = mag_to_count_rate(imposter_mag)
+        return spoil_counts * 3 * 5 / (spoil_counts + cand_counts)
+
+    guide_mags = []
+    guide_idxs = []
+    for idx, mag, ctype in zip(idxs, mags, types, strict=False):
+        if ctype in ["BOT", "GUI"]:
+            guide_mags.append(mag)
+            guide_idxs.append(idx)
+    guide_t_ccds = apply_t_ccds_bonus(guide_mags, t_ccd, date)
+    guide_t_ccd_dict = dict(zip(guide_idxs, guide_t_ccds, strict=False))
+
+    imposters = []
+    for idx, yag, zag, mag, ctype in zip(idxs, yags, zags, mags, types, strict=False):
+        if ctype in ["BOT", "GUI", "FID"]:
+            if ctype in ["BOT", "GUI"]:
+                t_ccd_i = guide_t_ccd_dict[idx]
+                dither = ACABox((dither_y, dither_z))
+            else:
+                t_ccd_i = t_ccd
+                dither = ACABox((5.0, 5.0))
+            row, col = yagzag_to_pixels(yag, zag, allow_bad=True)
+            try:
+                entries = Table(
+                    [{"idx": idx, "row": row, "col": col, "mag": mag, "type": ctype}]
+                )
+                scale = dark_temp_scale(dark_t_ccd, t_ccd_i)
+                imp_mags, imp_rows, imp_cols = get_imposter_mags(entries, dark, dither)
+                imp_mags, imp_rows, imp_cols = get_imposter_mags(
+                    entries, dark * scale, dither
+                )
+                offset = imposter_offset(mag, imp_mags[0])
+                imposters.append(
+                    {
+                        "idx": int(idx),
+                        "status": int(0),
+                        "entry_row": float(row),
+                        "entry_col": float(col),
+                        "bad2_row": float(imp_rows[0]),
+                        "bad2_col": float(imp_cols[0]),
+                        "bad2_mag": float(imp_mags[0]),
+                        "offset": float(offset),
+                        "t_ccd": float(t_ccd_i),
+                        "dark_date": dark_props["date"],
+                    }
+                )
+            except Exception:
+                imposters.append({"idx": int(idx), "status": int(1)})
+    return imposters
+
+
+def time_calls(func, date, n_iter):
+    t0 = time.perf_counter()
+    for _ in range(n_iter):
+        out = func(date=date, **KWARGS)
+    return out, (time.perf_counter() - t0) / n_iter
+
+
+def main(args=None):
+    opt = get_opt(args)
+
+    # Read the dark cal once so that neither version pays for the first read
+    aca_dark.get_dark_cal_props(date=opt.date, include_image=True, aca_image=True)
+
+    exp, t_prev = time_calls(check_hot_pix_prev, opt.date, opt.n_iter)
+    out, t_batch = time_calls(check_hot_pix, opt.date, opt.n_iter)
+    if out != exp:
+        raise ValueError(f"results do not match:\n{exp}\n{out}")
+
+    print(f"date: {opt.date}  candidates: {len(out)}  iterations: {opt.n_iter}")
+    print(f"previous (per candidate): {t_prev * 1e3:8.1f} ms per call")
+    print(f"batched:                  {t_batch * 1e3:8.1f} ms per call")
+    print(f"speedup: {t_prev / t_batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
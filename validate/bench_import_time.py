@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmark import and startup time of starcheck.utils and the starcheck server.
+
+This reports:
+
+- ``python -X importtime`` for ``import starcheck.utils``, summed by top-level
+  package (self time) and the slowest individual modules (cumulative time)
+- the time for ``starcheck.utils.preload()`` (heavy imports and the mica acq and
+  guide stats) after that import
+- the time from starting ``python -m starcheck.server`` to the ready file, and
+  to the first response (``utils.starcheck_version``)
+
+% python validate/bench_import_time.py --out import_time.json
+"""
+
+import argparse
+import collections
+import json
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HOST = "localhost"
+
+
+def get_opt(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark starcheck import and server startup time"
+    )
+    parser.add_argument(
+        "--n-top", default=20, type=int, help="Number of packages/modules to list"
+    )
+    parser.add_argument("--out", help="Write the results to this JSON file")
+    opt = parser.parse_args(args)
+    return opt
+
+
+def get_import_times(stmt):
+    """
+    Run ``stmt`` in a new Python with ``-X importtime``.
+
+    :returns: list of (module name, self usec, cumulative usec)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", stmt],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:") :].split("|")
+        times.append((name.strip(), int(self_us), int(cum_us)))
+    return times
+
+
+def get_preload_time():
+    stmt = (
+        "import time, starcheck.utils as u; t0 = time.perf_counter(); u.preload(); "
+        "print(time.perf_counter() - t0)"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", stmt], capture_output=True, text=True, check=True
+    )
+    return float(proc.stdout.split()[-1])
+
+
+def get_server_startup_times():
+    """Time to the server ready file and to the first response"""
+    key = secrets.token_hex(8)
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        port = sock.getsockname()[1]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ready_file = Path(tmpdir) / "ready"
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "starcheck.server", "--ready-file", str(ready_file)],
+            stdin=subprocess.PIPE,
+        )
+        try:
+            proc.stdin.write(f"{port}\n{key}\n0\n".encode())
+            proc.stdin.flush()
+            while not ready_file.exists():
+                time.sleep(0.001)
+            t_ready = time.perf_counter() - t0
+            cmd = {
+                "func": "utils.starcheck_version",
+                "args": [],
+                "kwargs": {},
+                "key": key,
+                "id": 1,
+            }
+            with (
+                socket.create_connection((HOST, port)) as sock,
+                sock.makefile("rb") as rfile,
+            ):
+                sock.sendall((json.dumps(cmd) + "\n").encode())
+                json.loads(rfile.readline())
+            t_first = time.perf_counter() - t0
+        finally:
+            proc.kill()
+            proc.wait()
+    return t_ready, t_first
+
+
+def main(args=None):
+    opt = get_opt(args)
+
+    times = get_import_times("import starcheck.utils")
+    by_package = collections.Counter()
+    for name, self_us, _ in times:
+        by_package[name.split(".")[0]] += self_us
+    total = sum(self_us for _, self_us, _ in times)
+
+    print(f"import starcheck.utils: {total / 1e6:.2f} s total")
+    print(f"\n{'package':>24s} {'self (s)':>9s}")
+    for name, self_us in by_package.most_common(opt.n_top):
+        print(f"{name:>24s} {self_us / 1e6:9.3f}")
+
+    print(f"\n{'module':>40s} {'cumulative (s)':>15s}")
+    slowest = sorted(times, key=lambda row: row[2], reverse=True)[: opt.n_top]
+    for name, _, cum_us in slowest:
+        print(f"{name:>40s} {cum_us / 1e6:15.3f}")
+
+    preload_time = get_preload_time()
+    print(f"\nstarcheck.utils.preload(): {preload_time:.2f} s")
+
+    t_ready, t_first = get_server_startup_times()
+    print(f"server ready: {t_ready:.2f} s")
+    print(f"server first response (utils.starcheck_version): {t_first:.2f} s")
+
+    if opt.out:
+        results = {
+            "import_total": total / 1e6,
+            "import_by_package": {
+                name: self_us / 1e6 for name, self_us in by_package.most_common()
+            },
+            "import_modules": [
+                {"module": name, "self": self_us / 1e6, "cumulative": cum_us / 1e6}
+                for name, self_us, cum_us in times
+            ],
+            "preload": preload_time,
+            "server_ready": t_ready,
+            "server_first_response": t_first,
+        }
+        Path(opt.out).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmark per-star latency of the mica acq and guide star stats lookup.
+
+This builds synthetic acq and guide stats tables with the columns used by
+``starcheck.utils.get_mica_star_stats`` and compares the per-star time for
+boolean masks over the full tables (the previous implementation) with the
+sorted ``starcheck.mica_stats.StarStats`` index.  Results are checked to match.
+It also reports the size of the star stats arrays and the time to load them from
+the memory-mapped cache.
+
+% python validate/bench_mica_star_stats.py --n-acq 2000000 --n-guide 4000000
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from astropy.table import Table
+
+from starcheck.mica_stats import StarStats
+
+
+def get_opt(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark mica star stats lookup per star"
+    )
+    parser.add_argument(
+        "--n-acq", default=2_000_000, type=int, help="Rows in the acq stats table"
+    )
+    parser.add_argument(
+        "--n-guide", default=4_000_000, type=int, help="Rows in the guide stats table"
+    )
+    parser.add_argument(
+        "--n-ids", default=500_000, type=int, help="Number of distinct AGASC ids"
+    )
+    parser.add_argument(
+        "--n-lookups", default=200, type=int, help="Number of star lookups to time"
+    )
+    parser.add_argument("--seed", default=0, type=int, help="Random seed")
+    opt = parser.parse_args(args)
+    return opt
+
+
+def get_tables(n_acq, n_guide, n_ids, rng):
+    t0, t1 = 0.0, 8e8
+    acq_stats = Table(
+        {
+            "agasc_id": rng.integers(0, n_ids, n_acq),
+            "guide_tstart": rng.uniform(t0, t1, n_acq),
+            "img_func": rng.choice(
+                ["star", "none", "spoiler"], n_acq, p=[0.9, 0.05, 0.05]
+            ),
+            "mag_obs": rng.uniform(5.0, 11.0, n_acq),
+        }
+    )
+    guide_stats = Table(
+        {
+            "agasc_id": rng.integers(0, n_ids, n_guide),
+            "kalman_tstart": rng.uniform(t0, t1, n_guide),
+            "aoacmag_mean": rng.uniform(5.0, 11.0, n_guide),
+            "f_track": rng.uniform(0.9, 1.0, n_guide),
+            "f_obc_bad": rng.uniform(0.0, 0.1, n_guide),
+        }
+    )
+    return acq_stats, guide_stats
+
+
+def get_star_stats_masks(acq_stats, guide_stats, agasc_id, time):
+    """Previous get_mica_star_stats: boolean masks over the full tables"""
+    acqs = Table(
+        acq_stats[
+            (acq_stats["agasc_id"] == agasc_id) & (acq_stats["guide_tstart"] < time)
+        ]
+    )
+    ok = acqs["img_func"] == "star"
+    guides = Table(
+        guide_stats[
+            (guide_stats["agasc_id"] == agasc_id)
+            & (guide_stats["kalman_tstart"] < time)
+        ]
+    )
+    mags = np.concatenate(
+        [
+            acqs["mag_obs"][acqs["mag_obs"] != 0],
+            guides["aoacmag_mean"][guides["aoacmag_mean"] != 0],
+        ]
+    )
+    avg_mag = float(np.mean(mags)) if (len(mags) > 0) else float(13.94)
+    return {
+        "acq": len(acqs),
+        "acq_noid": int(np.count_nonzero(~ok)),
+        "gui": len(guides),
+        "gui_bad": int(np.count_nonzero(guides["f_track"] < 0.95)),
+        "gui_fail": int(np.count_nonzero(guides["f_track"] < 0.01)),
+        "gui_obc_bad": int(np.count_nonzero(guides["f_obc_bad"] > 0.05)),
+        "avg_mag": avg_mag,
+    }
+
+
+def main(args=None):
+    opt = get_opt(args)
+    rng = np.random.default_rng(opt.seed)
+    acq_stats, guide_stats = get_tables(opt.n_acq, opt.n_guide, opt.n_ids, rng)
+    lookups = list(
+        zip(
+            rng.choice(acq_stats["agasc_id"], opt.n_lookups).tolist(),
+            rng.uniform(0, 8e8, opt.n_lookups).tolist(),
+            strict=True,
+        )
+    )
+
+    t0 = time.perf_counter()
+    star_stats = StarStats.from_tables(acq_stats, guide_stats)
+    t_build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    exp = [get_star_stats_masks(acq_stats, guide_stats, *lookup) for lookup in lookups]
+    t_masks = (time.perf_counter() - t0) / len(lookups)
+
+    t0 = time.perf_counter()
+    out = [star_stats.get_star_stats(*lookup) for lookup in lookups]
+    t_index = (time.perf_counter() - t0) / len(lookups)
+
+    for (agasc_id, _), stats_exp, stats_out in zip(lookups, exp, out, strict=True):
+        if stats_exp.keys() != stats_out.keys() or not all(
+            np.isclose(val, stats_out[key]) for key, val in stats_exp.items()
+        ):
+            raise ValueError(f"mismatch for {agasc_id}: {stats_exp} != {stats_out}")
+
+    print(f"acq rows: {opt.n_acq}  guide rows: {opt.n_guide}  lookups: {len(lookups)}")
+    print(f"index build: {t_build:.2f} s")
+    print(f"boolean masks: {t_masks * 1e6:10.1f} us per star")
+    print(f"sorted index:  {t_index * 1e6:10.1f} us per star")
+    print(f"speedup: {t_masks / t_index:.0f}x")
+
+    table_bytes = sum(
+        col.nbytes for tbl in (acq_stats, guide_stats) for col in tbl.itercols()
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        star_stats.write(tmpdir)
+        t0 = time.perf_counter()
+        cached = StarStats.read(tmpdir)
+        cached.get_star_stats(*lookups[0])
+        t_read = time.perf_counter() - t0
+    print(
+        f"tables: {table_bytes / 1e6:.0f} MB  star stats arrays: {cached.nbytes / 1e6:.0f} MB"
+    )
+    print(f"cache load and first lookup: {t_read * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmark ``starcheck.utils.proseco_probs_batch`` against the number of processes.
+
+This makes ``--n-obs`` acquisition catalogs with proseco at random attitudes
+(fixed seed), then gets the acq probabilities, P2 and expected acq stars for all
+of them with ``proseco_probs`` called serially (as starcheck did per obsid) and
+with ``proseco_probs_batch`` for each number of processes.  The batch results
+are checked to be identical to the serial ones.
+
+% python validate/bench_proseco_probs.py --n-obs 40 --n-processes 1 2 4 8
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from Quaternion import Quat
+
+from starcheck.utils import proseco_probs, proseco_probs_batch
+
+
+def get_opt(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark proseco_probs_batch")
+    parser.add_argument(
+        "--date", default="2023:140", help="Observation date (default=2023:140)"
+    )
+    parser.add_argument(
+        "--n-obs", default=40, type=int, help="Number of observations (default=40)"
+    )
+    parser.add_argument(
+        "--n-processes",
+        nargs="+",
+        type=int,
+        help="Numbers of processes (default=1, 2, 4, ... up to the available cores)",
+    )
+    parser.add_argument("--seed", default=1, type=int, help="Random seed")
+    opt = parser.parse_args(args)
+    return opt
+
+
+def get_obs_kwargs(date, n_obs, seed):
+    """Get proseco_probs keywords for acq catalogs at random attitudes"""
+    from proseco.catalog import get_aca_catalog
+
+    rng = np.random.default_rng(seed)
+    obs_kwargs = []
+    for ra, dec, roll in zip(
+        rng.uniform(0, 360, n_obs),
+        np.degrees(np.arcsin(rng.uniform(-1, 1, n_obs))),
+        rng.uniform(0, 360, n_obs),
+        strict=True,
+    ):
+        att = Quat([ra, dec, roll]).q.tolist()
+        aca = get_aca_catalog(
+            obsid=0,
+            att=att,
+            date=date,
+            n_fid=0,
+            n_guide=0,
+            man_angle=90,
+            t_ccd_acq=-10,
+            t_ccd_guide=-10,
+            dither_acq=(8, 8),
+            dither_guide=(8, 8),
+            detector="ACIS-S",
+            sim_offset=0,
+            focus_offset=0,
+        )
+        ids = [int(val) for val in aca.acqs["id"]]
+        obs_kwargs.append(
+            {
+                "obsid": len(obs_kwargs),
+                "att": att,
+                "date": date,
+                "n_acq": len(ids),
+                "man_angle": 90,
+                "t_ccd_acq": -10,
+                "t_ccd_guide": -10,
+                "dither_acq": [8, 8],
+                "dither_guide": [8, 8],
+                "include_ids_acq": ids,
+                "include_halfws_acq": [int(val) for val in aca.acqs["halfw"]],
+                "detector": "ACIS-S",
+                "sim_offset": 0,
+            }
+        )
+    return obs_kwargs
+
+
+def main(args=None):
+    opt = get_opt(args)
+    n_cores = (
+        len(os.sched_getaffinity(0))
+        if hasattr(os, "sched_getaffinity")
+        else os.cpu_count()
+    )
+    n_processes_list = opt.n_processes or [
+        2**idx for idx in range(int(np.log2(n_cores)) + 1)
+    ]
+
+    obs_kwargs = get_obs_kwargs(opt.date, opt.n_obs, opt.seed)
+
+    t0 = time.time()
+    exp = [list(proseco_probs(**kw)) for kw in obs_kwargs]
+    t_serial = time.time() - t0
+
+    print(f"date: {opt.date}  observations: {len(obs_kwargs)}  cores: {n_cores}")
+    print(f"serial proseco_probs: {t_serial:8.2f} s")
+    for n_processes in n_processes_list:
+        t0 = time.time()
+        out = proseco_probs_batch(obs_kwargs, n_processes=n_processes)
+        dt = time.time() - t0
+        if out != exp:
+            raise ValueError(f"results with {n_processes} processes do not match")
+        print(
+            f"batch {n_processes:3d} processes: {dt:8.2f} s"
+            f"  speedup: {t_serial / dt:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
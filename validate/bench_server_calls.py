@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmark per-call latency of the starcheck Python server.
+
+This starts ``python -m starcheck.server`` the same way starcheck.pl does and
+times the same command sent:
+
+- over TCP with a new connection per call (the original client behavior)
+- over one persistent TCP session (newline-delimited JSON)
+- over one persistent Unix domain socket session with length-prefixed JSON frames
+- over one persistent Unix domain socket session with MessagePack frames (if the
+  msgpack package is available)
+
+% python validate/bench_server_calls.py --n-calls 2000
+"""
+
+import argparse
+import json
+import secrets
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+HOST = "localhost"
+FRAME_HEADER = struct.Struct(">I")
+
+
+def get_opt(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark starcheck.server calls")
+    parser.add_argument(
+        "--n-calls", default=1000, type=int, help="Number of calls per mode"
+    )
+    parser.add_argument(
+        "--func",
+        default="get_server_calls",
+        help="Server function to call (default=get_server_calls)",
+    )
+    opt = parser.parse_args(args)
+    return opt
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(address, key, encoding="json"):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "starcheck.server", "--encoding", encoding],
+        stdin=subprocess.PIPE,
+    )
+    proc.stdin.write(f"{address}\n{key}\n0\n".encode())
+    proc.stdin.flush()
+    return proc
+
+
+def connect(address):
+    for _ in range(100):
+        try:
+            if isinstance(address, int):
+                return socket.create_connection((HOST, address))
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(address)
+            return sock
+        except (ConnectionRefusedError, FileNotFoundError):
+            time.sleep(0.1)
+    raise RuntimeError(f"unable to connect to server on {address}")
+
+
+def make_command(func, key, idx):
+    return {"func": func, "args": [], "kwargs": {}, "key": key, "id": idx}
+
+
+class LineClient:
+    """Newline-delimited JSON over TCP"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    def call(self, cmd):
+        self.sock.sendall((json.dumps(cmd) + "\n").encode())
+        return json.loads(self.rfile.readline())
+
+
+class FrameClient:
+    """Length-prefixed frames over a Unix domain socket"""
+
+    def __init__(self, sock, encoding):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        if encoding == "msgpack":
+            import msgpack
+
+            self.dumps = lambda obj: msgpack.packb(obj, use_bin_type=True)
+            self.loads = lambda data: msgpack.unpackb(data, raw=False)
+        else:
+            self.dumps = lambda obj: json.dumps(obj).encode()
+            self.loads = json.loads
+
+    def call(self, cmd):
+        data = self.dumps(cmd)
+        self.sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+        (size,) = FRAME_HEADER.unpack(self.rfile.read(FRAME_HEADER.size))
+        return self.loads(self.rfile.read(size))
+
+
+def time_per_call_socket(port, key, func, n_calls):
+    """Time calls that each open, use, and close one TCP connection"""
+    dts = []
+    for idx in range(n_calls):
+        t0 = time.perf_counter()
+        with connect(port) as sock:
+            LineClient(sock).call(make_command(func, key, idx))
+        dts.append(time.perf_counter() - t0)
+    return np.array(dts)
+
+
+def time_session(address, key, func, n_calls, encoding=None):
+    """Time calls sent over one persistent session"""
+    dts = []
+    with connect(address) as sock:
+        client = LineClient(sock) if encoding is None else FrameClient(sock, encoding)
+        for idx in range(n_calls):
+            t0 = time.perf_counter()
+            client.call(make_command(func, key, idx))
+            dts.append(time.perf_counter() - t0)
+    return np.array(dts)
+
+
+def bench_tcp(key, opt):
+    port = get_free_port()
+    proc = start_server(port, key)
+    try:
+        return {
+            "tcp per-call": time_per_call_socket(port, key, opt.func, opt.n_calls),
+            "tcp session": time_session(port, key, opt.func, opt.n_calls),
+        }
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def bench_unix(key, opt, encoding):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = str(Path(tmpdir) / "server.sock")
+        proc = start_server(path, key, encoding)
+        try:
+            return {
+                f"unix {encoding}": time_session(
+                    path, key, opt.func, opt.n_calls, encoding
+                )
+            }
+        finally:
+            proc.kill()
+            proc.wait()
+
+
+def main(args=None):
+    opt = get_opt(args)
+    key = secrets.token_hex(8)
+
+    results = bench_tcp(key, opt)
+    results.update(bench_unix(key, opt, "json"))
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        print("msgpack not available, skipping unix msgpack")
+    else:
+        results.update(bench_unix(key, opt, "msgpack"))
+
+    print(f"{opt.n_calls} calls of {opt.func}")
+    print(f"{'mode':>16s} {'mean':>9s} {'p50':>9s} {'p95':>9s}  (usec)")
+    for mode, dts in results.items():
+        usec = dts * 1e6
+        print(
+            f"{mode:>16s} {np.mean(usec):9.1f} {np.percentile(usec, 50):9.1f}"
+            f" {np.percentile(usec, 95):9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Validate the starcheck proseco probabilities against the original proseco call.
+
+For every observation with proseco args in the ``obsids.json`` files of starcheck
+outputs (e.g. the regression outputs from ``make regress``), get the acq star
+probabilities, P2 and expected acq stars with ``baseline_proseco_probs``, which
+is the ``proseco_probs`` of starcheck before the acq-only change (a full
+get_aca_catalog with proseco fetching its own stars).  Compare these with the
+values from ``starcheck.utils.proseco_probs_batch`` (the call starcheck makes for
+a load) and check that they match to within ``--tol``.
+
+% python validate/validate_proseco_probs.py --regress-dir test_regress/host_sha
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import Quaternion
+
+from starcheck.utils import proseco_probs_batch
+
+
+def get_opt(args=None):
+    parser = argparse.ArgumentParser(
+        description="Validate proseco_probs against the original proseco call"
+    )
+    parser.add_argument(
+        "--regress-dir",
+        default="test_regress",
+        help="Directory with starcheck outputs (searched for obsids.json)",
+    )
+    parser.add_argument(
+        "--tol", default=1e-6, type=float, help="Tolerance (default=1e-6)"
+    )
+    opt = parser.parse_args(args)
+    return opt
+
+
+def baseline_proseco_probs(**kw):
+    """proseco_probs as in starcheck before the acq-only catalog"""
+    from proseco.catalog import get_aca_catalog
+    from proseco.core import ACABox
+
+    args = {
+        "obsid": 0,
+        "att": Quaternion.normalize(kw["att"]),
+        "date": kw["date"],
+        "n_acq": kw["n_acq"],
+        "man_angle": kw["man_angle"],
+        "t_ccd_acq": kw["t_ccd_acq"],
+        "t_ccd_guide": kw["t_ccd_guide"],
+        "dither_acq": ACABox(kw["dither_acq"]),
+        "dither_guide": ACABox(kw["dither_guide"]),
+        "include_ids_acq": kw["include_ids_acq"],
+        "include_halfws_acq": kw["include_halfws_acq"],
+        "detector": kw["detector"],
+        "sim_offset": kw["sim_offset"],
+        "n_fid": 0,
+        "n_guide": 0,
+        "focus_offset": 0,
+    }
+    aca = get_aca_catalog(**args)
+    acq_cat = aca.acqs
+
+    # Assign the proseco probabilities back into an array.
+    p_acqs = [
+        float(acq_cat["p_acq"][acq_cat["id"] == acq_id][0])
+        for acq_id in kw["include_ids_acq"]
+    ]
+
+    return p_acqs, float(-np.log10(acq_cat.calc_p_safe())), float(np.sum(p_acqs))
+
+
+def get_obs_kwargs(obsids_file):
+    """Get the proseco_probs keywords for the observations in ``obsids_file``"""
+    return [
+        obs["proseco_args"]
+        for obs in json.loads(Path(obsids_file).read_text())
+        if obs.get("proseco_args")
+    ]
+
+
+def main(args=None):
+    opt = get_opt(args)
+    obsids_files = sorted(Path(opt.regress_dir).rglob("obsids.json"))
+    if not obsids_files:
+        raise ValueError(f"no obsids.json files in {opt.regress_dir}")
+
+    max_diffs = np.zeros(3)
+    n_obs = 0
+    for obsids_file in obsids_files:
+        obs_kwargs = get_obs_kwargs(obsids_file)
+        outs = proseco_probs_batch(obs_kwargs)
+        for kwargs, out in zip(obs_kwargs, outs, strict=True):
+            exp = baseline_proseco_probs(**kwargs)
+            diffs = np.array(
+                [
+                    np.max(np.abs(np.array(out[0]) - exp[0]), initial=0),
+                    abs(out[1] - exp[1]),
+                    abs(out[2] - exp[2]),
+                ]
+            )
+            if np.any(diffs > opt.tol):
+                raise ValueError(
+                    f"{obsids_file} obsid {kwargs['obsid']}: proseco_probs {out}"
+                    f" does not match baseline {exp}"
+                )
+            max_diffs = np.maximum(max_diffs, diffs)
+            n_obs += 1
+
+    print(f"{len(obsids_files)} loads, {n_obs} observations match to {opt.tol}")
+    print(
+        "max abs differences: p_acq {:.2g}  P2 {:.2g}  expected {:.2g}".format(
+            *max_diffs
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()